@@ -1,9 +1,9 @@
+import asyncio
 import os
 import random
 from datetime import datetime, timedelta
 from typing import Optional
 
-import pymongo
 import pytz
 from babel.dates import format_date, get_date_format
 from interactions import (
@@ -19,7 +19,6 @@ from interactions import (
     Task,
     TimeTrigger,
     Member,
-    User,
     listen,
     slash_command,
     slash_option,
@@ -27,22 +26,39 @@ from interactions import (
 from interactions.ext import paginators
 
 from src import logutil
+from src.birthdays import next_birthday
+from src.mongodb import get_database
 from src.utils import load_config
 
 logger = logutil.init_logger(os.path.basename(__file__))
 config, module_config, enabled_servers = load_config("moduleBirthday")
 
+# Number of birthdays on each page of /anniversaire liste
+PAGE_SIZE = 25
+
 
 class BirthdayClass(Extension):
     def __init__(self, bot):
         self.bot: Client = bot
-        # Database connection
-        client = pymongo.MongoClient(config["mongodb"]["url"])
-        db = client["Playlist"]
-        self.collection = db["birthday"]
+        self.collection = get_database("Playlist")["birthday"]
+        # Birthdays of each guild sorted by day, as listed by /anniversaire liste
+        self.listings: dict[int, list[dict]] = {}
 
     @listen()
     async def on_startup(self):
+        # The checks only look at the birthdays starting or ending
+        await self.collection.create_index([("isBirthday", 1), ("next_start", 1)])
+        await self.collection.create_index([("isBirthday", 1), ("next_end", 1)])
+        # Birthdays added before the instants were stored
+        async for birthday in self.collection.find({"next_start": {"$exists": False}}):
+            next_start, next_end = next_birthday(birthday["date"], birthday["timezone"])
+            if birthday.get("isBirthday") and next_start > datetime.utcnow():
+                # Marked on a day that is over, ended by the next check
+                next_end = datetime.utcnow()
+            await self.collection.update_one(
+                {"_id": birthday["_id"]},
+                {"$set": {"next_start": next_start, "next_end": next_end}},
+            )
         self.anniversaire_check.start()
 
     @slash_command(
@@ -91,18 +107,21 @@ class BirthdayClass(Extension):
             await ctx.send("Fuseau horaire invalide", ephemeral=True)
             return
         timezone = pytz.timezone(timezone)
+        next_start, next_end = next_birthday(date, timezone.zone)
         # Check if already in database
-        if self.collection.find_one({"user": ctx.author.id, "server": ctx.guild.id}):
-            self.collection.update_one(
+        existing = await self.collection.find_one(
+            {"user": ctx.author.id, "server": ctx.guild.id}
+        )
+        if existing:
+            update = {"date": date, "timezone": timezone.zone, "hideyear": hideyear}
+            # A birthday in progress ends as planned, the next one uses the new date
+            if not existing.get("isBirthday"):
+                update.update(next_start=next_start, next_end=next_end)
+            await self.collection.update_one(
                 {"user": ctx.author.id, "server": ctx.guild.id},
-                {
-                    "$set": {
-                        "date": date,
-                        "timezone": timezone.zone,
-                        "hideyear": hideyear,
-                    }
-                },
+                {"$set": update},
             )
+            self.listings.pop(ctx.guild.id, None)
             await ctx.send("Anniversaire mis à jour", ephemeral=True)
             logger.info(
                 "Anniversaire de %s mis à jour sur le serveur %s (%s)",
@@ -112,7 +131,7 @@ class BirthdayClass(Extension):
             )
             return
         # Add to database
-        self.collection.insert_one(
+        await self.collection.insert_one(
             {
                 "user": ctx.author.id,
                 "server": ctx.guild.id,
@@ -120,8 +139,11 @@ class BirthdayClass(Extension):
                 "timezone": timezone.zone,
                 "hideyear": hideyear,
                 "isBirthday": False,
+                "next_start": next_start,
+                "next_end": next_end,
             }
         )
+        self.listings.pop(ctx.guild.id, None)
         logger.info(
             "Anniversaire de %s ajouté sur le serveur %s (%s)",
             ctx.author.display_name,
@@ -158,7 +180,10 @@ class BirthdayClass(Extension):
     )
     async def anniversaire_supprimer(self, ctx: SlashContext):
         # Remove from database
-        self.collection.delete_one({"user": ctx.author.id, "server": ctx.guild.id})
+        await self.collection.delete_one(
+            {"user": ctx.author.id, "server": ctx.guild.id}
+        )
+        self.listings.pop(ctx.guild.id, None)
         await ctx.send("Anniversaire supprimé", ephemeral=True)
 
     @anniversaire.subcommand(
@@ -167,7 +192,8 @@ class BirthdayClass(Extension):
     )
     async def anniversaire_purge(self, ctx: SlashContext):
         # Remove from database
-        self.collection.delete_many({"user": ctx.author.id})
+        await self.collection.delete_many({"user": ctx.author.id})
+        self.listings.clear()
         await ctx.send("Anniversaire supprimé sur tous les serveurs", ephemeral=True)
 
     @anniversaire.subcommand(
@@ -175,160 +201,204 @@ class BirthdayClass(Extension):
         sub_cmd_description="Liste des anniversaires",
     )
     async def anniversaire_liste(self, ctx: SlashContext):
-        # Get all birthdays
-        birthdays = self.collection.find({"server": ctx.guild.id})
+        birthdays = await self.get_listing(ctx.guild.id)
         # Get locale
         locale = module_config[str(ctx.guild.id)].get("birthdayGuildLocale", "en_US")
         date_format = str(get_date_format("long", locale=locale))
         # remove the year from the date format
         date_format = date_format.replace("y", "").strip()
-
-        # Create embed
-        i = 0
-        embeds = []
-        embed = Embed(
-            title="Anniversaires",
-            description="Liste des anniversaires",
-            color=0x00FF00,
-        )
-        birthday_list = ""
-        # Sort by date without taking the year into account
-        birthdays = sorted(
-            birthdays,
-            key=lambda x: x["date"].replace(year=2000),
-        )
-        for birthday in birthdays:
-            date: datetime = birthday["date"]
-            user: User = await self.bot.fetch_user(birthday["user"])
-            hideyear: bool = birthday.get("hideyear", False)
-            if hideyear:
-                birthday_list += f"**{user.mention}** : {format_date(date,date_format, locale=locale)}\n"
-            else:
-                birthday_list += f"**{user.mention}** : {format_date(date,date_format, locale=locale)} ({datetime.now().year - date.year} ans)\n"
-            if i % 25 == 0 and i != 0:
-                embed.description = birthday_list
-                embeds.append(embed)
-                embed = Embed(
-                    title="Anniversaires",
-                    description="",
-                    color=0x00FF00,
-                )
-                birthday_list = ""
-            i += 1
-        embed.description = birthday_list
-        embeds.append(embed)
-        paginator = CustomPaginator.create_from_embeds(self.bot, *embeds, timeout=3600)
+        pages = [
+            BirthdayPage(birthdays[i : i + PAGE_SIZE], date_format, locale)
+            for i in range(0, max(len(birthdays), 1), PAGE_SIZE)
+        ]
+        paginator = CustomPaginator(self.bot, pages=pages, timeout_interval=3600)
         await paginator.send(ctx)
 
+    async def get_listing(self, guild_id: int) -> list[dict]:
+        """
+        Returns the birthdays of a guild sorted by day, regardless of the year.
+
+        The list is cached until a birthday of the guild is added, changed or removed.
+
+        Args:
+            guild_id (int): The ID of the guild.
+        """
+        if guild_id not in self.listings:
+            birthdays = await self.collection.find(
+                {"server": guild_id}, {"_id": 0, "user": 1, "date": 1, "hideyear": 1}
+            ).to_list(length=None)
+            # Sort by date without taking the year into account
+            birthdays.sort(key=lambda x: (x["date"].month, x["date"].day))
+            self.listings[guild_id] = birthdays
+        return self.listings[guild_id]
+
     @Task.create(OrTrigger(*[TimeTrigger(i, j) for i in range(24) for j in [0, 30]]))
     # @Task.create(TimeTrigger(0, 14, 10, utc=False))
     async def anniversaire_check(self):
-        # Get today's date
-        today = datetime.now(pytz.UTC).replace(second=0, microsecond=0)
-        # Get all birthdays
-        birthdays = self.collection.find()
-        for birthday in birthdays:
-            date: datetime = birthday["date"]
-            timezone = pytz.timezone(birthday["timezone"])
-            date = timezone.localize(date)
-            logger.debug(
-                "debug\nnow as birthday tz: %s\ndate as birthday tz: %s",
-                today.astimezone(timezone),
-                date.replace(year=today.year),
-            )
-            if (
-                today.astimezone(timezone).date()
-                == date.replace(year=today.year).date()
-            ):
-                # Check if birthday is already marked as birthday
-                logger.debug("It's %s's birthday", birthday["user"])
-                if birthday["isBirthday"]:
-                    logger.debug(
-                        "Birthday already marked as birthday for %s", birthday["user"]
-                    )
-                    continue
-                # Mark as birthday
-                self.collection.update_one(
-                    {"user": birthday["user"], "server": birthday["server"]},
-                    {"$set": {"isBirthday": True}},
-                )
-                # Get server
-                server = await self.bot.fetch_guild(birthday["server"])
-                # Get member
-                member = await server.fetch_member(birthday["user"])
-                # Get channel
-                channel = module_config[str(birthday["server"])].get(
-                    "birthdayChannelId", None
-                )
-                if channel:
-                    channel = await server.fetch_channel(channel)
-                else:
-                    channel = server.system_channel
-                # Get personnalised message
-                messages = module_config[str(birthday["server"])].get(
-                    "birthdayMessageList", ["Joyeux anniversaire {mention} ! 🎉"]
-                )
-                weights = module_config[str(birthday["server"])].get(
-                    "birthdayMessageWeights", len(messages) * [1]
-                )
-                message = (
-                    random.choices(messages, weights)[0]
-                )
-                # Send message
-                message = message.format(mention=member.mention, age=today.year - date.year)
-                logger.info(
-                    "C'est l'anniversaire de %s sur le serveur %s (%s ans)",
-                    member.display_name,
-                    server.name,
-                    today.year - date.year,
-                )
-                await channel.send(message)
-                # Give role if defined
-                role = module_config[str(birthday["server"])].get(
-                    "birthdayRoleId", None
-                )
-                if role:
-                    role = await server.fetch_role(role)
-                    await member.add_role(role)
-                    logger.info(
-                        "Rôle %s donné à %s sur le serveur %s",
-                        role.name,
-                        member.display_name,
-                        server.name,
-                    )
-            else:
-                # Check if birthday is already marked as not birthday
-                if not birthday.get("isBirthday", True):
-                    continue
-                # Mark as not birthday
-                self.collection.update_one(
-                    {"user": birthday["user"], "server": birthday["server"]},
-                    {"$set": {"isBirthday": False}},
+        now = datetime.now(pytz.UTC).replace(second=0, microsecond=0)
+        # MongoDB compares naive datetimes as UTC
+        naive_now = now.replace(tzinfo=None)
+        # Only the birthdays starting or ending, thanks to the indexes
+        due = await self.collection.find(
+            {
+                "$or": [
+                    {"isBirthday": False, "next_start": {"$lte": naive_now}},
+                    {"isBirthday": True, "next_end": {"$lte": naive_now}},
+                ]
+            }
+        ).to_list(length=None)
+        results = await asyncio.gather(
+            *[
+                self.end_birthday(birthday, now)
+                if birthday["isBirthday"] or birthday["next_end"] <= naive_now
+                else self.start_birthday(birthday, now)
+                for birthday in due
+            ],
+            return_exceptions=True,
+        )
+        for birthday, result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Anniversaire de %s sur le serveur %s non traité",
+                    birthday["user"],
+                    birthday["server"],
+                    exc_info=result,
                 )
 
-                # Get server
-                server = await self.bot.fetch_guild(birthday["server"])
-                # Get member
-                member = await server.fetch_member(birthday["user"])
+    async def start_birthday(self, birthday: dict, now: datetime):
+        """
+        Wishes a happy birthday and gives the birthday role, if any.
+
+        Args:
+            birthday (dict): The birthday document, whose next_start is due.
+            now (datetime): The time of the check, in UTC.
+        """
+        date: datetime = birthday["date"]
+        age = now.astimezone(pytz.timezone(birthday["timezone"])).year - date.year
+        # Mark as birthday, unless another check already did
+        result = await self.collection.update_one(
+            {"_id": birthday["_id"], "isBirthday": False},
+            {"$set": {"isBirthday": True}},
+        )
+        if result.modified_count == 0:
+            return
+        # Get server
+        server = await self.bot.fetch_guild(birthday["server"])
+        # Get member
+        member = await server.fetch_member(birthday["user"])
+        # Get channel
+        channel = module_config[str(birthday["server"])].get("birthdayChannelId", None)
+        if channel:
+            channel = await server.fetch_channel(channel)
+        else:
+            channel = server.system_channel
+        # Get personnalised message
+        messages = module_config[str(birthday["server"])].get(
+            "birthdayMessageList", ["Joyeux anniversaire {mention} ! 🎉"]
+        )
+        weights = module_config[str(birthday["server"])].get(
+            "birthdayMessageWeights", len(messages) * [1]
+        )
+        message = random.choices(messages, weights)[0]
+        # Send message
+        message = message.format(mention=member.mention, age=age)
+        logger.info(
+            "C'est l'anniversaire de %s sur le serveur %s (%s ans)",
+            member.display_name,
+            server.name,
+            age,
+        )
+        await channel.send(message)
+        # Give role if defined
+        role = module_config[str(birthday["server"])].get("birthdayRoleId", None)
+        if role:
+            role = await server.fetch_role(role)
+            await member.add_role(role)
+            logger.info(
+                "Rôle %s donné à %s sur le serveur %s",
+                role.name,
+                member.display_name,
+                server.name,
+            )
+
+    async def end_birthday(self, birthday: dict, now: datetime):
+        """
+        Removes the birthday role, if any, and moves the birthday to next year.
+
+        Also moves a birthday that passed entirely while the bot was down.
+
+        Args:
+            birthday (dict): The birthday document, whose next_end is due.
+            now (datetime): The time of the check, in UTC.
+        """
+        next_start, next_end = next_birthday(
+            birthday["date"], birthday["timezone"], now
+        )
+        await self.collection.update_one(
+            {"_id": birthday["_id"]},
+            {
+                "$set": {
+                    "isBirthday": False,
+                    "next_start": next_start,
+                    "next_end": next_end,
+                }
+            },
+        )
+        if not birthday["isBirthday"]:
+            return
+        # Get server
+        server = await self.bot.fetch_guild(birthday["server"])
+        # Get member
+        member = await server.fetch_member(birthday["user"])
+        logger.info(
+            "Ce n'est plus l'anniversaire de %s sur le serveur %s",
+            member.display_name,
+            server.name,
+        )
+        # Get role
+        role = module_config[str(birthday["server"])].get("birthdayRoleId", None)
+        if role:
+            role = await server.fetch_role(role)
+            if role in member.roles:
+                await member.remove_role(role)
                 logger.info(
-                    "Ce n'est plus l'anniversaire de %s sur le serveur %s",
+                    "Rôle %s retiré à %s sur le serveur %s",
+                    role.name,
                     member.display_name,
                     server.name,
                 )
-                # Get role
-                role = module_config[str(birthday["server"])].get(
-                    "birthdayRoleId", None
-                )
-                if role:
-                    role = await server.fetch_role(role)
-                    if role in member.roles:
-                        await member.remove_role(role)
-                        logger.info(
-                            "Rôle %s retiré à %s sur le serveur %s",
-                            role.name,
-                            member.display_name,
-                            server.name,
-                        )
+
+
+class BirthdayPage(paginators.Page):
+    """
+    A page of /anniversaire liste, only rendered when it is shown.
+
+    The users are mentioned by ID, which Discord resolves itself, so rendering a
+    page does not fetch anything.
+
+    Args:
+        birthdays (list[dict]): The birthdays of the page.
+        date_format (str): The babel format of the dates, without the year.
+        locale (str): The locale of the guild.
+    """
+
+    def __init__(self, birthdays: list[dict], date_format: str, locale: str):
+        super().__init__("", "Anniversaires")
+        self.birthdays = birthdays
+        self.date_format = date_format
+        self.locale = locale
+
+    def to_embed(self) -> Embed:
+        if not self.content:
+            lines = []
+            for birthday in self.birthdays:
+                date: datetime = birthday["date"]
+                line = f"**<@{birthday['user']}>** : {format_date(date, self.date_format, locale=self.locale)}"
+                if not birthday.get("hideyear", False):
+                    line += f" ({datetime.now().year - date.year} ans)"
+                lines.append(line)
+            self.content = "\n".join(lines) or "Aucun anniversaire"
+        return Embed(title=self.title, description=self.content, color=0x00FF00)
 
 
 class CustomPaginator(paginators.Paginator):
@@ -2,7 +2,6 @@ import json
 import os
 import pytz
 from datetime import datetime, timedelta
-from aiohttp import ClientSession
 from interactions import (
     ActionRow,
     BaseChannel,
@@ -10,7 +9,6 @@ from interactions import (
     ButtonStyle,
     Extension,
     Embed,
-    IntervalTrigger,
     Message,
     OptionType,
     SlashContext,
@@ -24,6 +22,7 @@ from interactions import (
 )
 from interactions.api.events import Component
 from src import logutil
+from src.timers import TIME_FORMAT, get_timers
 from src.utils import load_config, fetch
 
 logger = logutil.init_logger(os.path.basename(__file__))
@@ -33,8 +32,10 @@ config, module_config, enabled_servers = load_config("moduleColoc")
 # Server specific module
 module_config = module_config[enabled_servers[0]]
 
-# Keep track of reminders
-reminders = {}
+# Kind of the timers reminding to /journa
+JOURNA_REMINDER = "journa_reminder"
+
+
 class ColocClass(Extension):
     def __init__(self, bot: Client):
         self.bot: Client = bot
@@ -42,8 +43,10 @@ class ColocClass(Extension):
     @listen()
     async def on_startup(self):
         self.journa.start()
-        await self.load_reminders()
-        self.check_reminders.start()
+        await self.migrate_reminders()
+        timers = get_timers()
+        timers.register(JOURNA_REMINDER, self.send_reminder)
+        timers.start()
         self.corpo_recap.start()
 
     @slash_command(name="fesse", description="Fesses", scopes=enabled_servers)
@@ -90,32 +93,27 @@ class ColocClass(Extension):
         )
 
     # Zunivers API
-    async def load_reminders(self):
+    async def migrate_reminders(self):
         """
-        Load reminders from a JSON file and populate the reminders dictionary.
+        Moves the reminders of the former JSON file to the timer service, once.
         """
+        path = f"{config['misc']['dataFolder']}/journa.json"
         try:
-            with open(
-                f"{config['misc']['dataFolder']}/journa.json", "r", encoding="utf-8"
-            ) as file:
+            with open(path, "r", encoding="utf-8") as file:
                 reminders_data = json.load(file)
-                for remind_time_str, user_ids in reminders_data.items():
-                    remind_time = datetime.strptime(
-                        remind_time_str, "%Y-%m-%d %H:%M:%S"
-                    )
-                    reminders[remind_time] = set(user_ids)
         except FileNotFoundError:
-            pass
-
-    async def save_reminders(self):
-        reminders_data = {
-            remind_time.strftime("%Y-%m-%d %H:%M:%S"): list(user_ids)
-            for remind_time, user_ids in reminders.items()
-        }
-        with open(
-            f"{config['misc']['dataFolder']}/journa.json", "w", encoding="utf-8"
-        ) as file:
-            json.dump(reminders_data, file, indent=4)
+            return
+        for remind_time_str, user_ids in reminders_data.items():
+            remind_time = datetime.strptime(remind_time_str, TIME_FORMAT)
+            for user_id in user_ids:
+                await get_timers().schedule(
+                    JOURNA_REMINDER,
+                    remind_time,
+                    {"user_id": str(user_id)},
+                    every="daily",
+                )
+        os.replace(path, f"{path}.migrated")
+        logger.info("Rappels /journa déplacés vers le service de minuteurs")
 
     # Set reminder to /journa
     @slash_command(
@@ -152,10 +150,12 @@ class ColocClass(Extension):
         )
         if remind_time <= current_time:
             remind_time += timedelta(days=1)
-        if remind_time not in reminders:
-            reminders[remind_time] = set()
-        reminders[remind_time].add(ctx.user.id)
-        await self.save_reminders()
+        await get_timers().schedule(
+            JOURNA_REMINDER,
+            remind_time,
+            {"user_id": str(ctx.user.id)},
+            every="daily",
+        )
         await ctx.send(
             f"Rappel défini à {remind_time.strftime('%H:%M')}.", ephemeral=True
         )
@@ -166,20 +166,18 @@ class ColocClass(Extension):
         sub_cmd_description="Supprime un rappel pour /journa",
     )
     async def deletereminder(self, ctx: SlashContext):
-        user_id = ctx.user.id
         # create the list of reminders for the user
-        reminders_list = []
-        for remind_time, user_ids in reminders.copy().items():
-            if user_id in user_ids:
-                reminders_list.append(remind_time)
+        reminders_list = await get_timers().find(
+            JOURNA_REMINDER, user_id=str(ctx.user.id)
+        )
         # Create a button for each reminder
         buttons = [
             Button(
-                label=remind_time.strftime("%H:%M"),
+                label=datetime.strptime(timer["due"], TIME_FORMAT).strftime("%H:%M"),
                 style=ButtonStyle.SECONDARY,
-                custom_id=str(remind_time.timestamp()),
+                custom_id=timer_id,
             )
-            for remind_time in reminders_list
+            for timer_id, timer in reminders_list
         ]
         # Send a message with the buttons
         message = await ctx.send(
@@ -190,18 +188,14 @@ class ColocClass(Extension):
         try:
             # Wait for the user to click a button
             button_ctx: Component = await self.bot.wait_for_component(
-                components=[
-                    str(remind_time.timestamp()) for remind_time in reminders_list
-                ],
+                components=[timer_id for timer_id, _ in reminders_list],
                 timeout=60,
             )
-            # Remove the reminder from the reminders dictionary
-            remind_time = datetime.fromtimestamp(float(button_ctx.ctx.custom_id))
-            reminders[remind_time].remove(user_id)
-            if not reminders[remind_time]:
-                del reminders[remind_time]
-            # Save the reminders to a JSON file
-            await self.save_reminders()
+            # Remove the reminder from the timers
+            remind_time = datetime.strptime(
+                dict(reminders_list)[button_ctx.ctx.custom_id]["due"], TIME_FORMAT
+            )
+            await get_timers().cancel(button_ctx.ctx.custom_id)
             # Send a message to the user indicating that the reminder has been removed
             await button_ctx.ctx.edit_origin(
                 content=f"Rappel à {remind_time.strftime('%H:%M')} supprimé.",
@@ -218,43 +212,30 @@ class ColocClass(Extension):
             )
             await message.edit(content="Aucun rappel sélectionné.", components=[])
 
-    @Task.create(IntervalTrigger(minutes=1))
-    async def check_reminders(self):
+    async def send_reminder(self, timer: dict):
+        """
+        Reminds a user to /journa if they did not yet, called by the timer service.
+        """
         current_time = datetime.now()
-        reminders_to_remove = []
-        async with ClientSession() as session:
-            for remind_time, user_ids in reminders.copy().items():
-                if remind_time <= current_time:
-                    for user_id in user_ids.copy():
-                        user: User = await self.bot.fetch_user(user_id)
-                        # Check if the user did /journa today
-                        response = await fetch(
-                            f"https://zunivers-api.zerator.com/public/loot/{user.username}",
-                            "json",
-                        )
-                        for day in response["lootInfos"]:
-                            if day["date"] == current_time.strftime("%Y-%m-%d"):
-                                if day["count"] == 0:
-                                    await user.send(
-                                        "Tu n'as pas encore /journa aujourd'hui, n'oublie pas !\nhttps://discord.com/channels/138283154589876224/808432657838768168"
-                                    )
-                                    logger.info("Rappel envoyé à %s", user.display_name)
-                                else:
-                                    logger.info(
-                                        "Pas de rappel pour %s, /journa déjà fait aujourd'hui.",
-                                        user.display_name,
-                                    )
-                        next_remind_time = remind_time + timedelta(days=1)
-                        if next_remind_time not in reminders:
-                            reminders[next_remind_time] = set()
-                        reminders[next_remind_time].add(user_id)
-                        user_ids.remove(user_id)
-                    if not user_ids:
-                        reminders_to_remove.append(remind_time)
-        for remind_time in reminders_to_remove:
-            del reminders[remind_time]
-        await self.save_reminders()
-        
+        user: User = await self.bot.fetch_user(timer["data"]["user_id"])
+        # Check if the user did /journa today
+        response = await fetch(
+            f"https://zunivers-api.zerator.com/public/loot/{user.username}",
+            "json",
+        )
+        for day in response["lootInfos"]:
+            if day["date"] == current_time.strftime("%Y-%m-%d"):
+                if day["count"] == 0:
+                    await user.send(
+                        "Tu n'as pas encore /journa aujourd'hui, n'oublie pas !\nhttps://discord.com/channels/138283154589876224/808432657838768168"
+                    )
+                    logger.info("Rappel envoyé à %s", user.display_name)
+                else:
+                    logger.info(
+                        "Pas de rappel pour %s, /journa déjà fait aujourd'hui.",
+                        user.display_name,
+                    )
+
     @Task.create(TimeTrigger(23, 59, 45, utc=False))
     async def corpo_recap(self, date=None):
         bonuses_type_dict = {
@@ -10,6 +10,7 @@ from interactions import (
 )
 from interactions.client.utils import timestamp_converter
 from src import logutil
+from src.configstore import config_store
 from src.raiderio import get_table_data, ensure_six_elements
 from src.utils import load_config, fetch
 from datetime import datetime, timedelta
@@ -26,9 +27,10 @@ class Liquipedia(Extension):
         self.bot: Client = bot
         self.message = None
         self.wow_message = None
+        # Follow the pinned messages when they are changed in the config
+        config_store.subscribe("moduleLiquipedia", self.on_config_reload)
 
-    @listen()
-    async def on_startup(self):
+    async def load_messages(self):
         channel_id = module_config["liquipediaChannelId"]
         message_id = module_config["liquipediaMessageId"]
         wow_channel_id = module_config["liquipediaWowChannelId"]
@@ -37,6 +39,14 @@ class Liquipedia(Extension):
         self.message = await channel.fetch_message(message_id)
         channel = await self.bot.fetch_channel(wow_channel_id)
         self.wow_message = await channel.fetch_message(wow_message_id)
+
+    async def on_config_reload(self, *_):
+        if self.message is not None:
+            await self.load_messages()
+
+    @listen()
+    async def on_startup(self):
+        await self.load_messages()
         self.schedule.start()
         self.mdi_schedule.start()
         await self.mdi_schedule()
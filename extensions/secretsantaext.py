@@ -1,15 +1,15 @@
-import json
 import os
 import random
-from typing import Dict, List, Optional, Tuple
+from typing import List, Optional, Tuple
 
 from interactions import (
     Extension, Client, BrandColors, PartialEmoji, Embed, OptionType, 
-    SlashContext, slash_command, slash_option, Message, Member
+    SlashContext, slash_command, slash_option, Message, Member, listen
 )
 from interactions.client.utils import get
 
 from src import logutil
+from src.statestore import get_state_store
 from src.utils import load_config
 
 logger = logutil.init_logger(__name__)
@@ -18,6 +18,9 @@ config, module_config, enabled_servers = load_config("moduleSecretSanta")
 SECRET_SANTA_FILE = config["SecretSanta"]["secretSantaFile"]
 SECRET_SANTA_KEY = config["SecretSanta"]["secretSantaKey"]
 DRAW_RESULTS_FILE = config["SecretSanta"].get("drawResultsFile", "data/secret_santa_draw_results.json")
+# Message of the running Secret Santa and results of the draw, per guild
+NAMESPACE = "secretsanta"
+DRAWS_NAMESPACE = "secretsanta_draws"
 
 discord2name = config["discord2name"]
 
@@ -25,6 +28,16 @@ class SecretSanta(Extension):
     def __init__(self, bot):
         self.bot: Client = bot
 
+    @listen()
+    async def on_startup(self):
+        store = get_state_store()
+        await store.migrate_json(
+            NAMESPACE,
+            SECRET_SANTA_FILE,
+            select=lambda data: data.get(SECRET_SANTA_KEY, {}),
+        )
+        await store.migrate_json(DRAWS_NAMESPACE, DRAW_RESULTS_FILE)
+
     def create_embed(self, message: str) -> Embed:
         return Embed(
             title="Père Noël Secret",
@@ -32,38 +45,18 @@ class SecretSanta(Extension):
             color=BrandColors.RED,
         )
 
-    def read_secret_santa_data(self) -> Dict[str, int]:
-        try:
-            with open(SECRET_SANTA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get(SECRET_SANTA_KEY, {})
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-
-    def write_secret_santa_data(self, data: Dict[str, int]) -> None:
-        with open(SECRET_SANTA_FILE, "w", encoding="utf-8") as f:
-            json.dump({SECRET_SANTA_KEY: data}, f)
-        logger.info(f"Secret Santa data updated: {data}")
-
-    def update_secret_santa_data(self, guild_id: int, message_id: Optional[int] = None) -> None:
-        data = self.read_secret_santa_data()
+    async def get_secret_santa_message(self, guild_id: int) -> Optional[int]:
+        return await get_state_store().get(NAMESPACE, str(guild_id))
+
+    async def update_secret_santa_data(self, guild_id: int, message_id: Optional[int] = None) -> None:
         if message_id is None:
-            data.pop(str(guild_id), None)
+            await get_state_store().delete(NAMESPACE, str(guild_id))
         else:
-            data[str(guild_id)] = message_id
-        self.write_secret_santa_data(data)
+            await get_state_store().set(NAMESPACE, str(guild_id), message_id)
+        logger.info(f"Secret Santa data updated: {guild_id} -> {message_id}")
 
-    def save_draw_results(self, guild_id: int, results: List[Tuple[int, int]]) -> None:
-        try:
-            with open(DRAW_RESULTS_FILE, "r+", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
-
-        data[str(guild_id)] = results
-        
-        with open(DRAW_RESULTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
+    async def save_draw_results(self, guild_id: int, results: List[Tuple[int, int]]) -> None:
+        await get_state_store().set(DRAWS_NAMESPACE, str(guild_id), results)
         logger.info(f"Draw results saved for guild {guild_id}")
 
     async def fetch_message(self, ctx: SlashContext, message_id: int) -> Optional[Message]:
@@ -76,7 +69,7 @@ class SecretSanta(Extension):
                     "Il n'y a pas de Père Noël Secret en cours !\n(Le message n'a pas été trouvé)"
                 )
             )
-            self.update_secret_santa_data(ctx.guild.id)
+            await self.update_secret_santa_data(ctx.guild.id)
             return None
 
     @slash_command(
@@ -93,8 +86,7 @@ class SecretSanta(Extension):
         opt_type=OptionType.STRING,
     )
     async def secret_santa(self, ctx: SlashContext, infos: Optional[str] = None) -> None:
-        data = self.read_secret_santa_data()
-        if str(ctx.guild.id) in data:
+        if await self.get_secret_santa_message(ctx.guild.id) is not None:
             await ctx.send(
                 "Le Père Noël Secret est déjà en cours ! :santa:", ephemeral=True
             )
@@ -110,7 +102,7 @@ class SecretSanta(Extension):
         )
         message = await ctx.channel.send(content="@everyone", embed=embed)
         await message.add_reaction(":santa:")
-        self.update_secret_santa_data(ctx.guild.id, message.id)
+        await self.update_secret_santa_data(ctx.guild.id, message.id)
         await ctx.send("Le Père Noël Secret a été créé ! :santa:", ephemeral=True)
 
     @secret_santa.subcommand(
@@ -120,8 +112,7 @@ class SecretSanta(Extension):
     async def secret_santa_draw(self, ctx: SlashContext) -> None:
         await ctx.defer()
         
-        data = self.read_secret_santa_data()
-        message_id = data.get(str(ctx.guild.id))
+        message_id = await self.get_secret_santa_message(ctx.guild.id)
         if not message_id:
             await ctx.send(
                 embed=self.create_embed(
@@ -165,8 +156,8 @@ class SecretSanta(Extension):
                 logger.error(f"Failed to send DM to {giver.username}: {e}")
                 await ctx.send(f"Impossible d'envoyer un message privé à {giver.mention}. Assurez-vous que vos DMs sont ouverts.", ephemeral=True)
 
-        self.save_draw_results(ctx.guild.id, draw_results)
-        self.update_secret_santa_data(ctx.guild.id)
+        await self.save_draw_results(ctx.guild.id, draw_results)
+        await self.update_secret_santa_data(ctx.guild.id)
 
         participants = ", ".join(user.mention for user in sorted(users, key=lambda u: u.id))
         embed = self.create_embed(
@@ -183,8 +174,7 @@ class SecretSanta(Extension):
         sub_cmd_description="Annule le Père Noël Secret",
     )
     async def secret_santa_cancel(self, ctx: SlashContext) -> None:
-        data = self.read_secret_santa_data()
-        message_id = data.get(str(ctx.guild.id))
+        message_id = await self.get_secret_santa_message(ctx.guild.id)
         if not message_id:
             await ctx.send(
                 embed=self.create_embed(
@@ -202,7 +192,7 @@ class SecretSanta(Extension):
             embed=self.create_embed("Le Père Noël Secret a été annulé !")
         )
         await message.clear_reactions()
-        self.update_secret_santa_data(ctx.guild.id)
+        await self.update_secret_santa_data(ctx.guild.id)
         await ctx.send(
             embed=self.create_embed("Le Père Noël Secret a été annulé !"),
             ephemeral=True,
@@ -219,14 +209,11 @@ class SecretSanta(Extension):
         opt_type=OptionType.USER,
     )
     async def check_draw(self, ctx: SlashContext, user: Member) -> None:
-        try:
-            with open(DRAW_RESULTS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+        guild_results = await get_state_store().get(DRAWS_NAMESPACE, str(ctx.guild.id))
+        if guild_results is None:
             await ctx.send("Aucun résultat de tirage n'a été enregistré.", ephemeral=True)
             return
 
-        guild_results = data.get(str(ctx.guild.id), [])
         for giver_id, receiver_id in guild_results:
             if giver_id == user.id:
                 receiver = await self.bot.fetch_user(receiver_id)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import random
@@ -13,117 +14,384 @@ from interactions.api.events import Component
 
 from dict import finishList, startList
 from src import logutil
+from src.httpclient import get_session
+from src.mongodb import get_database
+from src.playlist import VOTE_OPTIONS, PlaylistIndex, PlaylistMirror, SongVote
+from src.playliststats import PlaylistStats, keep_ratio
+from src.scheduler import SyncScheduler
+from src.statestore import StateStore, get_state_store
+from src.timers import TIME_FORMAT, get_timers
 from src.spotify import (
+    AsyncSpotify,
     EmbedType,
+    SearchCache,
+    TrackCache,
+    check_spotify_token,
     count_votes,
     embed_message_vote,
     embed_song,
     spotify_auth,
     spotifymongoformat,
     embed_message_vote_add,
+    track_label,
 )
-from src.utils import milliseconds_to_string, load_config
+from src.triggers import AdaptiveTrigger
+from src.utils import Debouncer, milliseconds_to_string, load_config
 
 # Constants and Configuration
 CONFIG, MODULE_CONFIG, ENABLED_SERVERS = load_config("moduleSpotify")
-MODULE_CONFIG = MODULE_CONFIG[ENABLED_SERVERS[0]]
-
-DISCORD2NAME = CONFIG["discord2name"][str(ENABLED_SERVERS[0])]
-SPOTIFY2DISCORD = MODULE_CONFIG["spotifyIdToDiscordId"]
 
 SPOTIFY_CLIENT_ID = CONFIG["spotify"]["spotifyClientId"]
 SPOTIFY_CLIENT_SECRET = CONFIG["spotify"]["spotifyClientSecret"]
 SPOTIFY_REDIRECT_URI = CONFIG["spotify"]["spotifyRedirectUri"]
-CHANNEL_ID = MODULE_CONFIG["spotifyChannelId"]
-PLAYLIST_ID = MODULE_CONFIG["spotifyPlaylistId"]
-NEW_PLAYLIST_ID = MODULE_CONFIG["spotifyNewPlaylistId"]
-PATCH_MESSAGE_URL = MODULE_CONFIG["spotifyRecapMessage"]
-GUILD_ID = ENABLED_SERVERS[0]
 DEV_GUILD = CONFIG["discord"]["devGuildId"]
 COOLDOWN_TIME = 1
+# Seconds between two edits of the vote message
+VOTE_RENDER_DELAY = 2
+# Minimum number of seconds between two playlist checks, whatever the guild
+POLL_SPACING = 1
+# Kinds of the timers of the module
+VOTE_REMINDER = "spotify_vote_reminder"
+ADDWITHVOTE_END = "addwithvote_end"
+# End of the recap message, unless the guild configures its own
+DEFAULT_RECAP_LINKS = (
+    "Status : https://status.drndvs.fr/status/guildeux\n"
+    "Dashboard : https://drndvs.link/StatsPlaylist"
+)
+# Fields of the playlist items used by the database and the embeds
+PLAYLIST_ITEM_FIELDS = (
+    "items(added_at,added_by.id,track(id,name,duration_ms,preview_url,external_urls,"
+    "artists(id,name,external_urls),album(name,images,external_urls)))"
+)
 DATA_FOLDER = CONFIG["misc"]["dataFolder"]
+# Database and files of the module when it handled a single guild
+LEGACY_DATABASE = "Playlist"
+LEGACY_FILES = (
+    "addwithvotes.json",
+    "voteinfos.json",
+    "snapshot.json",
+    "reminderspotify.json",
+    "playlist_mirror.json",
+)
 
 # Logger setup
 logger = logutil.init_logger(os.path.basename(__file__))
 
-# MongoDB setup
-client = pymongo.MongoClient(CONFIG["mongodb"]["url"])
-db = client["Playlist"]
-playlist_items_full = db["playlistItemsFull"]
-votes_db = db["votes"]
+# MongoDB setup, the track cache is shared by every guild
+db = get_database("Playlist")
 
-# Spotify authentication
-sp = spotify_auth()
+# Spotify authentication, the token is checked once the bot is ready
+spotify = AsyncSpotify(spotify_auth())
+search_cache = SearchCache(spotify)
+track_cache = TrackCache(spotify, db["trackCache"])
 
 # Global variables
 last_votes = {}
-reminders = {}
-vote_infos = {}
-snapshot = {}
+poll_metrics = {"started": time.time(), "polls": 0, "patches": 0, "patches_skipped": 0}
+
+
+def format_interval(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} secondes"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} minutes"
+    return f"{seconds / 3600:.1f} heures"
+
+
+def format_ratio(ratio):
+    return "-" if ratio is None else f"{ratio:.0%}"
 
 
 class VoteManager:
-    def __init__(self, file_path):
-        self.file_path = file_path
+    """
+    Votes of /addwithvote, kept in memory and saved to the state store.
 
-    def load_data(self):
-        with open(self.file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+    Every change is applied under a lock, so concurrent votes never overwrite
+    each other, and only rewrites the song it concerns in the store.
+    """
 
-    def save_data(self, data):
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+    def __init__(self, store: StateStore, namespace: str, discord2name):
+        self.store = store
+        self.namespace = namespace
+        self.data = {}
+        self.lock = asyncio.Lock()
+        self.discord2name = discord2name
 
-    def count_votes(self, data, song):
-        song_data = data[song]
+    async def load(self, legacy_path):
+        await self.store.migrate_json(self.namespace, legacy_path)
+        self.data = await self.store.items(self.namespace)
+
+    def __contains__(self, song_id):
+        return song_id in self.data
+
+    def get(self, song_id):
+        return self.data[song_id]
+
+    def count_votes(self, song):
+        song_data = self.data[song]
         yes_votes = sum(1 for v in song_data["votes"].values() if v == "yes")
         no_votes = sum(1 for v in song_data["votes"].values() if v == "no")
-        users = [DISCORD2NAME.get(user, f"<@{user}>") for user in song_data["votes"]]
+        users = [
+            self.discord2name.get(user, f"<@{user}>") for user in song_data["votes"]
+        ]
         return yes_votes, no_votes, users
 
-    def check_deadline(self, song_id):
-        data = self.load_data()
-        return float(data[song_id]["deadline"]) <= datetime.now().timestamp()
+    async def open_vote(self, song, vote):
+        async with self.lock:
+            self.data[song] = vote
+            await self.store.set(self.namespace, song, vote)
 
-    def save_vote(self, author_id, vote, song):
-        data = self.load_data()
-        logger.info("%s voted %s to add %s", author_id, vote, song)
-        data[song]["votes"][str(author_id)] = vote
-        self.save_data(data)
+    async def save_vote(self, author_id, vote, song):
+        """
+        Saves the vote of a user, or cancels it if vote is None.
 
+        Returns:
+            bool: False if the vote is already closed.
+        """
+        async with self.lock:
+            if song not in self.data:
+                return False
+            logger.info("%s voted %s to add %s", author_id, vote, song)
+            votes = self.data[song]["votes"]
+            if vote is None:
+                votes.pop(str(author_id), None)
+            else:
+                votes[str(author_id)] = vote
+            await self.store.set(self.namespace, song, self.data[song])
+            return True
+
+    async def close_vote(self, song):
+        async with self.lock:
+            vote = self.data.pop(song, None)
+            if vote is not None:
+                await self.store.delete(self.namespace, song)
+            return vote
+
+
+def find_legacy_guild() -> str | None:
+    """
+    Returns the guild to default to the data of the single-guild version of the module.
+
+    Only needed when that data exists and no guild claims it through
+    spotifyDatabaseName or spotifyDataFolder: with a single guild it is that
+    one, with several the owner has to choose, so the bot refuses to start
+    rather than leave the history behind.
+
+    Returns:
+        str | None: The ID of the guild, or None if there is nothing to default.
+
+    Raises:
+        RuntimeError: If several guilds could own the data.
+    """
+    if not any(
+        os.path.exists(f"{DATA_FOLDER}/{name}{suffix}")
+        for name in LEGACY_FILES
+        for suffix in ("", ".migrated")
+    ):
+        return None
+    for guild_id in ENABLED_SERVERS:
+        config = MODULE_CONFIG[str(guild_id)]
+        if config.get("spotifyDatabaseName") == LEGACY_DATABASE or (
+            "spotifyDataFolder" in config
+            and os.path.abspath(config["spotifyDataFolder"])
+            == os.path.abspath(DATA_FOLDER)
+        ):
+            return None
+    if len(ENABLED_SERVERS) == 1:
+        logger.info("Données Spotify de %s reprises par le serveur", DATA_FOLDER)
+        return str(ENABLED_SERVERS[0])
+    raise RuntimeError(
+        f"Spotify data of {DATA_FOLDER} is used by no server: set spotifyDatabaseName"
+        f' to "{LEGACY_DATABASE}" and spotifyDataFolder to "{DATA_FOLDER}" in the'
+        " configuration of the server that owns it"
+    )
 
-class Spotify(interactions.Extension):
-    def __init__(self, bot: interactions.client):
-        self.bot: interactions.Client = bot
-        self.vote_manager = VoteManager(f"{DATA_FOLDER}/addwithvotes.json")
 
-    @interactions.listen()
-    async def on_startup(self):
-        self.check_playlist_changes.start()
-        self.randomvote.start()
-        await self.load_reminders()
-        self.reminder_check.start()
+class PlaylistContext:
+    """
+    Playlist, votes and channel of one guild using the module.
+
+    Each guild gets its own database and data folder, unless its configuration
+    names them with spotifyDatabaseName and spotifyDataFolder. The guild that
+    used the module before it handled several guilds defaults to the "Playlist"
+    database and to the data folder, to keep its history.
+
+    Args:
+        guild_id (str): The ID of the guild.
+        legacy (bool): Whether the guild defaults to the former database and folder.
+    """
+
+    def __init__(self, guild_id: str, legacy: bool = False):
+        config = MODULE_CONFIG[guild_id]
+        self.guild_id = guild_id
+        self.discord2name = CONFIG["discord2name"].get(guild_id, {})
+        self.spotify2discord = config["spotifyIdToDiscordId"]
+        self.channel_id = config["spotifyChannelId"]
+        self.playlist_id = config["spotifyPlaylistId"]
+        self.new_playlist_id = config.get("spotifyNewPlaylistId")
+        self.patch_message_url = config.get("spotifyRecapMessage")
+        self.recap_links = config.get("spotifyRecapLinks", DEFAULT_RECAP_LINKS)
+        # How the song of the day is drawn, see PlaylistIndex.pick
+        self.vote_weighting = config.get("spotifyVoteWeighting", "uniform")
+        self.trigger = AdaptiveTrigger(
+            config.get("spotifyPollMinSeconds", 30),
+            config.get("spotifyPollMaxSeconds", 900),
+        )
+        database = get_database(
+            config.get(
+                "spotifyDatabaseName", LEGACY_DATABASE if legacy else f"Playlist_{guild_id}"
+            )
+        )
+        self.playlist_items = database["playlistItemsFull"]
+        self.votes = database["votes"]
+        # Songs of the playlist and of the vote history, loaded on startup
+        self.index = PlaylistIndex()
+        self.stats = PlaylistStats(
+            self.playlist_items,
+            self.votes,
+            database["userStats"],
+            database["playlistStats"],
+        )
+        self.folder = config.get(
+            "spotifyDataFolder",
+            DATA_FOLDER if legacy else f"{DATA_FOLDER}/spotify/{guild_id}",
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        self.mirror = PlaylistMirror(f"{self.folder}/playlist_mirror.json")
+        # The state of the guild, in the namespace of the module
+        self.store = get_state_store()
+        self.namespace = f"spotify:{guild_id}"
+        self.vote_manager = VoteManager(
+            self.store, f"{self.namespace}:addwithvotes", self.discord2name
+        )
+        self.vote_infos = {}
+        self.snapshot = {"snapshot": None, "length": 0, "duration": 0}
+        self.song_vote: SongVote | None = None
+        self.vote_message: interactions.Message | None = None
+        self.vote_render = Debouncer(self.render_vote, delay=VOTE_RENDER_DELAY)
+        # Polling interval shown by the recap message
+        self.recap_interval: float | None = None
+
+    async def load(self):
+        """
+        Loads the state of the playlist from MongoDB and the state store.
+        """
+        await self.index.load(self.playlist_items, self.votes)
+        await asyncio.to_thread(self.mirror.load)
+        await self.stats.setup()
+        await self.migrate_reminders()
+        await self.vote_manager.load(f"{self.folder}/addwithvotes.json")
         await self.load_voteinfos()
         await self.load_snapshot()
-        self.addwithvote = self.vote_manager.load_data()
-        self.check_for_end.start()
-        self.new_titles_playlist.start()
+        # Votes opened before their deadlines were timers
+        for song_id, vote in self.vote_manager.data.items():
+            await self.schedule_vote_end(song_id, vote["deadline"])
 
     async def load_voteinfos(self):
-        with open(f"{DATA_FOLDER}/voteinfos.json", "r", encoding="utf-8") as f:
-            vote_infos.update(json.load(f))
+        await self.store.migrate_json(
+            self.namespace,
+            f"{self.folder}/voteinfos.json",
+            select=lambda data: {"voteinfos": data},
+        )
+        self.vote_infos.update(await self.store.get(self.namespace, "voteinfos", {}))
 
     async def load_snapshot(self):
-        with open(f"{DATA_FOLDER}/snapshot.json", "r", encoding="utf-8") as f:
-            snapshot.update(json.load(f))
+        await self.store.migrate_json(
+            self.namespace,
+            f"{self.folder}/snapshot.json",
+            select=lambda data: {"snapshot": data},
+        )
+        self.snapshot.update(await self.store.get(self.namespace, "snapshot", {}))
 
     async def save_snapshot(self):
-        with open(f"{DATA_FOLDER}/snapshot.json", "w", encoding="utf-8") as f:
-            json.dump(snapshot, f, indent=4)
+        await self.store.set(self.namespace, "snapshot", self.snapshot)
 
     async def save_voteinfos(self):
-        with open(f"{DATA_FOLDER}/voteinfos.json", "w", encoding="utf-8") as f:
-            json.dump(vote_infos, f, indent=4)
+        await self.store.set(self.namespace, "voteinfos", self.vote_infos)
+
+    async def migrate_reminders(self):
+        """
+        Moves the reminders of the former JSON file to the timer service, once.
+        """
+        path = f"{self.folder}/reminderspotify.json"
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                reminders_data = json.load(file)
+        except FileNotFoundError:
+            return
+        for remind_time_str, user_ids in reminders_data.items():
+            remind_time = datetime.strptime(remind_time_str, TIME_FORMAT)
+            for user_id in user_ids:
+                await self.schedule_reminder(str(user_id), remind_time)
+        os.replace(path, f"{path}.migrated")
+        logger.info("Rappels de vote de %s déplacés", self.guild_id)
+
+    async def schedule_reminder(self, user_id: str, remind_time: datetime):
+        await get_timers().schedule(
+            VOTE_REMINDER,
+            remind_time,
+            {"guild_id": self.guild_id, "user_id": user_id},
+            every="daily",
+        )
+
+    async def schedule_vote_end(self, song_id: str, deadline: float):
+        # The ID makes it idempotent, a vote has a single deadline
+        await get_timers().schedule(
+            ADDWITHVOTE_END,
+            datetime.fromtimestamp(float(deadline)),
+            {"guild_id": self.guild_id, "song_id": song_id},
+            timer_id=f"{ADDWITHVOTE_END}:{self.guild_id}:{song_id}",
+        )
+
+    async def render_vote(self):
+        """
+        Updates the vote message with the latest tallies.
+        """
+        message = self.vote_message
+        if message is None or self.song_vote is None:
+            return
+        embed = message.embeds[0]
+        total = self.song_vote.total()
+        users = ", ".join(
+            self.discord2name.get(user, f"<@{user}>") for user in self.song_vote.votes
+        )
+        embed.fields[4].value = f"{total} vote{'s' if total > 1 else ''} ({users})"
+        await message.edit(embeds=[embed])
+
+
+class Spotify(interactions.Extension):
+    def __init__(self, bot: interactions.client):
+        self.bot: interactions.Client = bot
+        legacy_guild = find_legacy_guild()
+        self.contexts = {
+            str(guild_id): PlaylistContext(str(guild_id), str(guild_id) == legacy_guild)
+            for guild_id in ENABLED_SERVERS
+        }
+        # One loop checks every playlist, spread over time
+        self.scheduler = SyncScheduler(self.check_playlist_changes, POLL_SPACING)
+        for guild_id, context in self.contexts.items():
+            self.scheduler.add(guild_id, context.trigger)
+
+    def get_context(self, guild_id) -> PlaylistContext | None:
+        return self.contexts.get(str(guild_id))
+
+    @interactions.listen()
+    async def on_startup(self):
+        await asyncio.to_thread(check_spotify_token, spotify.sp)
+        await track_cache.setup()
+        for context in self.contexts.values():
+            await context.load()
+        self.scheduler.start()
+        timers = get_timers()
+        timers.register(VOTE_REMINDER, self.send_reminder)
+        timers.register(ADDWITHVOTE_END, self.end_vote_timer)
+        timers.start()
+        self.randomvote.start()
+        self.new_titles_playlist.start()
+
+    def drop(self):
+        self.scheduler.stop()
+        super().drop()
 
     @interactions.slash_command(
         "addsong",
@@ -138,7 +406,8 @@ class Spotify(interactions.Extension):
         autocomplete=True,
     )
     async def addsong(self, ctx: interactions.SlashContext, song):
-        if str(ctx.channel_id) != str(CHANNEL_ID):
+        context = self.get_context(ctx.guild_id)
+        if context is None or str(ctx.channel_id) != str(context.channel_id):
             await ctx.send(
                 "Vous ne pouvez pas utiliser cette commande dans ce salon.",
                 ephemeral=True,
@@ -156,18 +425,23 @@ class Spotify(interactions.Extension):
         )
 
         try:
-            track = sp.track(song, market="FR")
+            track = await track_cache.get(song)
             song_data = spotifymongoformat(
-                track, ctx.author_id, spotify2discord=SPOTIFY2DISCORD
+                track, ctx.author_id, spotify2discord=context.spotify2discord
             )
         except spotipy.exceptions.SpotifyException:
             await ctx.send("Cette chanson n'existe pas.", ephemeral=True)
             logger.info("Commande /addsong utilisée avec une chanson inexistante")
             return
 
-        if song_data["_id"] not in playlist_items_full.distinct("_id"):
-            playlist_items_full.insert_one(song_data)
-            sp.playlist_add_items(PLAYLIST_ID, [song_data["_id"]])
+        if song_data["_id"] not in context.index:
+            await context.playlist_items.insert_one(song_data)
+            context.index.add(
+                song_data["_id"], song_data["added_by"], song_data["added_at"]
+            )
+            await context.stats.refresh([song_data["added_by"]])
+            await spotify.playlist_add_items(context.playlist_id, [song_data["_id"]])
+            self.scheduler.poke(context.guild_id)
             embed = await embed_song(
                 song=song_data,
                 track=track,
@@ -189,23 +463,20 @@ class Spotify(interactions.Extension):
 
     @addsong.autocomplete("song")
     async def autocomplete_from_spotify(self, ctx: interactions.AutocompleteContext):
+        """
+        Autocomplete function for the 'addsong' and 'addwithvote' commands.
+        """
         if not ctx.input_text:
             choices = [{"name": "Veuillez entrer un nom de chanson", "value": "error"}]
         else:
-            items = sp.search(ctx.input_text, limit=10, type="track", market="FR")[
-                "tracks"
-            ]["items"]
+            items = await search_cache.search(ctx.input_text, market="FR")
+            # The chosen track is then looked up by the command
+            await track_cache.warm(items, persist=False)
             if not items:
                 choices = [{"name": "Aucun résultat", "value": "error"}]
             else:
                 choices = [
-                    {
-                        "name": f"{item['artists'][0]['name']} - {item['name']} (Album: {item['album']['name']})"[
-                            :100
-                        ],
-                        "value": item["uri"],
-                    }
-                    for item in items
+                    {"name": track_label(item), "value": item["uri"]} for item in items
                 ]
         await ctx.send(choices=choices)
 
@@ -218,15 +489,48 @@ class Spotify(interactions.Extension):
     @interactions.Task.create(interactions.TimeTrigger(hour=20, minute=0, utc=False))
     async def randomvote(self):
         logger.info("Tache randomvote lancée")
-        message_id = vote_infos.get("message_id")
-        track_id = vote_infos.get("track_id")
+        for context in self.contexts.values():
+            try:
+                await self.song_of_the_day(context)
+            except Exception:
+                logger.exception("Vote du jour impossible pour %s", context.guild_id)
+
+    async def song_of_the_day(self, context: PlaylistContext):
+        """
+        Closes the vote on the song of the day of a guild, and opens the next one.
+
+        Args:
+            context (PlaylistContext): The playlist of the guild.
+        """
+        closed_by = None
+        if context.vote_infos.get("message_id"):
+            closed_by = await self.close_song_vote(context)
+        await self.open_song_vote(context, closed_by)
+
+    async def close_song_vote(self, context: PlaylistContext) -> str | None:
+        """
+        Closes the vote on the song of the day, removing the song if it lost.
+
+        Args:
+            context (PlaylistContext): The playlist of the guild.
+
+        Returns:
+            str | None: The Discord ID of the user who added the song.
+        """
+        # Show the last votes before closing
+        await context.vote_render.flush()
+        context.vote_message = None
+        message_id = context.vote_infos.get("message_id")
+        track_id = context.vote_infos.get("track_id")
         logger.debug("message_id: %s", message_id)
         logger.debug("track_id: %s", track_id)
-        channel = self.bot.get_channel(CHANNEL_ID)
+        channel = self.bot.get_channel(context.channel_id)
         message = await channel.fetch_message(message_id)
         logger.debug("message : %s", str(message.id))
-        votes = votes_db.find_one({"_id": track_id})
-        conserver, supprimer, menfou, users = count_votes(votes["votes"], DISCORD2NAME)
+        votes = await context.votes.find_one({"_id": track_id})
+        conserver, supprimer, menfou, users = count_votes(
+            votes["votes"], context.discord2name
+        )
 
         logger.debug(
             "keep : %s\nremove : %s\nmenfou : %s",
@@ -234,9 +538,9 @@ class Spotify(interactions.Extension):
             str(supprimer),
             str(menfou),
         )
-        song = playlist_items_full.find_one({"_id": track_id})
+        song = await context.playlist_items.find_one({"_id": track_id})
         logger.debug("song : %s\ntrack_id : %s", song, track_id)
-        track = sp.track(track_id, market="FR")
+        track = await track_cache.get(track_id)
         await message.unpin()
         if supprimer > conserver or (conserver == 0 and supprimer == 0 and menfou >= 3):
             await message.edit(
@@ -258,13 +562,16 @@ class Spotify(interactions.Extension):
                 ],
                 components=[],
             )
-            sp.playlist_remove_all_occurrences_of_items(PLAYLIST_ID, [track_id])
-            playlist_items_full.delete_one({"_id": track_id})
-            votes_db.find_one_and_update(
+            await spotify.playlist_remove_all_occurrences_of_items(
+                context.playlist_id, [track_id]
+            )
+            await context.playlist_items.delete_one({"_id": track_id})
+            context.index.remove(track_id)
+            await context.votes.find_one_and_update(
                 {"_id": track_id}, {"$set": {"state": "supprimée"}}
             )
             logger.info("La chanson a été supprimée.")
-            await self.check_playlist_changes()
+            self.scheduler.poke(context.guild_id)
         else:
             logger.debug("La chanson a été conservée.")
             logger.debug("track_id : %s\nmessage_id : %s", track_id, message_id)
@@ -287,23 +594,32 @@ class Spotify(interactions.Extension):
                 ],
                 components=[],
             )
-            votes_db.find_one_and_update(
+            await context.votes.find_one_and_update(
                 {"_id": track_id}, {"$set": {"state": "conservée"}}
             )
             logger.info("La chanson a été conservée.")
-        track_ids = set(playlist_items_full.distinct("_id"))
-        pollhistory = set(votes_db.distinct("_id"))
-        track_id = random.choice(list(track_ids))
-        logger.debug("track_id choisie : %s", track_id)
-        while track_id in pollhistory:
-            logger.warning(
-                "Chanson déjà votée, nouvelle chanson tirée au sort (%s)", track_id
-            )
-            track_id = random.choice(list(track_ids))
+        return votes.get("added_by")
+
+    async def open_song_vote(
+        self, context: PlaylistContext, closed_by: str | None = None
+    ):
+        """
+        Draws the next song of the day and opens the vote on it.
+
+        Args:
+            context (PlaylistContext): The playlist of the guild.
+            closed_by (str, optional): The adder of the song whose vote just closed.
+        """
+        if not context.index.unvoted:
+            logger.info("Toutes les chansons ont été votées, recyclage")
+        track_id = context.index.pick(context.vote_weighting)
+        if track_id is None:
+            logger.warning("La playlist est vide, aucune chanson à tirer au sort")
+            return
         logger.info("Chanson tirée au sort : %s", track_id)
-        song = playlist_items_full.find_one({"_id": track_id})
-        track = sp.track(song["_id"], market="FR")
-        channel = await self.bot.fetch_channel(CHANNEL_ID)
+        song = await context.playlist_items.find_one({"_id": track_id})
+        track = await track_cache.get(song["_id"])
+        channel = await self.bot.fetch_channel(context.channel_id)
         message = await channel.send(
             content=f"Voulez-vous **conserver** cette chanson dans playlist ? (poke <@{song['added_by']}>)",
             embeds=[
@@ -346,20 +662,24 @@ class Spotify(interactions.Extension):
         )
         await message.pin()
         await channel.purge(deletion_limit=1, after=message)
-        vote_infos.update({"message_id": str(message.id), "track_id": track_id})
-        await self.save_voteinfos()
-        votes_db.update_one(
+        context.vote_infos.update({"message_id": str(message.id), "track_id": track_id})
+        await context.save_voteinfos()
+        vote_date = datetime.now().strftime("%Y-%m-%d")
+        context.index.mark_voted(track_id, vote_date)
+        await context.votes.update_one(
             {"_id": track_id},
             {
                 "$set": {
                     "name": f"{', '.join(artist['name'] for artist in track['artists'])} - {track['name']}",
-                    "date": datetime.now().strftime("%Y-%m-%d"),
+                    "date": vote_date,
                     "added_by": song["added_by"],
                     "votes": {},
+                    "counts": dict.fromkeys(VOTE_OPTIONS, 0),
                 }
             },
             upsert=True,
         )
+        await context.stats.refresh([closed_by, song["added_by"]])
 
     @interactions.listen(Component)
     async def on_component(self, event: Component):
@@ -377,49 +697,26 @@ class Spotify(interactions.Extension):
             logger.warning("%s a essayé de voter trop rapidement", ctx.user.username)
             return
         last_votes[user_id] = time.time()
-        message_id = vote_infos.get("message_id")
-        track_id = vote_infos.get("track_id")
-        if ctx.message.id == int(message_id):
-            embed_original = ctx.message.embeds[0]
-            # Check if the user has already voted and update their vote if necessary
-            user_id = str(ctx.user.id)
-            if ctx.custom_id == "annuler":
-                votes = votes_db.find_one_and_update(
-                    {"_id": track_id},
-                    {"$unset": {f"votes.{user_id}": ""}},
-                    return_document=pymongo.ReturnDocument.AFTER,
-                )
-            else:
-                votes = votes_db.find_one_and_update(
-                    {"_id": track_id},
-                    {"$set": {f"votes.{user_id}": ctx.custom_id}},
-                    upsert=True,
-                    return_document=pymongo.ReturnDocument.AFTER,
-                )
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            return
+        message_id = context.vote_infos.get("message_id")
+        track_id = context.vote_infos.get("track_id")
+        if message_id and ctx.message.id == int(message_id):
+            if context.song_vote is None or context.song_vote.track_id != track_id:
+                context.song_vote = SongVote(context.votes, track_id)
+            option = None if ctx.custom_id == "annuler" else ctx.custom_id
+            await context.song_vote.vote(user_id, option)
             logger.info("User %s voted %s", ctx.user.username, ctx.custom_id)
-            # Count the votes
-            conserver, supprimer, menfou, users = count_votes(
-                votes["votes"], DISCORD2NAME
-            )
-            users = ", ".join(users)
             logger.info(
                 "Votes : %s conserver, %s supprimer, %s menfou",
-                conserver,
-                supprimer,
-                menfou,
-            )
-            embed_original.fields[4].value = (
-                f"{conserver+supprimer+menfou} vote{'s' if conserver+supprimer+menfou>1 else ''} ({users})"
-            )
-            # await ctx.message.edit(content=f"Voulez-vous conserver cette chanson dans playlist ?")
-            # Update the message with the vote counts
-
-            await ctx.message.edit(
-                embeds=[
-                    embed_original,
-                    # await embed_message_vote(keep, remove, menfou),
-                ]
+                context.song_vote.counts["conserver"],
+                context.song_vote.counts["supprimer"],
+                context.song_vote.counts["menfou"],
             )
+            # The message is edited once for all the votes of the next seconds
+            context.vote_message = ctx.message
+            context.vote_render.trigger()
 
             # Send a message to the user informing them that their vote has been counted
             if ctx.custom_id == "annuler":
@@ -433,15 +730,22 @@ class Spotify(interactions.Extension):
                     ephemeral=True,
                 )
 
-    @interactions.Task.create(interactions.IntervalTrigger(minutes=1, seconds=0))
-    async def check_playlist_changes(self):
+    async def check_playlist_changes(self, guild_id: str):
         """
-        Check for changes in the Spotify playlist and update the Discord message accordingly.
+        Check for changes in the Spotify playlist of a guild and update its recap message.
+
+        Called by the scheduler, which runs the checks of every guild one at a time.
+
+        Args:
+            guild_id (str): The ID of the guild.
         """
-        logger.debug("check_playlist_changes lancé")
+        context = self.contexts[guild_id]
+        snapshot = context.snapshot
+        logger.debug("check_playlist_changes lancé pour %s", guild_id)
+        poll_metrics["polls"] += 1
 
         # Retrieve the channel where messages will be sent
-        channel = await self.bot.fetch_channel(CHANNEL_ID)
+        channel = await self.bot.fetch_channel(context.channel_id)
         logger.debug(
             "old_snap : %s, duration : %s, length : %s",
             snapshot["snapshot"],
@@ -450,7 +754,9 @@ class Spotify(interactions.Extension):
         )
         # Compare the current snapshot ID to the previous snapshot ID
         try:
-            new_snap = sp.playlist(PLAYLIST_ID, fields="snapshot_id")["snapshot_id"]
+            new_snap = (
+                await spotify.playlist(context.playlist_id, fields="snapshot_id")
+            )["snapshot_id"]
         except spotipy.SpotifyException as e:
             logger.error("Spotify API Error : %s", e)
             return
@@ -458,96 +764,154 @@ class Spotify(interactions.Extension):
             logger.error("ConnectionError : %s", e)
             return
 
-        if new_snap != snapshot["snapshot"]:
-            # Retrieve the tracks of the playlist
+        changed = new_snap != snapshot["snapshot"]
+        if changed or new_snap != context.mirror.snapshot_id:
+            # Retrieve only the fields needed for the database and the embeds
             try:
-                results = sp.playlist_tracks(
-                    playlist_id=PLAYLIST_ID, limit=100, offset=0
+                tracks = await spotify.playlist_all_items(
+                    context.playlist_id, fields=PLAYLIST_ITEM_FIELDS
                 )
             except spotipy.SpotifyException as e:
                 logger.error("Spotify API Error : %s", e)
-            tracks = results["items"]
-            # get next 100 tracks
-            while results["next"]:
-                results = sp.next(results)
-                tracks.extend(results["items"])
-            # Process each track
-            length = len(tracks)
-            duration = 0
+                return
+            # Local files and unavailable tracks have no ID
+            tracks = [track for track in tracks if (track["track"] or {}).get("id")]
             # Compare the current track IDs to the previous track IDs
-            last_track_ids = playlist_items_full.distinct("_id")
+            last_track_ids = context.index.ids()
             current_track_ids = {track["track"]["id"] for track in tracks}
-            added_track_ids = list(set(current_track_ids) - set(last_track_ids))
-            removed_track_ids = list(set(last_track_ids) - set(current_track_ids))
-            logger.debug("added_track_ids : %s", added_track_ids)
+            added_tracks = [
+                track for track in tracks if track["track"]["id"] not in last_track_ids
+            ]
+            removed_track_ids = list(last_track_ids - current_track_ids)
+            # Only the new tracks: the others are already cached and stored, and
+            # warming the whole playlist would evict the rest of the cache
+            await track_cache.warm([track["track"] for track in added_tracks])
+            logger.debug(
+                "added_track_ids : %s", [track["track"]["id"] for track in added_tracks]
+            )
             logger.debug("removed_track_ids : %s", removed_track_ids)
-            for track in tracks:
-                # Append the track to a list of tracks to be inserted into the MongoDB collection
-                song = spotifymongoformat(track, spotify2discord=SPOTIFY2DISCORD)
-                # Retrieve the time the track was added and add its duration to the total duration of the playlist
-                duration += track["track"]["duration_ms"]
-                # Send messages for added or removed tracks
-                if track["track"]["id"] in added_track_ids:
-                    song = spotifymongoformat(track, spotify2discord=SPOTIFY2DISCORD)
-                    track = sp.track(track["track"]["id"], market="FR")
-                    playlist_items_full.insert_one(song)
-                    dt = interactions.utils.timestamp_converter(
-                        datetime.fromisoformat(song["added_at"]).astimezone(
-                            pytz.timezone("Europe/Paris")
-                        )
-                    )
-                    embed = await embed_song(
-                        song=song,
-                        track=track,
-                        embedtype=EmbedType.ADD,
-                        time=dt,
-                        person=DISCORD2NAME.get(song["added_by"], song["added_by"]),
-                    )
-                    await channel.send(
-                        content=f"{random.choice(startList)} <@{song['added_by']}>, {random.choice(finishList)}",
-                        embeds=embed,
+
+            added_songs = [
+                spotifymongoformat(track, spotify2discord=context.spotify2discord)
+                for track in added_tracks
+            ]
+            removed_songs = []
+            removed_tracks = []
+            if removed_track_ids:
+                removed_songs = await context.playlist_items.find(
+                    {"_id": {"$in": removed_track_ids}}
+                ).to_list(length=None)
+                try:
+                    removed_tracks = await track_cache.get_many(
+                        [song["_id"] for song in removed_songs]
                     )
-                    logger.info(
-                        "%s ajouté par %s",
-                        track["name"],
-                        DISCORD2NAME.get(song["added_by"], song["added_by"]),
+                except spotipy.SpotifyException as e:
+                    logger.error("Spotify API Error : %s", e)
+                    return
+            # Persist every change at once
+            operations = [
+                pymongo.ReplaceOne({"_id": song["_id"]}, song, upsert=True)
+                for song in added_songs
+            ]
+            if removed_track_ids:
+                operations.append(
+                    pymongo.DeleteMany({"_id": {"$in": removed_track_ids}})
+                )
+            if operations:
+                await context.playlist_items.bulk_write(operations, ordered=False)
+            for song in added_songs:
+                context.index.add(song["_id"], song["added_by"], song["added_at"])
+            for track_id in removed_track_ids:
+                context.index.remove(track_id)
+            if operations:
+                await context.stats.refresh(
+                    song["added_by"] for song in added_songs + removed_songs
+                )
+
+            if snapshot["snapshot"] is None:
+                # First sync of a new guild, the whole playlist is not news
+                logger.info(
+                    "Playlist de %s importée : %s chansons", guild_id, len(added_songs)
+                )
+                added_songs = added_tracks = []
+            # Send messages for added or removed tracks
+            for song, track in zip(added_songs, added_tracks):
+                dt = interactions.utils.timestamp_converter(
+                    datetime.fromisoformat(song["added_at"]).astimezone(
+                        pytz.timezone("Europe/Paris")
                     )
+                )
+                embed = await embed_song(
+                    song=song,
+                    track=track["track"],
+                    embedtype=EmbedType.ADD,
+                    time=dt,
+                    person=context.discord2name.get(song["added_by"], song["added_by"]),
+                )
+                await channel.send(
+                    content=f"{random.choice(startList)} <@{song['added_by']}>, {random.choice(finishList)}",
+                    embeds=embed,
+                )
+                logger.info(
+                    "%s ajouté par %s",
+                    song["name"],
+                    context.discord2name.get(song["added_by"], song["added_by"]),
+                )
             if removed_track_ids:
                 logger.info(
                     "%s chanson(s) ont été supprimée(s) depuis la dernière vérification",
                     len(removed_track_ids),
                 )
-                for track_id in removed_track_ids:
-                    song = playlist_items_full.find_one_and_delete({"_id": track_id})
-                    track = sp.track(track_id, market="FR")
+                for song, track in zip(removed_songs, removed_tracks):
+                    if track is None:
+                        logger.warning("Chanson %s introuvable sur Spotify", song["_id"])
+                        continue
                     embed = await embed_song(
                         song=song,
                         track=track,
                         embedtype=EmbedType.DELETE,
                         time=interactions.Timestamp.utcnow(),
                     )
-                    channel = await self.bot.fetch_channel(CHANNEL_ID)
                     await channel.send(embeds=embed)
 
+            context.mirror.update(new_snap, tracks)
+            await asyncio.to_thread(context.mirror.save)
             # Store the snapshot ID, length and duration in a JSON file
             snapshot["snapshot"] = new_snap
-            snapshot["length"] = length
-            snapshot["duration"] = duration
-            await self.save_snapshot()
+            snapshot["length"] = context.mirror.length
+            snapshot["duration"] = context.mirror.duration
+            snapshot["changed_at"] = time.time()
+            await context.save_snapshot()
             logger.debug("Snapshot mis à jour")
-            # Send a message indicating that the playlist has been updated
-        message = f"Dernière màj de la playlist {interactions.Timestamp.utcnow().format(interactions.TimestampStyles.RelativeTime)}, si c'était il y a plus d'**une minute**, il y a probablement un problème\n`/addsong Titre et artiste de la chanson` pour ajouter une chanson\nIl y a actuellement **{snapshot['length']}** chansons dans la playlist, pour un total de **{milliseconds_to_string(snapshot['duration'])}**\nStatus : https://status.drndvs.fr/status/guildeux\nDashboard : https://drndvs.link/StatsPlaylist"
+
+        trigger = context.trigger
+        if changed:
+            trigger.reset()
+        else:
+            trigger.backoff()
+        if not context.patch_message_url:
+            return
+        # The relative timestamps are rendered by Discord, the message only
+        # needs an edit when the playlist or the polling interval changes
+        if not changed and trigger.interval == context.recap_interval:
+            poll_metrics["patches_skipped"] += 1
+            return
+        context.recap_interval = trigger.interval
+        # Send a message indicating that the playlist has been updated
+        last_change = ""
+        if snapshot.get("changed_at"):
+            last_change = f"Dernière modification {interactions.Timestamp.fromtimestamp(snapshot['changed_at']).format(interactions.TimestampStyles.RelativeTime)}, "
+        message = f"{last_change}playlist vérifiée au moins toutes les **{format_interval(trigger.interval)}** en ce moment\n`/addsong Titre et artiste de la chanson` pour ajouter une chanson\nIl y a actuellement **{snapshot['length']}** chansons dans la playlist, pour un total de **{milliseconds_to_string(snapshot['duration'])}**\n{context.recap_links}"
         try:
-            async with aiohttp.ClientSession(
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as session:
-                async with session.patch(
-                    url=PATCH_MESSAGE_URL,
-                    json={
-                        "content": message,
-                    },
-                ) as response:
-                    response.raise_for_status()
+            async with get_session().patch(
+                url=context.patch_message_url,
+                json={
+                    "content": message,
+                },
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as response:
+                response.raise_for_status()
+            poll_metrics["patches"] += 1
         except aiohttp.ClientError as e:
             logger.error("Error while trying to patch message : %s", e)
         except TimeoutError:
@@ -585,7 +949,8 @@ class Spotify(interactions.Extension):
             heure (int): The hour of the reminder.
             minute (int): The minute of the reminder.
         """
-        if str(ctx.channel_id) == str(CHANNEL_ID):
+        context = self.get_context(ctx.guild_id)
+        if context is not None and str(ctx.channel_id) == str(context.channel_id):
             logger.info(
                 "%s a ajouté un rappel à %s:%s", ctx.user.display_name, heure, minute
             )
@@ -599,10 +964,7 @@ class Spotify(interactions.Extension):
             )
             if remind_time <= current_time:
                 remind_time += timedelta(days=1)
-            if remind_time not in reminders:
-                reminders[remind_time] = set()
-            reminders[remind_time].add(ctx.user.id)
-            await self.save_reminders()
+            await context.schedule_reminder(str(ctx.user.id), remind_time)
 
             await ctx.send(
                 f"Rappel défini à {remind_time.strftime('%H:%M')}.", ephemeral=True
@@ -618,85 +980,52 @@ class Spotify(interactions.Extension):
                 ctx.channel_id,
             )
 
-    async def load_reminders(self):
+    async def send_reminder(self, timer: dict):
         """
-        Load reminders from a JSON file and populate the reminders dictionary.
+        Reminds a user to vote if they have not yet, called by the timer service.
         """
-        try:
-            with open(
-                f"{DATA_FOLDER}/reminderspotify.json", "r", encoding="utf-8"
-            ) as file:
-                reminders_data = json.load(file)
-                for remind_time_str, user_ids in reminders_data.items():
-                    remind_time = datetime.strptime(
-                        remind_time_str, "%Y-%m-%d %H:%M:%S"
-                    )
-                    reminders[remind_time] = set(user_ids)
-        except FileNotFoundError:
-            pass
-
-    async def save_reminders(self):
-        reminders_data = {
-            remind_time.strftime("%Y-%m-%d %H:%M:%S"): list(user_ids)
-            for remind_time, user_ids in reminders.items()
-        }
-        with open(f"{DATA_FOLDER}/reminderspotify.json", "w", encoding="utf-8") as file:
-            json.dump(reminders_data, file, indent=4)
-
-    @interactions.Task.create(interactions.IntervalTrigger(minutes=1))
-    async def reminder_check(self):
-        logger.debug("reminder_check lancé")
-        current_time = datetime.now()
-        reminders_to_remove = []
-        for remind_time, user_ids in reminders.copy().items():
-            if current_time >= remind_time:
-                for user_id in user_ids.copy():
-                    user = await self.bot.fetch_user(user_id)
-                    if user:
-                        vote = votes_db.find_one({"_id": str(vote_infos["track_id"])})[
-                            "votes"
-                        ].get(str(user_id))
-                        if vote is None:
-                            await user.send(
-                                f"Hey {user.mention}, tu n'as pas voté aujourd'hui :pleading_face: \nhttps://discord.com/channels/136812800709361664/352980972800704513/{vote_infos.get('message_id')}"
-                            )
-                            logger.debug("Rappel envoyé à %s", user.display_name)
-                        else:
-                            logger.debug(
-                                "%s a déjà voté aujourd'hui !, pas de rappel envoyé",
-                                user.display_name,
-                            )
-                    next_remind_time = remind_time + timedelta(days=1)
-                    if next_remind_time not in reminders:
-                        reminders[next_remind_time] = set()
-                    reminders[next_remind_time].add(user_id)
-                    user_ids.remove(user_id)
-                if not user_ids:
-                    reminders_to_remove.append(remind_time)
-        for remind_time in reminders_to_remove:
-            del reminders[remind_time]
-
-        await self.save_reminders()
+        context = self.get_context(timer["data"]["guild_id"])
+        if context is None:
+            return
+        vote_infos = context.vote_infos
+        if not vote_infos.get("track_id"):
+            return
+        user_id = timer["data"]["user_id"]
+        user = await self.bot.fetch_user(user_id)
+        if user:
+            votes = await context.votes.find_one({"_id": str(vote_infos["track_id"])})
+            vote = votes["votes"].get(str(user_id))
+            if vote is None:
+                await user.send(
+                    f"Hey {user.mention}, tu n'as pas voté aujourd'hui :pleading_face: \nhttps://discord.com/channels/{context.guild_id}/{context.channel_id}/{vote_infos.get('message_id')}"
+                )
+                logger.debug("Rappel envoyé à %s", user.display_name)
+            else:
+                logger.debug(
+                    "%s a déjà voté aujourd'hui !, pas de rappel envoyé",
+                    user.display_name,
+                )
 
     @setreminder.subcommand(
         sub_cmd_name="remove",
         sub_cmd_description="Enlève un rappel de vote pour la chanson du jour",
     )
     async def deletereminder(self, ctx: interactions.SlashContext):
-        user_id = ctx.user.id
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            return
         # create the list of reminders for the user
-        reminders_list = []
-        for remind_time, user_ids in reminders.copy().items():
-            if user_id in user_ids:
-                reminders_list.append(remind_time)
+        reminders_list = await get_timers().find(
+            VOTE_REMINDER, guild_id=context.guild_id, user_id=str(ctx.user.id)
+        )
         # Create a button for each reminder
         buttons = [
             interactions.Button(
-                label=remind_time.strftime("%H:%M"),
+                label=datetime.strptime(timer["due"], TIME_FORMAT).strftime("%H:%M"),
                 style=interactions.ButtonStyle.SECONDARY,
-                custom_id=str(remind_time.timestamp()),
+                custom_id=timer_id,
             )
-            for remind_time in reminders_list
+            for timer_id, timer in reminders_list
         ]
         # Send a message with the buttons
         await ctx.send(
@@ -707,18 +1036,14 @@ class Spotify(interactions.Extension):
         try:
             # Wait for the user to click a button
             button_ctx: Component = await self.bot.wait_for_component(
-                components=[
-                    str(remind_time.timestamp()) for remind_time in reminders_list
-                ],
+                components=[timer_id for timer_id, _ in reminders_list],
                 timeout=60,
             )
-            # Remove the reminder from the reminders dictionary
-            remind_time = datetime.fromtimestamp(float(button_ctx.ctx.custom_id))
-            reminders[remind_time].remove(user_id)
-            if not reminders[remind_time]:
-                del reminders[remind_time]
-            # Save the reminders to a JSON file
-            await self.save_reminders()
+            # Remove the reminder from the timers
+            remind_time = datetime.strptime(
+                dict(reminders_list)[button_ctx.ctx.custom_id]["due"], TIME_FORMAT
+            )
+            await get_timers().cancel(button_ctx.ctx.custom_id)
             # Send a message to the user indicating that the reminder has been removed
             await button_ctx.ctx.edit_origin(
                 content=f"Rappel à {remind_time.strftime('%H:%M')} supprimé.",
@@ -782,7 +1107,7 @@ class Spotify(interactions.Extension):
         )
         await modal_ctx.send("Token mis à jour !", ephemeral=True)
         # Create a new instance of the Spotify API with the access token
-        sp = spotipy.Spotify(auth_manager=sp_oauth, language="fr")
+        spotify.set_client(spotipy.Spotify(auth_manager=sp_oauth, language="fr"))
 
     @interactions.slash_command(
         name="songinfo",
@@ -801,10 +1126,13 @@ class Spotify(interactions.Extension):
         """
         Displays information about a song from the mongodb database.
         """
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            return
         embed = None
-        song = playlist_items_full.find_one({"_id": song_id})
-        votes = votes_db.find_one({"_id": song_id})
-        track = sp.track(song_id, market="FR")
+        song = await context.playlist_items.find_one({"_id": song_id})
+        votes = await context.votes.find_one({"_id": song_id})
+        track = await track_cache.get(song_id)
         if song:
             embed = await embed_song(
                 song=song,
@@ -815,7 +1143,9 @@ class Spotify(interactions.Extension):
             )
         else:
             song = spotifymongoformat(
-                track, votes.get("added_by", "Inconnu"), spotify2discord=SPOTIFY2DISCORD
+                track,
+                votes.get("added_by", "Inconnu"),
+                spotify2discord=context.spotify2discord,
             )
             embed = await embed_song(
                 song=song,
@@ -827,7 +1157,7 @@ class Spotify(interactions.Extension):
         if votes:
             if votes.get("votes"):
                 conserver, supprimer, menfou, users = count_votes(
-                    votes.get("votes", {}), DISCORD2NAME
+                    votes.get("votes", {}), context.discord2name
                 )
                 # Create a Timestamp object from the date string and a None object if the date is not present
                 date = votes.get("date")
@@ -866,7 +1196,10 @@ class Spotify(interactions.Extension):
         """
         Autocomplete function for the 'songinfo' command.
         """
-        if not ctx.input_text:
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            choices = [{"name": "Aucun résultat", "value": "error"}]
+        elif not ctx.input_text:
             choices = [
                 {
                     "name": "Veuillez entrer un nom de chanson",
@@ -886,13 +1219,13 @@ class Spotify(interactions.Extension):
                     {"artists": {"$regex": regex_pattern, "$options": "i"}},
                 ]
             }
-            # Fetch data from playlist_items_full and votes_db
+            # Fetch data from the playlist and the votes of the guild
             playlist_items = {
-                item["_id"]: item for item in playlist_items_full.find(query)
+                item["_id"]: item async for item in context.playlist_items.find(query)
             }
-            votes = {item["_id"]: item for item in votes_db.find(query)}
+            votes = {item["_id"]: item async for item in context.votes.find(query)}
 
-            # Merge dictionaries. In case of conflict, keep the entry from playlist_items_full
+            # Merge dictionaries. In case of conflict, keep the entry from the playlist
             results = {**playlist_items, **votes}
             if not results:
                 choices = [
@@ -932,9 +1265,8 @@ class Spotify(interactions.Extension):
         autocomplete=True,
     )
     async def addwithvote(self, ctx: interactions.SlashContext, song):
-        if str(ctx.channel_id) == str(CHANNEL_ID):
-            # Get last track IDs from MongoDB
-            last_track_ids = playlist_items_full.distinct("_id")
+        context = self.get_context(ctx.guild_id)
+        if context is not None and str(ctx.channel_id) == str(context.channel_id):
             logger.info(
                 "/addwithvote '%s' utilisé par %s(id:%s)",
                 song,
@@ -943,17 +1275,17 @@ class Spotify(interactions.Extension):
             )
             try:
                 # Get track info from Spotify API
-                track = sp.track(song, market="FR")
+                track = await track_cache.get(song)
                 song = spotifymongoformat(
-                    track, ctx.author_id, spotify2discord=SPOTIFY2DISCORD
+                    track, ctx.author_id, spotify2discord=context.spotify2discord
                 )
             except spotipy.exceptions.SpotifyException:
                 await ctx.send("Cette chanson n'existe pas.", ephemeral=True)
                 logger.info("Commande /addsong utilisée avec une chanson inexistante")
-            data = self.vote_manager.load_data()
-            # List all song_id in data
-            song_ids = list(data.keys())
-            if song["_id"] not in last_track_ids and song["_id"] not in song_ids:
+            if (
+                song["_id"] not in context.index
+                and song["_id"] not in context.vote_manager
+            ):
                 logger.debug("song : %s", song)
                 # Create and send embed message
                 components = [
@@ -996,18 +1328,20 @@ class Spotify(interactions.Extension):
                     embeds=embed,
                     components=components,
                 )
-                # Append the song, message ID and track ID to the votewithadd dictionary
-                data = self.vote_manager.load_data()
-                data[song["_id"]] = {
-                    "channel_id": ctx.channel.id,
-                    "message_id": message.id,
-                    "author_id": ctx.author.id,
-                    "deadline": time.timestamp(),
-                    "votes": {
-                        str(ctx.author.id): "yes",
+                # Open the vote, with the vote of the author
+                await context.vote_manager.open_vote(
+                    song["_id"],
+                    {
+                        "channel_id": ctx.channel.id,
+                        "message_id": message.id,
+                        "author_id": ctx.author.id,
+                        "deadline": time.timestamp(),
+                        "votes": {
+                            str(ctx.author.id): "yes",
+                        },
                     },
-                }
-                self.vote_manager.save_data(data)
+                )
+                await context.schedule_vote_end(song["_id"], time.timestamp())
                 logger.info(
                     "%s ajouté au vote par %s", track["name"], ctx.author.display_name
                 )
@@ -1046,16 +1380,15 @@ class Spotify(interactions.Extension):
             )
             return
         last_votes[user_id] = time.time()
+        context = self.get_context(event.ctx.guild_id)
         # check if the user has already voted and update their vote if necessary
-        data = self.vote_manager.load_data()
-        if vote == "annuler":
-            data[song_id]["votes"].pop(user_id, None)
-            self.vote_manager.save_data(data)
-        else:
-            self.vote_manager.save_vote(user_id, vote, song_id)
+        if context is None or not await context.vote_manager.save_vote(
+            user_id, None if vote == "annuler" else vote, song_id
+        ):
+            await event.ctx.send("Ce vote est terminé.", ephemeral=True)
+            return
         # count the votes
-        data = self.vote_manager.load_data()
-        yes, no, users = self.vote_manager.count_votes(data, song_id)
+        yes, no, users = context.vote_manager.count_votes(song_id)
         # update the message with the vote counts
         users = ", ".join(users)
         embed_original = event.ctx.message.embeds[0]
@@ -1077,67 +1410,38 @@ class Spotify(interactions.Extension):
         logger.info("User %s voted %s", event.ctx.user.username, vote)
 
     @addwithvote.autocomplete("song")
-    async def autocomplete_from_spotify(self, ctx: interactions.AutocompleteContext):
-        """
-        Autocomplete function for the 'addwithvote' command.
-        """
-        if not ctx.input_text:
-            choices = [
-                {
-                    "name": "Veuillez entrer un nom de chanson",
-                    "value": "error",
-                }
-            ]
-        else:
-            # Search for tracks on Spotify
-            items = sp.search(ctx.input_text, limit=10, type="track", market="FR")[
-                "tracks"
-            ]["items"]
-            if not items:
-                choices = [
-                    {
-                        "name": "Aucun résultat",
-                        "value": "error",
-                    }
-                ]
-            else:
-                # Format search results for autocomplete choices
-                choices = [
-                    {
-                        "name": f"{item['artists'][0]['name']} - {item['name']} (Album: {item['album']['name']})"[
-                            :100
-                        ],
-                        "value": item["uri"],
-                    }
-                    for item in items
-                ]
-        await ctx.send(choices=choices)
+    async def autocomplete_addwithvote(self, ctx: interactions.AutocompleteContext):
+        await self.autocomplete_from_spotify(ctx)
 
-    async def endvote(self, song_id: str):
+    async def endvote(self, context: PlaylistContext, song_id: str):
         """
-        End the vote for a given surname.
+        End the vote for a given song.
 
         Args:
-            surname (str): The surname to end the vote for.
+            context (PlaylistContext): The playlist of the guild.
+            song_id (str): The ID of the song to end the vote for.
         """
-        data = self.vote_manager.load_data()
-        yes_votes, no_votes, users = self.vote_manager.count_votes(data, song_id)
+        vote = context.vote_manager.get(song_id)
+        yes_votes, no_votes, users = context.vote_manager.count_votes(song_id)
         # Get the message
-        channel = await self.bot.fetch_channel(data[song_id]["channel_id"])
-        message = await channel.fetch_message(data[song_id]["message_id"])
+        channel = await self.bot.fetch_channel(vote["channel_id"])
+        message = await channel.fetch_message(vote["message_id"])
         try:
             # Get track info from Spotify API
-            track = sp.track(song_id, market="FR")
+            track = await track_cache.get(song_id)
             song = spotifymongoformat(
-                track, data[song_id]["author_id"], spotify2discord=SPOTIFY2DISCORD
+                track, vote["author_id"], spotify2discord=context.spotify2discord
             )
         except spotipy.exceptions.SpotifyException as e:
             logger.error("Spotify API Error while using /addwithvote: %s", e)
         if yes_votes > no_votes:
             # Add song to MongoDB and Spotify playlist
             logger.debug("song : %s", song)
-            playlist_items_full.insert_one(song)
-            sp.playlist_add_items(PLAYLIST_ID, [song["_id"]])
+            await context.playlist_items.insert_one(song)
+            context.index.add(song["_id"], song["added_by"], song["added_at"])
+            await context.stats.refresh([song["added_by"]])
+            await spotify.playlist_add_items(context.playlist_id, [song["_id"]])
+            self.scheduler.poke(context.guild_id)
             await message.edit(
                 content="La chanson a été ajoutée à la playlist.",
                 embeds=[
@@ -1146,7 +1450,7 @@ class Spotify(interactions.Extension):
                         track=track,
                         embedtype=EmbedType.VOTE_WIN,
                         time=interactions.Timestamp.utcnow(),
-                        person=data[song_id]["author_id"],
+                        person=vote["author_id"],
                     ),
                     await embed_message_vote_add(yes_votes, no_votes, users),
                 ],
@@ -1162,75 +1466,211 @@ class Spotify(interactions.Extension):
                         track=track,
                         embedtype=EmbedType.VOTE_LOSE,
                         time=interactions.Timestamp.utcnow(),
-                        person=data[song_id]["author_id"],
+                        person=vote["author_id"],
                     ),
                     await embed_message_vote_add(yes_votes, no_votes, users),
                 ],
                 components=[],
             )
             logger.info("La chanson n'a pas été ajoutée à la playlist.")
-        # Remove the vote from the data dictionary
-        data.pop(song_id)
-        self.vote_manager.save_data(data)
+        # Remove the vote
+        await context.vote_manager.close_vote(song_id)
 
-    @interactions.Task.create(
-        interactions.OrTrigger(
-            *[interactions.TimeTrigger(hour=hour) for hour in range(24)]
-        )
-    )
-    async def check_for_end(self):
+    async def end_vote_timer(self, timer: dict):
         """
-        Check if the vote has ended for each surname and end it if necessary.
+        Ends a vote of /addwithvote at its deadline, called by the timer service.
         """
-        data = self.vote_manager.load_data()
-        songs_to_end = []
-        for song_id in data:
-            if self.vote_manager.check_deadline(song_id):
-                await self.endvote(song_id)
-                songs_to_end.append(song_id)
-        for song_id in songs_to_end:
-            data.pop(song_id)
-        self.vote_manager.save_data(data)
+        context = self.get_context(timer["data"]["guild_id"])
+        song_id = timer["data"]["song_id"]
+        if context is not None and song_id in context.vote_manager:
+            await self.endvote(context, song_id)
 
     @interactions.Task.create(interactions.TimeTrigger(hour=4, minute=30, utc=False))
     async def new_titles_playlist(self):
         logger.debug("new_titles_playlist lancé")
-
-        results = sp.playlist_tracks(playlist_id=PLAYLIST_ID, limit=100, offset=0)
-        tracks = results["items"]
-
-        while results["next"]:
-            results = sp.next(results)
-            tracks.extend(results["items"])
-
-        tracks.reverse()
-
-        new_tracks = []
-        artists = set()
-        for i, track in enumerate(tracks, 1):
-            track_artists = {artist["name"] for artist in track["track"]["artists"]}
-
-            if not artists.intersection(track_artists):
-                new_tracks.append(track["track"]["id"])
-                artists.update(track_artists)
-
-            if len(new_tracks) >= 100:
-                logger.info(
-                    "Playlist 'Les découvertes de la guilde' créée à partir de %s titres",
-                    i,
+        for context in self.contexts.values():
+            if not context.new_playlist_id:
+                continue
+            if not context.mirror.length:
+                logger.warning(
+                    "Playlist de %s pas encore synchronisée, découvertes non générées",
+                    context.guild_id,
                 )
-                break
-
-        sp.playlist_replace_items(NEW_PLAYLIST_ID, new_tracks)
+                continue
+            # Built from the local mirror, refreshed by check_playlist_changes
+            new_tracks = context.mirror.discoveries(100)
+            logger.info(
+                "Playlist 'Les découvertes de la guilde' créée avec %s titres",
+                len(new_tracks),
+            )
+            await spotify.playlist_replace_items(context.new_playlist_id, new_tracks)
 
     @interactions.slash_command(
         name="nextvote",
         description="Force le prochain vote PAS TOUCHE",
         scopes=[DEV_GUILD],
     )
-    async def nextvote(self, ctx: interactions.SlashContext):
+    @interactions.slash_option(
+        name="serveur",
+        description="ID du serveur, le premier serveur activé par défaut",
+        opt_type=interactions.OptionType.STRING,
+        required=False,
+    )
+    async def nextvote(self, ctx: interactions.SlashContext, serveur: str = None):
         """
         Force the next vote for the song of the day.
         """
-        await self.randomvote()
+        context = self.get_context(serveur or ENABLED_SERVERS[0])
+        if context is None:
+            await ctx.send("Ce serveur n'utilise pas la playlist.", ephemeral=True)
+            return
+        await self.song_of_the_day(context)
         await ctx.send("Vote forcé", ephemeral=True)
+
+    @interactions.slash_command(
+        name="playliststats",
+        sub_cmd_name="global",
+        description="Statistiques de la playlist",
+        sub_cmd_description="Affiche les statistiques de la playlist et des membres",
+        scopes=ENABLED_SERVERS,
+    )
+    async def playliststats_global(self, ctx: interactions.SlashContext):
+        """
+        Displays the statistics of the playlist and the contribution of each user.
+        """
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            return
+        summary = await context.stats.get_summary()
+        embed = interactions.Embed(
+            title="Statistiques de la playlist",
+            description="\n".join(
+                [
+                    f"Chansons : **{summary['songs']}**",
+                    f"Durée : {milliseconds_to_string(summary['duration_ms'])}",
+                    f"Votes : {summary['votes']} | Conservées : {summary['kept']}"
+                    f" | Supprimées : {summary['removed']}",
+                    f"Taux de conservation : {format_ratio(keep_ratio(summary))}",
+                ]
+            ),
+            color=0x1DB954,
+        )
+        # An embed holds at most 25 fields
+        for stats in (await context.stats.get_users())[:25]:
+            embed.add_field(
+                name=context.discord2name.get(stats["_id"], stats["_id"]),
+                value=f"{stats['songs']} chanson(s)"
+                f" ({stats['songs'] / max(summary['songs'], 1):.0%})"
+                f"\nConservées : {format_ratio(keep_ratio(stats))}",
+                inline=True,
+            )
+        await ctx.send(embeds=embed)
+
+    @interactions.slash_command(
+        name="playliststats",
+        sub_cmd_name="utilisateur",
+        description="Statistiques de la playlist",
+        sub_cmd_description="Affiche les statistiques d'un membre",
+        scopes=ENABLED_SERVERS,
+    )
+    @interactions.slash_option(
+        "utilisateur",
+        "Membre dont afficher les statistiques",
+        opt_type=interactions.OptionType.USER,
+        required=False,
+    )
+    async def playliststats_user(
+        self, ctx: interactions.SlashContext, utilisateur: interactions.User = None
+    ):
+        """
+        Displays the contribution of a user to the playlist and the fate of their songs.
+
+        Args:
+            ctx (interactions.SlashContext): The context of the slash command.
+            utilisateur (interactions.User, optional): The user, defaults to the author.
+        """
+        context = self.get_context(ctx.guild_id)
+        if context is None:
+            return
+        user = utilisateur or ctx.author
+        stats = await context.stats.get_user(str(user.id))
+        summary = await context.stats.get_summary()
+        name = context.discord2name.get(str(user.id), user.display_name)
+        embed = interactions.Embed(
+            title=f"Statistiques de {name}",
+            description="\n".join(
+                [
+                    f"Chansons : **{stats['songs']}** ("
+                    f"{stats['songs'] / max(summary['songs'], 1):.0%} de la playlist)",
+                    f"Durée : {milliseconds_to_string(stats['duration_ms'])}",
+                    f"Votes : {stats['votes']} | Conservées : {stats['kept']}"
+                    f" | Supprimées : {stats['removed']}",
+                    f"Taux de conservation : {format_ratio(keep_ratio(stats))}",
+                ]
+            ),
+            color=0x1DB954,
+        )
+        await ctx.send(embeds=embed)
+
+    @interactions.slash_command(
+        name="spotifymetrics",
+        description="Affiche les statistiques des caches Spotify",
+        scopes=[DEV_GUILD],
+    )
+    async def spotifymetrics(self, ctx: interactions.SlashContext):
+        """
+        Displays the metrics of the Spotify caches.
+        """
+        stats = search_cache.stats()
+        track_stats = track_cache.stats()
+        embed = interactions.Embed(title="Caches Spotify", color=0x1DB954)
+        embed.add_field(
+            name="Recherche (autocomplete)",
+            value="\n".join(
+                [
+                    f"Taux de réponse immédiate : **{stats['hit_rate']:.0%}**",
+                    f"Hits : {stats['hits']} | Préfixes : {stats['prefix_hits']}"
+                    f" | Misses : {stats['misses']}",
+                    f"Requêtes Spotify : {stats['requests']}"
+                    f" | Entrées : {stats['entries']}",
+                ]
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Chansons",
+            value="\n".join(
+                [
+                    f"Taux de hit : **{track_stats['hit_rate']:.0%}**",
+                    f"Mémoire : {track_stats['memory_hits']}"
+                    f" | MongoDB : {track_stats['store_hits']}"
+                    f" | Misses : {track_stats['misses']}",
+                    f"Requêtes Spotify par jour : {track_stats['requests_per_day']:.0f}"
+                    f" (évitées : {track_stats['avoided_per_day']:.0f})",
+                ]
+            ),
+            inline=False,
+        )
+        # Polls a fixed one-minute interval per playlist would have made over the
+        # same period, the counter covering every guild
+        baseline = (
+            (time.time() - poll_metrics["started"]) / 60 * len(self.contexts)
+        )
+        embed.add_field(
+            name="Surveillance de la playlist",
+            value="\n".join(
+                [
+                    *(
+                        f"Intervalle actuel ({guild_id}) : "
+                        f"{format_interval(context.trigger.interval)}"
+                        for guild_id, context in self.contexts.items()
+                    ),
+                    f"Vérifications : {poll_metrics['polls']}"
+                    f" (économisées : {max(baseline - poll_metrics['polls'], 0):.0f})",
+                    f"Messages récap : {poll_metrics['patches']}"
+                    f" (évités : {poll_metrics['patches_skipped']})",
+                ]
+            ),
+            inline=False,
+        )
+        await ctx.send(embeds=embed, ephemeral=True)
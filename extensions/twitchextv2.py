@@ -2,7 +2,6 @@ import asyncio
 import os
 import signal
 from datetime import datetime, timedelta
-import json
 from typing import Optional, Union
 
 import pytz
@@ -45,9 +44,12 @@ from twitchAPI.twitch import Twitch
 from twitchAPI.type import AuthScope, TwitchResourceNotFound
 
 from src import logutil
+from src.statestore import get_state_store
 from src.utils import load_config
 
 logger = logutil.init_logger(os.path.basename(__file__))
+# Known emotes of the channel, their ID mapped to their name
+EMOTES_NAMESPACE = "twitch_emotes"
 
 
 class TwitchExt2(Extension):
@@ -92,6 +94,7 @@ class TwitchExt2(Extension):
             creator = await event.creator
             if creator.id == self.bot.user.id:
                 self.scheduled_event = event
+        await get_state_store().migrate_json(EMOTES_NAMESPACE, "data/emotes.json")
         self.check_new_emotes.start()
         logger.info("Starting TwitchExt2")
         # asyncio.create_task(self.run())
@@ -540,9 +543,9 @@ class TwitchExt2(Extension):
     async def check_new_emotes(self):
         logger.debug("Checking new emotes")
         emotes = await self.twitch.get_channel_emotes(self.user_id)
-        # load the emotes from data/emotes.json
-        with open("data/emotes.json", "r") as file:
-            data = json.load(file)
+        # load the known emotes from the state store
+        store = get_state_store()
+        data = await store.items(EMOTES_NAMESPACE)
         # check if there are new emotes
         new_emotes = [emote for emote in emotes if emote.id not in data]
         # Check if there are deleted emotes
@@ -597,6 +600,9 @@ class TwitchExt2(Extension):
                 await self.notif_channel.send(embed=embed)
                 del data[emote]
         if new_emotes or deleted_emotes:
-            # Save the new emotes
-            with open("data/emotes.json", "w") as file:
-                json.dump(data, file, indent=4)
+            # Save only the emotes that changed
+            await store.update(
+                EMOTES_NAMESPACE,
+                {emote.id: emote.name for emote in new_emotes},
+                deleted_emotes,
+            )
@@ -8,6 +8,7 @@ import aiohttp
 from interactions import Extension, listen, Task, IntervalTrigger, Client
 
 from src import logutil
+from src.httpclient import get_session
 from src.utils import load_config
 
 logger = logutil.init_logger(os.path.basename(__file__))
@@ -33,14 +34,13 @@ class Uptime(Extension):
         """
         Perform status checks and gather information about your service/script's status.
         """
-        async with aiohttp.ClientSession() as session:
-            try:
-                # Create the URL
-                url = f"https://{config['uptimeKumaUrl']}/api/push/{config['uptimeKumaToken']}?status=up&msg=OK&ping={round(self.bot.latency * 1000, 1)}"
+        try:
+            # Create the URL
+            url = f"https://{config['uptimeKumaUrl']}/api/push/{config['uptimeKumaToken']}?status=up&msg=OK&ping={round(self.bot.latency * 1000, 1)}"
 
-                # Send the status update
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    logger.debug("Status update sent successfully.")
-            except aiohttp.ClientError as error:
-                logger.error("Error sending status update: %s", error)
+            # Send the status update
+            async with get_session().get(url) as response:
+                response.raise_for_status()
+                logger.debug("Status update sent successfully.")
+        except aiohttp.ClientError as error:
+            logger.error("Error sending status update: %s", error)
@@ -1,6 +1,5 @@
 import asyncio
 import os
-import uuid
 import json
 from dateutil.relativedelta import relativedelta
 from interactions import (
@@ -20,8 +19,6 @@ from interactions import (
     slash_default_member_permission,
     slash_option,
     Button,
-    Task,
-    IntervalTrigger,
     ActionRow,
     ButtonStyle,
     User,
@@ -36,23 +33,29 @@ from interactions.api.events import (
 from interactions.client.utils import timestamp_converter
 from datetime import datetime, timedelta
 from src import logutil
-from src.utils import format_poll, load_config
+from src.polls import POLL_COLOR, PollStore, is_poll
+from src.statestore import get_state_store
+from src.timers import TIME_FORMAT, get_timers
+from src.utils import load_config
 
 logger = logutil.init_logger(os.path.basename(__file__))
 config, module_config, enabled_servers = load_config("moduleUtils")
-# Keep track of reminders
-reminders = {}
+# Kind of the timers of /reminder
+REMINDER = "reminder"
 
 
 class Utils(Extension):
     def __init__(self, bot: client):
         self.bot: Client = bot
-        self.lock = asyncio.Lock()
+        self.polls = PollStore(bot, get_state_store(), config["discord2name"])
 
     @listen()
     async def on_startup(self):
-        await self.load_reminders()
-        self.check_reminders.start()
+        await self.migrate_reminders()
+        timers = get_timers()
+        timers.register(REMINDER, self.send_reminder)
+        timers.start()
+        await self.polls.load()
 
     @slash_command(
         name="ping", description="Vérifier la latence du bot", scopes=enabled_servers
@@ -256,13 +259,14 @@ class Utils(Extension):
             description="\n\n".join(
                 [f"{emojis[i]} {option}" for i, option in enumerate(options)]
             ),
-            color=0x3489EB,
+            color=POLL_COLOR,
         )
         embed.set_footer(
             text=f"Créé par {ctx.user.username} (ID: {ctx.user.id})",
             icon_url=ctx.user.avatar_url,
         )
         message = await ctx.send(embed=embed)
+        await self.polls.add(message)
         for i in range(len(options)):
             await message.add_reaction(emojis[i])
         logger.debug(
@@ -278,42 +282,32 @@ class Utils(Extension):
         """
         Count reactions and update the poll embed
         """
-        async with self.lock:
-            logger.debug(
-                "Reaction added : %s\npoll message id : %s\nperson : %s\nreaction : %s",
-                event.emoji,
-                event.message,
-                event.author,
-                event.reaction,
-            )
-            if len(event.message.embeds) == 0:
-                return
-            # Check if the message is a poll
-            if event.message.embeds[0].color == 0x3489EB:
-                # Create the poll embed
-                embed = await format_poll(event, config)
-                await event.message.edit(embed=embed)
+        logger.debug(
+            "Reaction added : %s\npoll message id : %s\nperson : %s\nreaction : %s",
+            event.emoji,
+            event.message,
+            event.author,
+            event.reaction,
+        )
+        await self.polls.on_reaction(
+            event.message, str(event.emoji), event.author, added=True
+        )
 
     @listen(MessageReactionRemove)
     async def on_message_reaction_remove(self, event: MessageReactionRemove):
         """
         Count reactions and update the poll embed
         """
-        async with self.lock:
-            logger.debug(
-                "Reaction removed : %s\npoll message id : %s\nperson : %s\nreaction : %s",
-                event.emoji,
-                event.message,
-                event.author,
-                event.reaction,
-            )
-            if len(event.message.embeds) == 0:
-                return
-            # Check if the message is a poll
-            if event.message.embeds[0].color == 0x3489EB:
-                # Create the poll embed
-                embed = await format_poll(event, config)
-                await event.message.edit(embed=embed)
+        logger.debug(
+            "Reaction removed : %s\npoll message id : %s\nperson : %s\nreaction : %s",
+            event.emoji,
+            event.message,
+            event.author,
+            event.reaction,
+        )
+        await self.polls.on_reaction(
+            event.message, str(event.emoji), event.author, added=False
+        )
 
     @slash_command(
         name="editpoll", description="Modifier un sondage", scopes=enabled_servers
@@ -380,7 +374,7 @@ class Utils(Extension):
                 ephemeral=True,
             )
             return
-        if message.embeds[0].color != 0x3489EB:
+        if not is_poll(message):
             await ctx.send(
                 "Vous ne pouvez modifier que les sondages créés par le bot",
                 ephemeral=True,
@@ -441,7 +435,9 @@ class Utils(Extension):
             for i in range(len(embed.description.split("\n\n"))):
                 await message.add_reaction(emojis[i])
 
-        await message.edit(embed=embed)
+        message = await message.edit(embed=embed)
+        # The options or the reactions may have changed
+        await self.polls.reload(message)
         logger.info("Poll edited")
         await ctx.send("Sondage modifié", ephemeral=True)
 
@@ -465,34 +461,37 @@ class Utils(Extension):
     #         )
 
     # Create a set of commands to define daily tasks
-    async def load_reminders(self):
+    async def migrate_reminders(self):
         """
-        Load reminders from a JSON file and populate the reminders dictionary.
+        Moves the reminders of the former JSON file to the timer service, once.
         """
+        path = f"{config['misc']['dataFolder']}/taskreminders.json"
         try:
-            with open(
-                f"{config['misc']['dataFolder']}/taskreminders.json",
-                "r",
-                encoding="utf-8",
-            ) as file:
+            with open(path, "r", encoding="utf-8") as file:
                 reminders_data = json.load(file)
-                for remind_time_str, user_reminders in reminders_data.items():
-                    remind_time = datetime.strptime(
-                        remind_time_str, "%Y-%m-%d %H:%M:%S"
-                    )
-                    reminders[remind_time] = user_reminders
-            logger.debug(reminders)
         except FileNotFoundError:
-            pass
+            return
+        timers = get_timers()
+        for remind_time_str, user_reminders in reminders_data.items():
+            remind_time = datetime.strptime(remind_time_str, TIME_FORMAT)
+            for user_id, reminder_list in user_reminders.items():
+                for reminder in reminder_list:
+                    await timers.schedule(
+                        REMINDER,
+                        remind_time,
+                        {"user_id": user_id, "message": reminder["message"]},
+                        every=reminder.get("frequency"),
+                    )
+        os.replace(path, f"{path}.migrated")
+        logger.info("Reminders moved to the timer service")
 
-    async def save_reminders(self):
-        reminders_data = {}
-        for remind_time, user_reminders in reminders.items():
-            reminders_data[remind_time.strftime("%Y-%m-%d %H:%M:%S")] = user_reminders
-        with open(
-            f"{config['misc']['dataFolder']}/taskreminders.json", "w", encoding="utf-8"
-        ) as file:
-            json.dump(reminders_data, file, indent=4)
+    async def send_reminder(self, timer: dict):
+        """
+        Sends a reminder to its user, called by the timer service when it is due.
+        """
+        user = await self.bot.fetch_user(timer["data"]["user_id"])
+        await user.send(timer["data"]["message"])
+        logger.info(f"Reminder sent to {user.global_name}: {timer['data']['message']}")
 
     # Set reminder
     @slash_command(
@@ -592,25 +591,14 @@ class Utils(Extension):
             elif frequency == "yearly":
                 remind_time += relativedelta(years=1)
 
-        # Check if there are reminders for this remind_time, if not, initialize it
-        if remind_time not in reminders:
-            reminders[remind_time] = {}
-
-        # Get the user's ID
-        user_id = str(ctx.author.id)
-
-        # Check if there are reminders for this user at this remind_time, if not, initialize it
-        if user_id not in reminders[remind_time]:
-            reminders[remind_time][user_id] = []
-
-        # Append the new reminder for this user at this remind_time
-        reminders[remind_time][user_id].append(
-            {"message": task, "frequency": frequency}
+        # Schedule the reminder, it is persisted by the timer service
+        await get_timers().schedule(
+            REMINDER,
+            remind_time,
+            {"user_id": str(ctx.author.id), "message": task},
+            every=frequency,
         )
 
-        # Save the reminders
-        await self.save_reminders()
-
         # Send confirmation message
         await ctx.send(
             f"Rappel {frequency} créé à {remind_time.strftime('%H:%M')} avec le message: {task}",
@@ -631,32 +619,34 @@ class Utils(Extension):
     async def delete_reminder(self, ctx):
         user_id = str(ctx.author.id)
         buttons = []
-        uuid_reminder_map = {}
-        # Iterate through reminders to find user's reminders
-        for remind_time, user_reminders in reminders.items():
-            if user_id in user_reminders:
-                for reminder in user_reminders[user_id]:
-                    reminder_id = str(uuid.uuid4())
-                    logger.debug(reminder)
-                    if reminder["frequency"] == "daily":
-                        label = f"{reminder['message']:40} (Tous les jours à {remind_time.strftime('%H:%M')})"
-                    elif reminder["frequency"] == "weekly":
-                        label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%A')} à {remind_time.strftime('%H:%M')})"
-                    elif reminder["frequency"] == "monthly":
-                        label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%d')} à {remind_time.strftime('%H:%M')})"
-                    elif reminder["frequency"] == "yearly":
-                        label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%d/%m')} à {remind_time.strftime('%H:%M')})"
-                    else:
-                        label = f"{reminder['message']:40} ({remind_time.strftime('%H:%M')})"
-                    buttons.append(
-                        Button(
-                            label=label,
-                            style=ButtonStyle.SECONDARY,
-                            custom_id=reminder_id,
-                        )
-                    )
-                    # Map UUID to reminder
-                    uuid_reminder_map[reminder_id] = (remind_time, reminder)
+        reminder_map = {}
+        # Find the user's reminders among the timers
+        for timer_id, timer in await get_timers().find(REMINDER, user_id=user_id):
+            remind_time = datetime.strptime(timer["due"], TIME_FORMAT)
+            reminder = {
+                "message": timer["data"]["message"],
+                "frequency": timer["every"],
+            }
+            logger.debug(reminder)
+            if reminder["frequency"] == "daily":
+                label = f"{reminder['message']:40} (Tous les jours à {remind_time.strftime('%H:%M')})"
+            elif reminder["frequency"] == "weekly":
+                label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%A')} à {remind_time.strftime('%H:%M')})"
+            elif reminder["frequency"] == "monthly":
+                label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%d')} à {remind_time.strftime('%H:%M')})"
+            elif reminder["frequency"] == "yearly":
+                label = f"{reminder['message']:40} (Tous les {remind_time.strftime('%d/%m')} à {remind_time.strftime('%H:%M')})"
+            else:
+                label = f"{reminder['message']:40} ({remind_time.strftime('%H:%M')})"
+            buttons.append(
+                Button(
+                    label=label,
+                    style=ButtonStyle.SECONDARY,
+                    custom_id=timer_id,
+                )
+            )
+            # Map the button to the timer
+            reminder_map[timer_id] = remind_time
 
         if not buttons:
             await ctx.send("Tu n'as aucun rappel", ephemeral=True)
@@ -674,18 +664,12 @@ class Utils(Extension):
                 components=[button.custom_id for button in buttons], timeout=60
             )
             ctx = button_ctx.ctx
-            # Find selected reminder using UUID
-            selected_reminder_data = uuid_reminder_map.get(ctx.custom_id)
+            # Find selected reminder using its timer ID
+            remind_time = reminder_map.get(ctx.custom_id)
 
-            if selected_reminder_data:
-                remind_time, selected_reminder = selected_reminder_data
+            if remind_time:
                 # Remove selected reminder
-                reminders[remind_time][user_id].remove(selected_reminder)
-                if not reminders[remind_time][user_id]:
-                    del reminders[remind_time][user_id]
-                    if not reminders[remind_time]:
-                        del reminders[remind_time]
-                await self.save_reminders()
+                await get_timers().cancel(ctx.custom_id)
                 await ctx.edit_origin(
                     content=f"Rappel à {remind_time.strftime('%H:%M')} supprimé.",
                     components=[],
@@ -702,41 +686,3 @@ class Utils(Extension):
                 content="Annulé, aucun rappel sélectionné", components=[]
             )
 
-    @Task.create(IntervalTrigger(minutes=1))
-    async def check_reminders(self):
-        current_time = datetime.now()
-        reminders_to_remove = set()
-        reminders_to_add = {}
-
-        for remind_time, user_reminders in reminders.copy().items():
-            if remind_time <= current_time:
-                for user_id, reminder_list in user_reminders.items():
-                    user = await self.bot.fetch_user(user_id)
-                    for reminder in reminder_list:
-                        await user.send(reminder["message"])
-                        logger.info(
-                            f"Reminder sent to {user.global_name}: {reminder['message']}"
-                        )
-                reminders_to_remove.add(remind_time)
-                frequency = reminder.get("frequency")
-                if frequency == "daily":
-                    reminders_to_add[remind_time + timedelta(days=1)] = user_reminders
-                elif frequency == "weekly":
-                    reminders_to_add[remind_time + timedelta(weeks=1)] = user_reminders
-                elif frequency == "monthly":
-                    reminders_to_add[remind_time + relativedelta(months=1)] = (
-                        user_reminders
-                    )
-                elif frequency == "yearly":
-                    reminders_to_add[remind_time + relativedelta(years=1)] = (
-                        user_reminders
-                    )
-
-        if reminders_to_remove:
-            for remind_time in reminders_to_remove:
-                del reminders[remind_time]
-        if reminders_to_add:
-            reminders.update(reminders_to_add)
-        if reminders_to_remove or reminders_to_add:
-            await self.save_reminders()
-
@@ -3,7 +3,6 @@ import random
 from datetime import datetime
 from typing import Optional
 
-import pymongo
 import pytz
 from interactions import (
     BaseChannel,
@@ -12,6 +11,7 @@ from interactions import (
     Embed,
     Extension,
     Guild,
+    IntervalTrigger,
     Message,
     OptionType,
     SlashContext,
@@ -27,7 +27,11 @@ from interactions.api.events import MessageCreate
 from interactions.ext import paginators
 
 from src import logutil
-from src.utils import format_number, load_config
+from src.leveling import XP_CURVE
+from src.lifecycle import on_shutdown
+from src.mongodb import get_database
+from src.utils import UserCache, load_config
+from src.xp import LeaderboardSnapshot, XpCache
 
 logger = logutil.init_logger(os.path.basename(__file__))
 config, module_config, enabled_servers = load_config("moduleXp")
@@ -36,20 +40,24 @@ config, module_config, enabled_servers = load_config("moduleXp")
 class XP(Extension):
     def __init__(self, bot: client):
         self.bot: Client = bot
-        # Connect to MongoDB
-        mongo_client = pymongo.MongoClient(config.get("mongodb", "").get("url", ""))
-        self.db = mongo_client["Playlist"]
+        self.db = get_database("Playlist")
+        self.xp_cache = XpCache(self.db)
+        on_shutdown(self.xp_cache.flush)
+        self.leaderboard_snapshot = LeaderboardSnapshot(self.xp_cache, UserCache(bot))
         logger.debug("enabled_servers for XP module: %s", enabled_servers)
 
     @listen()
     async def on_startup(self):
+        for guild in enabled_servers:
+            await self.xp_cache.load(guild)
+        self.flush_xp.start()
         self.leaderboardpermanent.start()
         await self.leaderboardpermanent()
 
     @listen()
     async def on_message(self, event: MessageCreate):
         """
-        A listener that gives XP to a user when they send a message using MongoDB to store levels.
+        A listener that gives XP to a user when they send a message, using the in-memory XP cache.
 
         Parameters:
         -----------
@@ -76,61 +84,34 @@ class XP(Extension):
         if guild not in enabled_servers:
             logger.debug("Message was not from a guild with XP enabled.")
             return
-        # Create a new entry for the guild if it doesn't exist.
-        if guild not in self.db.list_collection_names():
-            self.db.create_collection(guild)
-            logger.debug("Created a new collection for %s.", event.message.guild.name)
-        # Find the user in the database and create a new entry if they don't exist.
-        stats = self.db[guild].find_one({"_id": user})
+        await self.xp_cache.load(guild)
+        stats = self.xp_cache.add_message(
+            guild,
+            user,
+            event.message.created_at.timestamp(),
+            random.randint(15, 25),
+        )
         if stats is None:
-            newuser = {
-                "_id": user,
-                "xp": random.randint(15, 25),
-                "time": event.message.created_at.timestamp(),
-                "msg": 1,
-                "lvl": 0,
-            }
-            self.db[guild].insert_one(newuser)
-            logger.debug("Added %s to the database.", user)
-        else:
-            if event.message.created_at.timestamp() - stats["time"] < 60:
-                logger.debug("No XP given to %s due to cooldown.", user)
-                return
-            # Add XP to the user and update the database.
-            xp = stats["xp"] + random.randint(15, 25)
-            msg = stats["msg"] + 1
-            self.db[str(guild)].update_one(
-                {"_id": user},
-                {
-                    "$set": {
-                        "xp": xp,
-                        "time": event.message.created_at.timestamp(),
-                        "msg": msg,
-                    }
-                },
+            logger.debug("No XP given to %s due to cooldown.", user)
+            return
+        logger.debug("Gave %s XP.", user)
+        lvl = XP_CURVE.level(stats["xp"])[0]
+        if lvl > stats["lvl"]:
+            self.xp_cache.set_level(guild, user, lvl)
+            logger.debug("%s is now level {lvl}.", user)
+            # Send a message if the user levels up.
+            lvlupmessages = module_config[guild].get(
+                "levelUpMessageList",
+                ["Bravo {mention}, tu as atteint le niveau {lvl} !"],
+            )
+            weights = module_config[guild].get("levelUpMessageWeights", len(lvlupmessages) * [1])
+            message = random.choices(lvlupmessages, weights=weights)[0]
+            logger.debug("Messages: %s\nWeights: %s", message, weights)
+            filled_message = message.format(
+                mention=event.message.author.mention,
+                lvl=lvl,
             )
-            logger.debug("Gave %s XP.", user)
-            calculate_level_result = await self.calculate_level(xp)
-            lvl = calculate_level_result[0]
-            oldlvl = stats["lvl"]
-            if lvl > oldlvl:
-                self.db[guild].update_one(
-                    {"_id": user}, {"$set": {"lvl": lvl}}, upsert=True
-                )
-                logger.debug("%s is now level {lvl}.", user)
-                # Send a message if the user levels up.
-                lvlupmessages = module_config[guild].get(
-                    "levelUpMessageList",
-                    ["Bravo {mention}, tu as atteint le niveau {lvl} !"],
-                )
-                weights = module_config[guild].get("levelUpMessageWeights", len(lvlupmessages) * [1])
-                message = random.choices(lvlupmessages, weights=weights)[0]
-                logger.debug("Messages: %s\nWeights: %s", message, weights)
-                filled_message = message.format(
-                    mention=event.message.author.mention,
-                    lvl=lvl,
-                )
-                await event.message.channel.send(filled_message)
+            await event.message.channel.send(filled_message)
 
     @slash_command(
         name="rank",
@@ -160,19 +141,15 @@ class XP(Extension):
         """
         if utilisateur is None:
             utilisateur = ctx.author
-        stats = self.db[str(ctx.guild.id)].find_one({"_id": str(utilisateur.id)})
+        await self.xp_cache.load(str(ctx.guild.id))
+        stats = self.xp_cache.get(str(ctx.guild.id), str(utilisateur.id))
         if stats is None:
             await ctx.send(f"{utilisateur.mention} n'a pas encore de niveau.")
         else:
             xp = stats["xp"]
-            lvl, xp_in_level, xp_max = await self.calculate_level(xp)
+            lvl, xp_in_level, xp_max = XP_CURVE.level(xp)
             boxes = int(round((xp_in_level / xp_max) * 10, 0))
-            rankings = self.db[str(ctx.guild.id)].find().sort("xp", -1)
-            rank = 0
-            for x in rankings:
-                rank += 1
-                if str(utilisateur.id) == x["_id"]:
-                    break
+            rank = self.xp_cache.rank(str(ctx.guild.id), str(utilisateur.id))
             embed = Embed(
                 title=f"Statistiques de {utilisateur.username}",
                 color=0x00FF00,
@@ -209,53 +186,18 @@ class XP(Extension):
         ctx : interactions.SlashContext
             The context of the slash command.
         """
-        rankings = self.db[str(ctx.guild.id)].find().sort("xp", -1)
-        i = 0
-        embeds = []
-        embed = Embed(
-            title=f"Classement de {ctx.guild.name}",
-            color=0x00FF00,
-            timestamp=datetime.now(pytz.timezone("Europe/Paris")),
-        )
-        for x in rankings:
-            try:
-                temp = ctx.guild.get_member(x["_id"])
-                if temp is None:
-                    temp = await ctx.bot.fetch_user(x["_id"])
-                    if temp is None:
-                        temp["username"] = "Utilisateur inconnu"
-                        temp["display_name"] = "Utilisateur inconnu"
-                tempxp = x["xp"]
-                lvl, xp_in_level, xp_max = await self.calculate_level(tempxp)
-                if i == 0 or i == 1 or i == 2:
-                    text = ["🥇", "🥈", "🥉"][i]
-                else:
-                    text = f"{i+1} -"
-
-                temppercentage = f"({(xp_in_level/xp_max*100):.0f}"
-                embed.add_field(
-                    name=f"{text} {temp.display_name} ({temp.username})",
-                    value=f"`Niveau {str(lvl).rjust(2)} {temppercentage.rjust(3)} %) | XP : {str(format_number(tempxp).rjust(7))} | {str(format_number(x['msg'])).rjust(5)} messages`",
-                    inline=False,
-                )
-                if (
-                    i % 10 == 0 and i != 0
-                ):  # If we've added 10 fields, create a new embed
-                    embeds.append(embed)
-                    embed = Embed(
-                        title=f"Classement de {ctx.guild.name} (cont.)",
-                        color=0x00FF00,
-                        timestamp=datetime.now(pytz.timezone("Europe/Paris")),
-                    )
-                i += 1
-            except KeyError:
-                pass
-        embeds.append(embed)  # Add the last embed
-
+        embeds = await self.leaderboard_snapshot.render(ctx.guild)
         paginator = CustomPaginator.create_from_embeds(self.bot, *embeds, timeout=3600)
         # add the callback button and function to update the leaderboard
         await paginator.send(ctx)
 
+    @Task.create(IntervalTrigger(seconds=10))
+    async def flush_xp(self):
+        """
+        Writes the XP gained since the last flush to MongoDB.
+        """
+        await self.xp_cache.flush()
+
     @Task.create(TimeTrigger(utc=False))
     async def leaderboardpermanent(self):
         """
@@ -275,49 +217,8 @@ class XP(Extension):
             message: Message = await channel.fetch_message(
                 module_config[str(guild.id)]["xpMessageId"]
             )
-            rankings = self.db[str(guild.id)].find().sort("xp", -1)
-            i = 0
-            embeds = []
-            embed = Embed(
-                title=f"Classement de {guild.name}",
-                color=0x00FF00,
-                timestamp=datetime.now(pytz.timezone("Europe/Paris")),
-            )
-            for x in rankings:
-                try:
-                    temp = guild.get_member(x["_id"])
-                    if temp is None:
-                        temp = await self.bot.fetch_user(x["_id"])
-                        if temp is None:
-                            temp["username"] = "Utilisateur inconnu"
-                            temp["display_name"] = "Utilisateur inconnu"
-                    tempxp = x["xp"]
-                    lvl, xp_in_level, xp_max = await self.calculate_level(tempxp)
-                    if i == 0 or i == 1 or i == 2:
-                        text = ["🥇", "🥈", "🥉"][i]
-                    else:
-                        text = f"{i+1} -"
-
-                    temppercentage = f"({(xp_in_level/xp_max*100):.0f}"
-                    embed.add_field(
-                        name=f"{text} {temp.display_name} ({temp.username})",
-                        value=f"`Niveau {str(lvl).rjust(2)} {temppercentage.rjust(3)} %) | XP : {str(format_number(tempxp).rjust(7))} | {str(format_number(x['msg'])).rjust(5)} messages`",
-                        inline=False,
-                    )
-                    if (
-                        i % 10 == 0 and i != 0
-                    ):  # If we've added 10 fields, create a new embed
-                        embeds.append(embed)
-                        embed = Embed(
-                            title=f"Classement de {guild.name} (cont.)",
-                            color=0x00FF00,
-                            timestamp=datetime.now(pytz.timezone("Europe/Paris")),
-                        )
-                    i += 1
-                except KeyError:
-                    pass
-            embeds.append(embed)  # Add the last embed
-
+            # Rebuild every page once a day to pick up the new user names
+            embeds = await self.leaderboard_snapshot.render(guild, refresh=True)
             paginator = CustomPaginator.create_from_embeds(self.bot, *embeds)
             # add the callback button and function to update the leaderboard
             logger.debug("Updating leaderboard for %s", guild.name)
@@ -327,28 +228,6 @@ class XP(Extension):
                 components=paginator.to_dict()["components"],
             )
 
-    async def calculate_level(self, xp):
-        """
-        Calculates the level, XP within the level, and maximum XP for the given XP value.
-        XP required to level up is 5x^2 + 50x  + 100 where x is the level.
-
-        Args:
-            xp (int): The XP value to calculate the level for.
-
-        Returns:
-            tuple: A tuple containing the level, XP within the level, and maximum XP for the level.
-        """
-        level = 0
-        while True:
-            if xp < ((5 * (level**2)) + (50 * level) + 100):
-                break
-            else:
-                xp -= (5 * ((level) ** 2)) + (50 * (level) + 100)
-            level += 1
-        xp_max = (5 * (level**2)) + (50 * level) + 100
-        xp_in_level = xp
-        return level, xp_in_level, xp_max
-
 
 class CustomPaginator(paginators.Paginator):
     # Override the functions here
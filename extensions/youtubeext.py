@@ -1,5 +1,4 @@
 import datetime
-import json
 import os
 
 import aiohttp
@@ -7,6 +6,7 @@ import isodate
 from interactions import BaseChannel, Client, Extension, IntervalTrigger, Task, listen
 
 from src import logutil
+from src.statestore import get_state_store
 from src.utils import load_config, fetch
 
 logger = logutil.init_logger(os.path.basename(__file__))
@@ -14,6 +14,8 @@ config, module_config, enabled_servers = load_config("moduleYoutube")
 
 YOUTUBE_API_KEY = config["youtube"]["youtubeApiKey"]
 YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+# Last video seen for each channel, one key per server in the state store
+NAMESPACE = "youtube"
 
 
 class YoutubeClass(Extension):
@@ -23,6 +25,7 @@ class YoutubeClass(Extension):
 
     @listen()
     async def on_startup(self):
+        await get_state_store().migrate_json(NAMESPACE, "data/youtube.json")
         self.check_youtube.start()
         # await self.check_youtube()
 
@@ -38,15 +41,13 @@ class YoutubeClass(Extension):
             for user in module_config[str(server)]["youtubeChannelList"]:
                 uploads = await self.get_uploads(user)
                 video_id = await self.get_video_id(uploads)
-                youtube_data = self.get_youtube_data()
-                if self.is_video_already_checked(server, user, video_id, youtube_data):
+                youtube_data = await self.get_youtube_data(server)
+                if youtube_data.get(user) == video_id:
                     continue
-                youtube_data = self.update_youtube_data(
-                    server, user, video_id, youtube_data
-                )
+                youtube_data[user] = video_id
                 if await self.is_video_valid(video_id):
                     await channel.send(f"https://www.youtube.com/watch?v={video_id}")
-                self.save_youtube_data(youtube_data)
+                await self.save_youtube_data(server, youtube_data)
 
     async def get_uploads(self, user):
         if user not in self.playlist_cache:
@@ -65,24 +66,8 @@ class YoutubeClass(Extension):
         logger.debug(data)
         return data["items"][0]["snippet"]["resourceId"]["videoId"]
 
-    def get_youtube_data(self):
-        try:
-            with open("data/youtube.json", "r", encoding="utf-8") as file:
-                return json.load(file)
-        except FileNotFoundError:
-            return {}
-
-    def is_video_already_checked(self, server, user, video_id, youtube_data):
-        return (
-            str(server) in youtube_data
-            and user in youtube_data[str(server)]
-            and youtube_data[str(server)][user] == video_id
-        )
-
-    def update_youtube_data(self, server, user, video_id, youtube_data):
-        youtube_data[str(server)] = youtube_data.get(str(server), {})
-        youtube_data[str(server)][user] = video_id
-        return youtube_data
+    async def get_youtube_data(self, server):
+        return await get_state_store().get(NAMESPACE, str(server), {})
 
     async def is_video_valid(self, video_id):
         url = f"{YOUTUBE_API_URL}/videos?part=snippet,contentDetails&id={video_id}&key={YOUTUBE_API_KEY}"
@@ -100,6 +85,5 @@ class YoutubeClass(Extension):
             logger.info("New video is a live stream")
         return False
 
-    def save_youtube_data(self, youtube_data):
-        with open("data/youtube.json", "w", encoding="utf-8") as file:
-            json.dump(youtube_data, file, indent=4)
+    async def save_youtube_data(self, server, youtube_data):
+        await get_state_store().set(NAMESPACE, str(server), youtube_data)
@@ -4,13 +4,18 @@ Main script to run
 This script initializes extensions and starts the bot
 """
 
+import asyncio
+import contextlib
 import os
+import signal
 import sys
 
 import interactions
 
 from config import DEBUG
-from src import logutil
+from src import lifecycle, logutil
+from src.configstore import config_store
+from src.startup import StartupProfiler
 from src.utils import load_config
 
 config,_,_ = load_config()
@@ -52,10 +57,35 @@ extensions = [
     for f in os.listdir("extensions")
     if f.endswith(".py") and not f.startswith("_")
 ]
-for extension in extensions:
+# Import them in parallel, and log how long each one takes to start
+StartupProfiler(client).load_extensions(extensions)
+
+
+async def main():
+    """Runs the bot until it stops, then releases the shared resources"""
+    loop = asyncio.get_running_loop()
+    # Docker stops the container with SIGTERM, stop the bot cleanly on it
+    with contextlib.suppress(NotImplementedError):
+        loop.add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.ensure_future(client.stop())
+        )
+    # Reload config/config.json when it is edited, without restarting the bot
+    config_watcher = asyncio.create_task(config_store.watch())
     try:
-        client.load_extension(extension)
-        logger.info(f"Loaded extension {extension}")
-    except interactions.errors.ExtensionLoadException as e:
-        logger.exception(f"Failed to load extension {extension}.", exc_info=e)
-client.start()
+        await client.astart()
+    finally:
+        config_watcher.cancel()
+        await lifecycle.shutdown()
+
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+with contextlib.suppress(KeyboardInterrupt):
+    if uvloop:
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        asyncio.run(main())
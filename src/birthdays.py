@@ -0,0 +1,56 @@
+"""
+This module computes when birthdays start and end, so they can be queried by due time.
+"""
+
+import calendar
+from datetime import date as Date
+from datetime import datetime, time, timedelta
+
+import pytz
+
+
+def anniversary(date: datetime, year: int) -> Date:
+    """
+    Returns the day of a birthday in a given year.
+
+    Birthdays on February 29th fall on February 28th in the other years.
+
+    Args:
+        date (datetime): The date of birth.
+        year (int): The year of the anniversary.
+    """
+    if date.month == 2 and date.day == 29 and not calendar.isleap(year):
+        return Date(year, 2, 28)
+    return date.date().replace(year=year)
+
+
+def next_birthday(
+    date: datetime, timezone: str, now: datetime | None = None
+) -> tuple[datetime, datetime]:
+    """
+    Returns the start and end of the first birthday that is not over yet.
+
+    A birthday lasts from midnight to midnight in the timezone of the user. The
+    instants are naive UTC datetimes, as MongoDB stores them.
+
+    Args:
+        date (datetime): The date of birth.
+        timezone (str): The timezone of the user, e.g. "Europe/Paris".
+        now (datetime, optional): An aware datetime. Defaults to the current time.
+
+    Returns:
+        tuple[datetime, datetime]: The start and end of the birthday, in UTC.
+    """
+    tz = pytz.timezone(timezone)
+    now = now or datetime.now(pytz.UTC)
+    year = now.astimezone(tz).year
+    while True:
+        day = anniversary(date, year)
+        start = tz.localize(datetime.combine(day, time()))
+        end = tz.localize(datetime.combine(day + timedelta(days=1), time()))
+        if end > now:
+            return (
+                start.astimezone(pytz.UTC).replace(tzinfo=None),
+                end.astimezone(pytz.UTC).replace(tzinfo=None),
+            )
+        year += 1
@@ -0,0 +1,200 @@
+"""
+This module provides the configuration store of the bot.
+
+The configuration file is parsed once and every module gets live views of its part
+of it: when the file changes on disk, the views are refreshed in place and the
+subscribed extensions are notified, so most changes apply without a restart.
+Slash command scopes are read when the extensions load and still need a restart.
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import tempfile
+from collections import defaultdict
+from typing import Callable
+
+from src import logutil
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+CONFIG_PATH = "config/config.json"
+
+GlobalConfig = dict
+ModuleConfig = dict[str, dict]
+ConfigViews = tuple[GlobalConfig, ModuleConfig, list[str]]
+
+
+def _refresh_in_place(target: dict, source: dict):
+    """
+    Makes target equal to source while keeping the identity of the nested dictionaries.
+    """
+    for key in list(target):
+        if key not in source:
+            del target[key]
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _refresh_in_place(target[key], value)
+        else:
+            target[key] = value
+
+
+class ConfigStore:
+    """
+    Cached configuration, indexed by module name and server ID.
+
+    Args:
+        path (str): The path of the configuration file.
+    """
+
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self.data: dict = {}
+        self.mtime: float | None = None
+        self.views: dict[str | None, ConfigViews] = {}
+        self.subscribers: dict[str | None, list[Callable]] = defaultdict(list)
+        self.config: GlobalConfig = {}
+        self.load()
+
+    def load(self):
+        """
+        Parses the configuration file and refreshes the views handed out so far.
+        """
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        self._apply(data, mtime)
+
+    def _apply(self, data: dict, mtime: float):
+        self.data = data
+        self.mtime = mtime
+        _refresh_in_place(self.config, data.get("config", {}))
+        for module_name, (_, module_config, enabled_servers) in self.views.items():
+            if module_name is None:
+                continue
+            new_module_config, new_enabled_servers = self._index(module_name)
+            _refresh_in_place(module_config, new_module_config)
+            enabled_servers[:] = new_enabled_servers
+
+    def _index(self, module_name: str) -> tuple[ModuleConfig, list[str]]:
+        servers = self.data.get("servers", {})
+        enabled_servers = [
+            str(server_id)
+            for server_id, server_info in servers.items()
+            if server_info.get(module_name, {}).get("enabled", False)
+        ]
+        module_config = {
+            str(server_id): server_info.get(module_name, {})
+            for server_id, server_info in servers.items()
+            if str(server_id) in enabled_servers
+        }
+        return module_config, enabled_servers
+
+    def get(self, module_name: str = None) -> ConfigViews:
+        """
+        Returns the live configuration views of a module.
+
+        Args:
+            module_name (str, optional): The name of the module. Only the global configuration is returned if None.
+
+        Returns:
+            A tuple containing the global configuration, the module-specific configuration, and the list of enabled servers.
+        """
+        if module_name not in self.views:
+            if module_name is None:
+                self.views[None] = (self.config, {}, [])
+            else:
+                module_config, enabled_servers = self._index(module_name)
+                self.views[module_name] = (self.config, module_config, enabled_servers)
+        return self.views[module_name]
+
+    def server(self, server_id: str, module_name: str) -> dict:
+        """
+        Returns the configuration of a module for one server.
+        """
+        return self.get(module_name)[1].get(str(server_id), {})
+
+    def save(
+        self,
+        module_name: str,
+        config: dict,
+        module_config: dict,
+        enabled_servers: list[str],
+    ):
+        """
+        Saves the configuration of a module, replacing the file atomically.
+
+        Args:
+            module_name (str): The name of the module.
+            config (dict): The global configuration.
+            module_config (dict): The module-specific configuration.
+            enabled_servers (list[str]): The list of enabled servers.
+        """
+        data = json.loads(json.dumps(self.data))
+        for server_id, server_info in data["servers"].items():
+            if str(server_id) in enabled_servers:
+                server_info[module_name] = module_config
+            else:
+                server_info[module_name] = {"enabled": False}
+        data["config"] = json.loads(json.dumps(config))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False
+        ) as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, self.path)
+        self._apply(data, os.stat(self.path).st_mtime)
+
+    def subscribe(self, module_name: str | None, callback: Callable):
+        """
+        Registers a function or coroutine function called when the configuration is reloaded.
+
+        The callback receives the global configuration, the module-specific
+        configuration and the list of enabled servers of the module.
+
+        Args:
+            module_name (str | None): The name of the module, or None for the global configuration.
+            callback (Callable): The function to call.
+        """
+        self.get(module_name)
+        self.subscribers[module_name].append(callback)
+
+    async def _notify(self):
+        for module_name, callbacks in self.subscribers.items():
+            for callback in callbacks:
+                try:
+                    result = callback(*self.get(module_name))
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.exception(
+                        "Config subscriber %s failed",
+                        callback.__qualname__,
+                        exc_info=e,
+                    )
+
+    async def watch(self, interval: float = 5):
+        """
+        Reloads the configuration whenever the file is modified on disk.
+
+        Args:
+            interval (float): Number of seconds between two checks of the file.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if os.stat(self.path).st_mtime == self.mtime:
+                    continue
+                self.load()
+            except (OSError, ValueError) as e:
+                # The file may be half written, keep the current configuration
+                logger.error("Failed to reload config: %s", e)
+                continue
+            logger.info("Config reloaded from %s", self.path)
+            await self._notify()
+
+
+config_store = ConfigStore()
@@ -0,0 +1,92 @@
+"""
+This module provides the process-wide aiohttp session shared by every HTTP call of the bot.
+"""
+
+import os
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from src import logutil
+from src.lifecycle import on_shutdown
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+# Connection pool settings
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 10
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+DEFAULT_TIMEOUT = ClientTimeout(total=30)
+
+# Backoff settings
+MAX_BACKOFF = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session: ClientSession | None = None
+
+
+def get_session() -> ClientSession:
+    """
+    Returns the shared aiohttp session, creating it on first use.
+
+    The session keeps connections alive, caps concurrent connections per host and
+    caches DNS lookups. It must be called from within the running event loop.
+
+    Returns:
+        ClientSession: The shared session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+        logger.debug("HTTP session created")
+    return _session
+
+
+@on_shutdown
+async def close_session():
+    """
+    Closes the shared aiohttp session if it is open.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.debug("HTTP session closed")
+    _session = None
+
+
+def retry_delay(attempt: int, pause: float = 1, retry_after: str | None = None) -> float:
+    """
+    Computes how long to wait before the next attempt of a request.
+
+    The Retry-After header is honoured when present, otherwise the delay grows
+    exponentially with the attempt number and is jittered to avoid bursts.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+        pause (float): The base delay in seconds.
+        retry_after (str, optional): The value of the Retry-After header, in seconds or as an HTTP date.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0), MAX_BACKOFF)
+        except ValueError:
+            try:
+                date = parsedate_to_datetime(retry_after)
+                delay = (date - datetime.now(timezone.utc)).total_seconds()
+                return min(max(delay, 0), MAX_BACKOFF)
+            except (TypeError, ValueError):
+                pass
+    delay = pause * 2**attempt
+    return min(delay / 2 + random.uniform(0, delay / 2), MAX_BACKOFF)
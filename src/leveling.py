@@ -0,0 +1,61 @@
+"""
+This module provides the leveling curves used to turn XP into levels.
+
+Each curve precomputes the cumulative XP needed to reach every level, so a level is
+found with a binary search instead of walking the curve one level at a time.
+"""
+
+import bisect
+from typing import Callable
+
+
+class LevelCurve:
+    """
+    A leveling curve defined by the XP needed to go from a level to the next one.
+
+    Args:
+        cost (Callable[[int], float]): Returns the XP needed to complete the given level.
+        initial_levels (int): Number of levels to precompute.
+    """
+
+    def __init__(self, cost: Callable[[int], float], initial_levels: int = 100):
+        self.cost = cost
+        # thresholds[level] is the total XP needed to reach the level
+        self.thresholds = [0]
+        self._extend_to_level(initial_levels)
+
+    def _extend_to_level(self, level: int):
+        while len(self.thresholds) <= level:
+            last = len(self.thresholds) - 1
+            self.thresholds.append(self.thresholds[last] + self.cost(last))
+
+    def _extend_to_xp(self, xp: float):
+        if xp >= self.thresholds[-1]:
+            # Double the table until it covers the XP, to keep extensions rare
+            level = len(self.thresholds)
+            while True:
+                level *= 2
+                self._extend_to_level(level)
+                if xp < self.thresholds[-1]:
+                    break
+
+    def level(self, xp: float) -> tuple[int, float, float]:
+        """
+        Calculates the level, XP within the level, and maximum XP for the given XP value.
+
+        Args:
+            xp (float): The total XP.
+
+        Returns:
+            tuple: A tuple containing the level, XP within the level, and maximum XP for the level.
+        """
+        self._extend_to_xp(xp)
+        level = bisect.bisect_right(self.thresholds, xp) - 1
+        return level, xp - self.thresholds[level], self.cost(level)
+
+
+# XP required to level up is 5x^2 + 50x + 100 where x is the level
+XP_CURVE = LevelCurve(lambda level: 5 * level**2 + 50 * level + 100)
+
+# Minecraft skills curve, 150 * 1.05^(1.55x) where x is the level
+MINECRAFT_CURVE = LevelCurve(lambda level: 150 * (1.05 ** (1.55 * level)))
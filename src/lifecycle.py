@@ -0,0 +1,45 @@
+"""
+This module keeps track of the coroutines to run when the bot shuts down.
+"""
+
+import inspect
+import os
+from typing import Callable
+
+from src import logutil
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+_shutdown_hooks: list[Callable] = []
+
+
+def on_shutdown(func: Callable) -> Callable:
+    """
+    Registers a function or coroutine function to be called when the bot shuts down.
+
+    Can be used as a decorator. Hooks run in reverse registration order, so
+    resources created last are released first.
+
+    Args:
+        func (Callable): The function to call on shutdown.
+
+    Returns:
+        Callable: The function, unchanged.
+    """
+    if func not in _shutdown_hooks:
+        _shutdown_hooks.append(func)
+    return func
+
+
+async def shutdown():
+    """
+    Runs every registered shutdown hook, logging the ones that fail.
+    """
+    while _shutdown_hooks:
+        hook = _shutdown_hooks.pop()
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.exception("Shutdown hook %s failed", hook.__qualname__, exc_info=e)
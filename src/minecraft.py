@@ -3,6 +3,7 @@ import json
 import asyncssh
 import os
 from src import logutil
+from src.leveling import MINECRAFT_CURVE
 import nbtlib
 import gzip
 
@@ -78,8 +79,4 @@ def format_number(num):
         return str(int(num))
     
 def calculate_level(xp):
-    level = 0
-    while xp >= 150*(1.05**(1.55*level)):
-        xp -= 150*(1.05**(1.55*level))
-        level += 1
-    return str(level)
+    return str(MINECRAFT_CURVE.level(xp)[0])
@@ -0,0 +1,65 @@
+"""
+This module provides the shared asynchronous MongoDB client used by the extensions.
+"""
+
+import os
+import threading
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from src import logutil
+from src.lifecycle import on_shutdown
+from src.utils import load_config
+
+logger = logutil.init_logger(os.path.basename(__file__))
+config, _, _ = load_config()
+
+_client: AsyncIOMotorClient | None = None
+# Extensions are imported from several threads at startup
+_client_lock = threading.Lock()
+
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Returns the process-wide MongoDB client, creating it on first use.
+
+    All the extensions share this client and therefore its connection pool.
+
+    Returns:
+        AsyncIOMotorClient: The shared MongoDB client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            mongo_config = config.get("mongodb", {})
+            _client = AsyncIOMotorClient(
+                mongo_config.get("url", ""),
+                maxPoolSize=mongo_config.get("maxPoolSize", 50),
+            )
+            logger.info("MongoDB client created")
+    return _client
+
+
+def get_database(name: str = "Playlist") -> AsyncIOMotorDatabase:
+    """
+    Returns a database from the shared MongoDB client.
+
+    Args:
+        name (str): The name of the database. Defaults to "Playlist".
+
+    Returns:
+        AsyncIOMotorDatabase: The requested database.
+    """
+    return get_client()[name]
+
+
+@on_shutdown
+def close_client():
+    """
+    Closes the shared MongoDB client if it has been created.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+        logger.info("MongoDB client closed")
@@ -0,0 +1,445 @@
+"""
+This module provides the in-memory state of the guild playlist used by the Spotify extension.
+"""
+
+import json
+import os
+import random
+import tempfile
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src import logutil
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+VOTE_OPTIONS = ("conserver", "supprimer", "menfou")
+
+
+class IndexedSet:
+    """
+    A set that also supports picking a random element in O(1).
+
+    The elements are kept in a list, and a dictionary gives the position of each
+    one, so an element is removed by swapping it with the last one.
+
+    Args:
+        items (Iterable[str], optional): The initial elements.
+    """
+
+    def __init__(self, items: Iterable[str] = ()):
+        self.items: list[str] = []
+        self.positions: dict[str, int] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: str):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self) -> str | None:
+        """
+        Returns a random element, or None if the set is empty.
+        """
+        return random.choice(self.items) if self.items else None
+
+    def __contains__(self, item: object) -> bool:
+        return item in self.positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class PlaylistIndex:
+    """
+    Membership index of the playlist and of the songs already put to the vote.
+
+    The songs never put to the vote form the candidate pool of the song of the
+    day. The pool is also split by adder and by year of addition, so a weighted
+    pick only draws a bucket among a handful before an O(1) pick inside it.
+
+    Every path adding or removing a song of the playlist must keep it in sync.
+    """
+
+    def __init__(self):
+        self.tracks = IndexedSet()
+        # Date of the last vote of each song put to the vote, as YYYY-MM-DD
+        self.last_voted: dict[str, str] = {}
+        # Songs of the playlist never put to the vote
+        self.unvoted = IndexedSet()
+        self.unvoted_by_adder: dict[str | None, IndexedSet] = {}
+        self.unvoted_by_year: dict[int, IndexedSet] = {}
+        # Adder and year of addition of each song of the playlist
+        self.origins: dict[str, tuple[str | None, int]] = {}
+
+    async def load(
+        self,
+        playlist_items: AsyncIOMotorCollection,
+        votes: AsyncIOMotorCollection,
+    ):
+        """
+        Rebuilds the index from MongoDB.
+
+        Args:
+            playlist_items (AsyncIOMotorCollection): The songs of the playlist.
+            votes (AsyncIOMotorCollection): The votes, one document per song put to the vote.
+        """
+        self.last_voted = {
+            vote["_id"]: str(vote.get("date", ""))
+            async for vote in votes.find({}, {"date": 1})
+        }
+        self.tracks = IndexedSet()
+        self.unvoted = IndexedSet()
+        self.unvoted_by_adder = {}
+        self.unvoted_by_year = {}
+        self.origins = {}
+        async for song in playlist_items.find({}, {"added_by": 1, "added_at": 1}):
+            self.add(song["_id"], song.get("added_by"), song.get("added_at"))
+        logger.info(
+            "Playlist index loaded: %s songs, %s never voted",
+            len(self.tracks),
+            len(self.unvoted),
+        )
+
+    @staticmethod
+    def _year(added_at: datetime | str | None) -> int:
+        if isinstance(added_at, datetime):
+            return added_at.year
+        try:
+            return int(str(added_at)[:4])
+        except ValueError:
+            return datetime.now().year
+
+    def _pool_add(self, track_id: str):
+        added_by, year = self.origins[track_id]
+        self.unvoted.add(track_id)
+        self.unvoted_by_adder.setdefault(added_by, IndexedSet()).add(track_id)
+        self.unvoted_by_year.setdefault(year, IndexedSet()).add(track_id)
+
+    def _pool_discard(self, track_id: str):
+        if track_id not in self.unvoted:
+            return
+        self.unvoted.discard(track_id)
+        added_by, year = self.origins[track_id]
+        # Empty buckets are dropped so that a pick only looks at non-empty ones
+        for buckets, key in (
+            (self.unvoted_by_adder, added_by),
+            (self.unvoted_by_year, year),
+        ):
+            buckets[key].discard(track_id)
+            if not buckets[key]:
+                del buckets[key]
+
+    def add(
+        self,
+        track_id: str,
+        added_by: str | None = None,
+        added_at: datetime | str | None = None,
+    ):
+        """
+        Adds a song of the playlist.
+
+        Args:
+            track_id (str): The ID of the song.
+            added_by (str, optional): The Discord ID of the user who added it.
+            added_at (datetime | str, optional): When it was added, defaults to now.
+        """
+        if track_id in self.tracks:
+            return
+        self.tracks.add(track_id)
+        self.origins[track_id] = (added_by, self._year(added_at))
+        if track_id not in self.last_voted:
+            self._pool_add(track_id)
+
+    def remove(self, track_id: str):
+        self._pool_discard(track_id)
+        self.tracks.discard(track_id)
+        self.origins.pop(track_id, None)
+
+    def mark_voted(self, track_id: str, date: str):
+        """
+        Records that a song was put to the vote.
+
+        Args:
+            track_id (str): The ID of the song.
+            date (str): The date of the vote, as YYYY-MM-DD.
+        """
+        self.last_voted[track_id] = date
+        self._pool_discard(track_id)
+
+    def pick(self, weighting: str = "uniform") -> str | None:
+        """
+        Picks the next song of the day.
+
+        The songs never put to the vote come first. Once they have all been
+        voted on, the song whose last vote is the oldest is put to the vote again.
+
+        Args:
+            weighting (str): How the never voted songs are drawn:
+                "uniform": every song has the same chance.
+                "adder": every adder has the same chance, then every song of theirs.
+                "age": the chance of a song grows with the years since its addition.
+
+        Returns:
+            str | None: The ID of the song, or None if the playlist is empty.
+        """
+        if not self.unvoted:
+            return self.oldest_voted()
+        if weighting == "adder":
+            bucket = random.choice(list(self.unvoted_by_adder.values()))
+        elif weighting == "age":
+            current_year = datetime.now().year
+            buckets = list(self.unvoted_by_year.items())
+            bucket = random.choices(
+                [bucket for _, bucket in buckets],
+                weights=[
+                    len(bucket) * (max(current_year - year, 0) + 1)
+                    for year, bucket in buckets
+                ],
+            )[0]
+        else:
+            if weighting != "uniform":
+                logger.warning("Unknown vote weighting %s, using uniform", weighting)
+            bucket = self.unvoted
+        return bucket.choice()
+
+    def oldest_voted(self) -> str | None:
+        """
+        Returns the song of the playlist whose last vote is the oldest, or None if
+        the playlist is empty.
+        """
+        if not self.tracks:
+            return None
+        return min(self.tracks, key=lambda track_id: self.last_voted.get(track_id, ""))
+
+    def __contains__(self, track_id: object) -> bool:
+        return track_id in self.tracks
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+    def ids(self) -> set[str]:
+        """
+        Returns a copy of the IDs of the songs of the playlist.
+        """
+        return set(self.tracks.positions)
+
+
+class SongVote:
+    """
+    Votes of the song of the day, mirrored from their MongoDB document.
+
+    Besides the vote of each user, the document holds one counter per option.
+    Each vote is applied with a single conditional update that moves the user's
+    vote and the counters together, so the counts never need to be recomputed.
+
+    Args:
+        collection (AsyncIOMotorCollection): The votes, one document per song.
+        track_id (str): The ID of the song put to the vote.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, track_id: str):
+        self.collection = collection
+        self.track_id = track_id
+        self.votes: dict[str, str] = {}
+        self.counts: dict[str, int] = dict.fromkeys(VOTE_OPTIONS, 0)
+        self.loaded = False
+
+    def _apply(self, document: dict):
+        self.votes = document.get("votes", {})
+        counts = document.get("counts", {})
+        self.counts = {option: counts.get(option, 0) for option in VOTE_OPTIONS}
+        self.loaded = True
+
+    async def load(self):
+        """
+        Loads the votes, adding the counters to a document created before they existed.
+        """
+        document = await self.collection.find_one(
+            {"_id": self.track_id}, {"votes": 1, "counts": 1}
+        )
+        if document is None:
+            document = {}
+        elif "counts" not in document:
+            counts = dict.fromkeys(VOTE_OPTIONS, 0)
+            for option in document.get("votes", {}).values():
+                if option in counts:
+                    counts[option] += 1
+            document = await self.collection.find_one_and_update(
+                {"_id": self.track_id, "counts": {"$exists": False}},
+                {"$set": {"counts": counts}},
+                projection={"votes": 1, "counts": 1},
+                return_document=ReturnDocument.AFTER,
+            ) or await self.collection.find_one(
+                {"_id": self.track_id}, {"votes": 1, "counts": 1}
+            )
+        self._apply(document)
+
+    async def vote(self, user_id: str, option: str | None, retries: int = 3) -> bool:
+        """
+        Sets or cancels the vote of a user.
+
+        The update only applies if the user's vote in MongoDB is still the one
+        known here; otherwise the votes are reloaded and the update is retried.
+
+        Args:
+            user_id (str): The ID of the user.
+            option (str | None): One of VOTE_OPTIONS, or None to cancel the vote.
+            retries (int): Maximum number of attempts.
+
+        Returns:
+            bool: Whether the vote changed.
+        """
+        for _ in range(retries):
+            if not self.loaded:
+                await self.load()
+            previous = self.votes.get(user_id)
+            if previous == option:
+                return False
+            key = f"votes.{user_id}"
+            update = {"$inc": {}}
+            if previous is not None:
+                update["$inc"][f"counts.{previous}"] = -1
+            if option is not None:
+                update["$inc"][f"counts.{option}"] = 1
+                update["$set"] = {key: option}
+            else:
+                update["$unset"] = {key: ""}
+            try:
+                document = await self.collection.find_one_and_update(
+                    {
+                        "_id": self.track_id,
+                        key: {"$exists": False} if previous is None else previous,
+                    },
+                    update,
+                    projection={"votes": 1, "counts": 1},
+                    upsert=previous is None,
+                    return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                document = None
+            if document is not None:
+                self._apply(document)
+                return True
+            # The vote changed in the meantime, start again from the stored state
+            self.loaded = False
+        raise RuntimeError(f"Vote of {user_id} on {self.track_id} kept conflicting")
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+class PlaylistMirror:
+    """
+    Compact local copy of the playlist, kept up to date by the playlist sync.
+
+    The tracks are stored by column, in playlist order, so the totals and the
+    derived playlists are computed locally without calling Spotify.
+
+    Args:
+        path (str): The JSON file persisting the mirror.
+    """
+
+    COLUMNS = ("ids", "artists", "added_by", "added_at", "duration_ms")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot_id: str | None = None
+        self.ids: list[str] = []
+        # Artist IDs of each track
+        self.artists: list[list[str]] = []
+        # Spotify user ID of the person who added each track
+        self.added_by: list[str | None] = []
+        self.added_at: list[str] = []
+        self.duration_ms: list[int] = []
+
+    def load(self):
+        """
+        Reads the mirror from its file, leaving it empty if there is none yet.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        self.snapshot_id = data["snapshot_id"]
+        for column in self.COLUMNS:
+            setattr(self, column, data[column])
+
+    def save(self):
+        """
+        Writes the mirror to its file, atomically. This is blocking.
+        """
+        data = {"snapshot_id": self.snapshot_id}
+        for column in self.COLUMNS:
+            data[column] = getattr(self, column)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False
+        ) as file:
+            json.dump(data, file)
+        os.replace(file.name, self.path)
+
+    def update(self, snapshot_id: str, items: list[dict]):
+        """
+        Replaces the content of the mirror with the items of the playlist.
+
+        Args:
+            snapshot_id (str): The snapshot ID of the playlist.
+            items (list[dict]): The playlist items, in order, with a track ID each.
+        """
+        self.snapshot_id = snapshot_id
+        self.ids = [item["track"]["id"] for item in items]
+        self.artists = [
+            [artist["id"] for artist in item["track"]["artists"]] for item in items
+        ]
+        self.added_by = [(item.get("added_by") or {}).get("id") for item in items]
+        self.added_at = [item["added_at"] for item in items]
+        self.duration_ms = [item["track"]["duration_ms"] for item in items]
+
+    @property
+    def length(self) -> int:
+        return len(self.ids)
+
+    @property
+    def duration(self) -> int:
+        """
+        Total duration of the playlist, in milliseconds.
+        """
+        return sum(self.duration_ms)
+
+    def discoveries(self, limit: int = 100) -> list[str]:
+        """
+        Picks the most recent tracks of the playlist, skipping the artists already picked.
+
+        Args:
+            limit (int): Maximum number of tracks.
+
+        Returns:
+            list[str]: The track IDs, most recent first.
+        """
+        picked = []
+        seen = set()
+        for track_id, artists in zip(reversed(self.ids), reversed(self.artists)):
+            if seen.isdisjoint(artists):
+                picked.append(track_id)
+                seen.update(artists)
+                if len(picked) >= limit:
+                    break
+        return picked
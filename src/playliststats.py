@@ -0,0 +1,190 @@
+"""
+This module maintains summaries of the playlist and of its votes in MongoDB.
+
+The summaries are computed by aggregation pipelines merged into their own
+collections. A change only recomputes the users it concerns, so the commands
+read a handful of precomputed documents instead of scanning the playlist and
+the votes.
+"""
+
+import asyncio
+import os
+from typing import Iterable
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from src import logutil
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+# Outcomes of the vote on a song, as stored in its "state" field
+KEPT = "conservée"
+REMOVED = "supprimée"
+SUMMARY_ID = "playlist"
+COUNTERS = ("songs", "duration_ms", "votes", "kept", "removed")
+
+
+class PlaylistStats:
+    """
+    Per-user and global statistics of the playlist, materialized in MongoDB.
+
+    Each user document holds the songs they have in the playlist, their total
+    duration, and how many of their songs were put to the vote, kept and removed.
+    The summary document adds them up for the whole playlist.
+
+    Args:
+        playlist_items (AsyncIOMotorCollection): The songs of the playlist.
+        votes (AsyncIOMotorCollection): The votes, one document per song voted on.
+        user_stats (AsyncIOMotorCollection): The summaries of each user.
+        summary (AsyncIOMotorCollection): The summary of the whole playlist.
+    """
+
+    def __init__(
+        self,
+        playlist_items: AsyncIOMotorCollection,
+        votes: AsyncIOMotorCollection,
+        user_stats: AsyncIOMotorCollection,
+        summary: AsyncIOMotorCollection,
+    ):
+        self.playlist_items = playlist_items
+        self.votes = votes
+        self.user_stats = user_stats
+        self.summary = summary
+        # Refreshes delete the users they did not write, so they must not overlap
+        self.lock = asyncio.Lock()
+
+    async def setup(self):
+        """
+        Computes every summary if they were never computed.
+        """
+        if await self.summary.count_documents({"_id": SUMMARY_ID}, limit=1) == 0:
+            await self.refresh()
+
+    async def refresh(self, users: Iterable[str] | None = None):
+        """
+        Recomputes the summaries of some users, then the summary of the playlist.
+
+        Args:
+            users (Iterable[str], optional): The Discord IDs of the users whose
+                songs or votes changed. Defaults to every user.
+        """
+        if users is not None:
+            users = [user for user in set(users) if user]
+            if not users:
+                return
+        match = {} if users is None else {"added_by": {"$in": users}}
+        async with self.lock:
+            refresh_id = ObjectId()
+            pipeline = [
+                {"$match": match},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "user": "$added_by",
+                        "songs": {"$literal": 1},
+                        "duration_ms": {"$ifNull": ["$duration_ms", 0]},
+                    }
+                },
+                {
+                    "$unionWith": {
+                        "coll": self.votes.name,
+                        "pipeline": [
+                            {"$match": match},
+                            {
+                                "$project": {
+                                    "_id": 0,
+                                    "user": "$added_by",
+                                    "votes": {"$literal": 1},
+                                    "kept": {
+                                        "$cond": [{"$eq": ["$state", KEPT]}, 1, 0]
+                                    },
+                                    "removed": {
+                                        "$cond": [{"$eq": ["$state", REMOVED]}, 1, 0]
+                                    },
+                                }
+                            },
+                        ],
+                    }
+                },
+                # Votes recorded before the adder was stored have no user
+                {"$match": {"user": {"$ne": None}}},
+                {
+                    "$group": {
+                        "_id": "$user",
+                        **{counter: {"$sum": f"${counter}"} for counter in COUNTERS},
+                    }
+                },
+                {"$set": {"refresh_id": refresh_id}},
+                {
+                    "$merge": {
+                        "into": self.user_stats.name,
+                        "whenMatched": "replace",
+                        "whenNotMatched": "insert",
+                    }
+                },
+            ]
+            await self.playlist_items.aggregate(pipeline).to_list(length=None)
+            # Users left without songs nor votes are missing from the output
+            stale = {"refresh_id": {"$ne": refresh_id}}
+            if users is not None:
+                stale["_id"] = {"$in": users}
+            await self.user_stats.delete_many(stale)
+            await self.user_stats.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": SUMMARY_ID,
+                            "users": {"$sum": 1},
+                            **{
+                                counter: {"$sum": f"${counter}"}
+                                for counter in COUNTERS
+                            },
+                        }
+                    },
+                    {
+                        "$merge": {
+                            "into": self.summary.name,
+                            "whenMatched": "replace",
+                            "whenNotMatched": "insert",
+                        }
+                    },
+                ]
+            ).to_list(length=None)
+        logger.debug(
+            "Playlist stats refreshed for %s", "every user" if users is None else users
+        )
+
+    async def get_summary(self) -> dict:
+        """
+        Returns the summary of the playlist, with every counter at 0 if it is empty.
+        """
+        document = await self.summary.find_one({"_id": SUMMARY_ID}) or {}
+        return {"users": 0, **dict.fromkeys(COUNTERS, 0), **document}
+
+    async def get_user(self, user_id: str) -> dict:
+        """
+        Returns the summary of a user, with every counter at 0 if they have none.
+
+        Args:
+            user_id (str): The Discord ID of the user.
+        """
+        document = await self.user_stats.find_one({"_id": str(user_id)}) or {}
+        return {**dict.fromkeys(COUNTERS, 0), **document}
+
+    async def get_users(self) -> list[dict]:
+        """
+        Returns the summary of every user, the biggest contributors first.
+        """
+        return await self.user_stats.find().sort("songs", -1).to_list(length=None)
+
+
+def keep_ratio(stats: dict) -> float | None:
+    """
+    Returns the share of the voted songs that were kept, or None if none was voted.
+
+    Args:
+        stats (dict): A summary of PlaylistStats.
+    """
+    decided = stats["kept"] + stats["removed"]
+    return stats["kept"] / decided if decided else None
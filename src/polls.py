@@ -0,0 +1,265 @@
+"""
+This module keeps the state of the polls, updated from the reaction events.
+
+The votes of a poll are held in memory, so a reaction costs a set update and
+a debounced edit of the poll message, instead of fetching the users of every
+reaction and re-parsing the embed each time. Discord is only read back when
+a poll is first seen and, for the recent polls, on startup.
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+
+from interactions import Client, Embed, Message
+
+from src import logutil
+from src.statestore import StateStore
+from src.utils import Debouncer
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+POLL_COLOR = 0x3489EB
+# Number of seconds the votes of a poll are gathered before editing it
+POLL_RENDER_DELAY = 1
+# Polls older than that are forgotten, and read back from Discord if they get a vote
+POLL_TRACKING_SECONDS = 30 * 24 * 3600
+NAMESPACE = "polls"
+
+
+def is_poll(message: Message) -> bool:
+    """
+    Returns whether a message is a poll created by the bot.
+    """
+    return len(message.embeds) > 0 and message.embeds[0].color == POLL_COLOR
+
+
+class Poll:
+    """
+    The options and voters of a poll.
+
+    Args:
+        message (Message): The poll message.
+        names (dict): Names to use for some users, indexed by their ID as a string.
+    """
+
+    def __init__(self, message: Message, names: dict):
+        self.names = names
+        self.created_at = message.created_at.timestamp()
+        self.update(message)
+        # Voters of each emoji, their ID mapped to their name, in voting order
+        self.voters: dict[str, dict[str, str]] = defaultdict(dict)
+        # Number of reactions of each voter, to count the participants
+        self.participants: Counter = Counter()
+        self.render = Debouncer(self.edit, delay=POLL_RENDER_DELAY)
+
+    def update(self, message: Message):
+        """
+        Reads the options of the poll from its message, after it was edited.
+
+        The poll is updated in place, so a pending edit renders the new options.
+
+        Args:
+            message (Message): The poll message.
+        """
+        self.message = message
+        self.options = [
+            option.split(":", 1)[0].replace("**", "").strip()
+            for option in message.embeds[0].description.split("\n\n")
+        ]
+
+    def add_vote(self, emoji: str, user):
+        """
+        Records a reaction. Does nothing if it was already recorded.
+
+        Args:
+            emoji (str): The emoji of the reaction.
+            user (User | Member): The user who reacted.
+        """
+        user_id = str(user.id)
+        if user_id in self.voters[emoji]:
+            return
+        self.voters[emoji][user_id] = self.names.get(user_id, user.display_name)
+        self.participants[user_id] += 1
+
+    def remove_vote(self, emoji: str, user_id):
+        """
+        Forgets a reaction. Does nothing if it was not recorded.
+
+        Args:
+            emoji (str): The emoji of the reaction.
+            user_id (str | int): The ID of the user who removed it.
+        """
+        user_id = str(user_id)
+        if self.voters[emoji].pop(user_id, None) is None:
+            return
+        self.participants[user_id] -= 1
+        if self.participants[user_id] == 0:
+            del self.participants[user_id]
+
+    async def reconcile(self):
+        """
+        Replaces the recorded votes with the reactions of the message.
+        """
+        self.voters.clear()
+        self.participants.clear()
+        for reaction in self.message.reactions:
+            for user in await reaction.users().flatten():
+                if not user.bot:
+                    self.add_vote(str(reaction.emoji), user)
+
+    def format(self) -> str:
+        """
+        Returns the description of the poll, with the votes of each option.
+        """
+        counts = {
+            option: len(self.voters.get(option.split(" ", 1)[0], ()))
+            for option in self.options
+        }
+        max_count = max(counts.values(), default=0)
+        participant_count = len(self.participants)
+        description_list = []
+        for option, count in counts.items():
+            description = option
+            if count > 0:
+                user_names = ", ".join(self.voters[option.split(" ", 1)[0]].values())
+                description = (
+                    f"**{option} : {count}/{participant_count} votes\n({user_names})**"
+                    if count == max_count
+                    else f"{option} : **{count}/{participant_count} votes**\n({user_names})"
+                )
+            description_list.append(description)
+        return "\n\n".join(description_list)
+
+    async def edit(self):
+        """
+        Edits the poll message with the current votes.
+        """
+        embed: Embed = self.message.embeds[0]
+        embed.description = self.format()
+        self.message = await self.message.edit(embed=embed)
+
+
+class PollStore:
+    """
+    The polls known to the bot, each updated under its own lock.
+
+    The polls are recorded in the state store, so the recent ones are
+    reconciled with Discord on startup, then only follow the reaction events.
+
+    Args:
+        bot (Client): The bot, to fetch the polls on startup.
+        store (StateStore): Records the channel and creation time of each poll.
+        names (dict): Names to use for the users, indexed by guild then user ID.
+    """
+
+    def __init__(self, bot: Client, store: StateStore, names: dict):
+        self.bot = bot
+        self.store = store
+        self.names = names
+        self.polls: dict[str, Poll] = {}
+        # Created on first use, so two events of a new poll share the same lock
+        self.locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def _poll(self, message: Message) -> Poll:
+        # A known poll is updated in place, rather than left with a pending edit
+        poll = self.polls.get(str(message.id))
+        if poll is not None:
+            poll.update(message)
+            return poll
+        names = self.names.get(str(message.guild.id), {}) if message.guild else {}
+        poll = Poll(message, names)
+        self.polls[str(message.id)] = poll
+        return poll
+
+    def _prune(self):
+        # Forgets the polls past the tracking period, read back if they get a vote
+        now = time.time()
+        for message_id, poll in list(self.polls.items()):
+            if now - poll.created_at > POLL_TRACKING_SECONDS:
+                del self.polls[message_id]
+        for message_id, lock in list(self.locks.items()):
+            if message_id not in self.polls and not lock.locked():
+                del self.locks[message_id]
+
+    async def add(self, message: Message):
+        """
+        Records a new poll, without any vote yet.
+
+        Args:
+            message (Message): The poll message.
+        """
+        self._prune()
+        self._poll(message)
+        await self.store.set(
+            NAMESPACE,
+            str(message.id),
+            {"channel_id": str(message.channel.id), "created_at": time.time()},
+        )
+
+    async def load(self):
+        """
+        Reconciles the recent polls with Discord, and forgets the older ones.
+        """
+        stale = []
+        for message_id, infos in (await self.store.items(NAMESPACE)).items():
+            if time.time() - infos["created_at"] > POLL_TRACKING_SECONDS:
+                stale.append(message_id)
+                continue
+            try:
+                channel = await self.bot.fetch_channel(infos["channel_id"])
+                message = await channel.fetch_message(message_id)
+            except Exception:
+                message = None
+            if message is None or not is_poll(message):
+                stale.append(message_id)
+                continue
+            async with self.locks[message_id]:
+                poll = self._poll(message)
+                await poll.reconcile()
+                # Only the polls whose votes changed while the bot was down
+                if poll.format() != message.embeds[0].description:
+                    poll.render.trigger()
+        await self.store.update(NAMESPACE, deleted=stale)
+        self._prune()
+        logger.info("%s polls reconciled", len(self.polls))
+
+    async def reload(self, message: Message):
+        """
+        Reads a poll back from Discord, after it was edited.
+
+        Args:
+            message (Message): The poll message.
+        """
+        async with self.locks[str(message.id)]:
+            poll = self._poll(message)
+            await poll.reconcile()
+            poll.render.trigger()
+
+    async def on_reaction(self, message: Message, emoji: str, user, added: bool):
+        """
+        Records a reaction to a poll and schedules the edit of the message.
+
+        A poll not seen since startup is first read back from Discord.
+
+        Args:
+            message (Message): The message reacted to.
+            emoji (str): The emoji of the reaction.
+            user (User | Member): The user who reacted.
+            added (bool): Whether the reaction was added or removed.
+        """
+        if user.bot or not is_poll(message):
+            return
+        message_id = str(message.id)
+        async with self.locks[message_id]:
+            poll = self.polls.get(message_id)
+            if poll is None:
+                poll = self._poll(message)
+                await poll.reconcile()
+            # Recording a vote twice is harmless, if the reconciliation saw it
+            if added:
+                poll.add_vote(emoji, user)
+            else:
+                poll.remove_vote(emoji, user.id)
+            poll.render.trigger()
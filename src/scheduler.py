@@ -0,0 +1,102 @@
+"""
+This module runs the periodic checks of many sources from a single loop.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Hashable
+
+from src import logutil
+from src.triggers import AdaptiveTrigger
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+
+class SyncScheduler:
+    """
+    Checks many sources one at a time, each at its own adaptive interval.
+
+    The sources first run staggered over the shortest interval, and two checks
+    are always at least `spacing` seconds apart, so the checks spread evenly
+    over time instead of hitting the API together, whatever the number of sources.
+
+    Args:
+        check (Callable[[Hashable], Awaitable[None]]): Checks a source. It
+            adjusts the interval of the source by calling reset() or backoff()
+            on its trigger.
+        spacing (float): Minimum number of seconds between two checks.
+    """
+
+    def __init__(
+        self, check: Callable[[Hashable], Awaitable[None]], spacing: float = 1
+    ):
+        self.check = check
+        self.spacing = spacing
+        self.triggers: dict[Hashable, AdaptiveTrigger] = {}
+        # Monotonic time of the next check of each source
+        self.due: dict[Hashable, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def add(self, key: Hashable, trigger: AdaptiveTrigger):
+        """
+        Registers a source, checked once the scheduler is started.
+
+        Args:
+            key (Hashable): The source, passed to the check.
+            trigger (AdaptiveTrigger): Gives the interval between two checks.
+        """
+        self.triggers[key] = trigger
+
+    def start(self):
+        """
+        Staggers the first check of each source, then starts the loop.
+        """
+        if not self.triggers:
+            return
+        now = time.monotonic()
+        count = len(self.triggers)
+        for position, (key, trigger) in enumerate(self.triggers.items()):
+            self.due[key] = now + trigger.minimum * position / count
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def poke(self, key: Hashable):
+        """
+        Checks a source as soon as possible, and at its shortest interval again.
+
+        Args:
+            key (Hashable): The source, after some activity.
+        """
+        self.triggers[key].reset()
+        self.due[key] = time.monotonic()
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            key = min(self.due, key=self.due.get)
+            delay = self.due[key] - time.monotonic()
+            if delay > 0:
+                # Sleep until the next check, or until a source is poked
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            trigger = self.triggers[key]
+            started = time.monotonic()
+            try:
+                await self.check(key)
+            except Exception:
+                logger.exception("Check of %s failed", key)
+                trigger.backoff()
+            # A source poked during its check is checked again right away
+            if self.due[key] < started:
+                self.due[key] = time.monotonic() + trigger.interval
+            await asyncio.sleep(self.spacing)
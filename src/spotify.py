@@ -2,13 +2,24 @@
 This module provides functionality for authenticating with the Spotify API and creating embed messages for Discord bots.
 """
 
+import asyncio
 import os
-from datetime import datetime
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
 from enum import Enum
 
+import aiohttp
 import interactions
 import spotipy
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+
 from src import logutil
+from src.httpclient import RETRY_STATUSES, get_session, retry_delay
 from src.utils import load_config
 
 logger = logutil.init_logger(os.path.basename(__file__))
@@ -16,7 +27,10 @@ config,_,_ = load_config()
 
 def spotify_auth():
     """
-    Authenticates the application with the Spotify API and returns a new instance of the Spotify API.
+    Creates a new instance of the Spotify API, without any network call.
+
+    The token is refreshed by spotipy on the first request. Use check_spotify_token
+    to validate it beforehand.
 
     Returns:
         spotipy.Spotify: A new instance of the Spotify API.
@@ -31,6 +45,22 @@ def spotify_auth():
         cache_handler=spotipy.CacheFileHandler("data/.cache"),
     )
 
+    # Create a new instance of the Spotify API with the auth manager
+    sp = spotipy.Spotify(auth_manager=sp_oauth, language="fr")
+
+    return sp
+
+
+def check_spotify_token(sp: spotipy.Spotify):
+    """
+    Checks the cached token of a Spotify API instance, logging the authorization URL if it is invalid.
+
+    This is blocking, as refreshing the token is a network call.
+
+    Args:
+        sp (spotipy.Spotify): The instance created by spotify_auth.
+    """
+    sp_oauth = sp.auth_manager
     # Check if a valid token is already cached
     token_info = sp_oauth.get_cached_token()
 
@@ -47,20 +77,652 @@ def spotify_auth():
         logger.warning(
             "Please visit this URL to authorize the application: %s", auth_url
         )
-        # print(f"Please visit this URL to authorize the application: {auth_url}")
 
-        # # Wait for the user to input the response URL after authenticating
-        # auth_code = input("Enter the response URL: ")
 
-        # # Exchange the authorization code for an access token and refresh token
-        # token_info = sp_oauth.get_access_token(
-        #     sp_oauth.parse_response_code(auth_code), as_dict=False
-        # )
+SPOTIFY_API_URL = "https://api.spotify.com/v1/"
+# Refresh the access token when it expires in less than this many seconds
+TOKEN_MARGIN = 60
+MAX_CONCURRENT_PAGES = 5
 
-    # Create a new instance of the Spotify API with the access token
-    sp = spotipy.Spotify(auth_manager=sp_oauth, language="fr")
 
-    return sp
+def spotify_id(value: str) -> str:
+    """
+    Extracts a Spotify ID from an URI (spotify:track:ID), an URL or a bare ID.
+    """
+    if value.startswith("spotify:"):
+        return value.split(":")[-1]
+    if value.startswith("http"):
+        return value.split("?")[0].rstrip("/").split("/")[-1]
+    return value
+
+
+def spotify_uri(kind: str, value: str) -> str:
+    """
+    Builds a Spotify URI (spotify:track:ID) from an URI, an URL or a bare ID.
+    """
+    return f"spotify:{kind}:{spotify_id(value)}"
+
+
+class AsyncSpotify:
+    """
+    Asynchronous facade over the Spotify Web API, using the shared HTTP session.
+
+    Only the token refresh goes through spotipy, in a thread. Identical GET
+    requests in flight are coalesced, and the pages of a playlist are fetched
+    concurrently. Errors are raised as spotipy.SpotifyException, like spotipy does.
+
+    Args:
+        sp (spotipy.Spotify): The client holding the auth manager, see spotify_auth.
+        retries (int): Number of attempts for a request failing with a retryable status.
+    """
+
+    def __init__(self, sp: spotipy.Spotify, retries: int = 3):
+        self.sp = sp
+        self.retries = retries
+        self._token_info: dict | None = None
+        self._token_lock = asyncio.Lock()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._pages = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+
+    def set_client(self, sp: spotipy.Spotify):
+        """
+        Replaces the spotipy client, for example after a new authorization.
+        """
+        self.sp = sp
+        self._token_info = None
+
+    def _fetch_token(self) -> dict | None:
+        auth_manager = self.sp.auth_manager
+        token_info = auth_manager.validate_token(auth_manager.get_cached_token())
+        if token_info is None:
+            # Same behaviour as spotipy without a valid cached token
+            auth_manager.get_access_token(as_dict=False)
+            token_info = auth_manager.get_cached_token()
+        return token_info
+
+    def _refresh_token(self, token_info: dict) -> dict | None:
+        # The token was rejected, spotipy would keep it until it expires locally
+        if token_info.get("refresh_token"):
+            return self.sp.auth_manager.refresh_access_token(
+                token_info["refresh_token"]
+            )
+        return self._fetch_token()
+
+    async def _refresh(self, rejected: str):
+        async with self._token_lock:
+            # Unless a concurrent request already refreshed it
+            if self._token_info is None or self._token_info["access_token"] != rejected:
+                return
+            self._token_info = await asyncio.to_thread(
+                self._refresh_token, self._token_info
+            )
+
+    async def _token(self) -> str:
+        async with self._token_lock:
+            if (
+                self._token_info is None
+                or self._token_info["expires_at"] - time.time() < TOKEN_MARGIN
+            ):
+                self._token_info = await asyncio.to_thread(self._fetch_token)
+            return self._token_info["access_token"]
+
+    async def _request(
+        self, method: str, path: str, params: dict = None, payload: dict = None
+    ) -> dict | None:
+        url = path if path.startswith("http") else SPOTIFY_API_URL + path
+        params = {
+            key: value for key, value in (params or {}).items() if value is not None
+        }
+        refreshed = False
+        attempt = 0
+        while True:
+            token = await self._token()
+            headers = {"Authorization": f"Bearer {token}"}
+            if self.sp.language:
+                headers["Accept-Language"] = self.sp.language
+            # Set to retry once the connection is back in the pool
+            rejected = False
+            delay = 0
+            try:
+                async with get_session().request(
+                    method, url, params=params, json=payload, headers=headers
+                ) as response:
+                    if response.status < 400:
+                        # Empty bodies give None
+                        return await response.json(content_type=None)
+                    if response.status == 401 and not refreshed:
+                        refreshed = rejected = True
+                    elif (
+                        response.status in RETRY_STATUSES
+                        and attempt < self.retries - 1
+                    ):
+                        delay = retry_delay(
+                            attempt, retry_after=response.headers.get("Retry-After")
+                        )
+                        logger.warning(
+                            "Spotify %s %s returned %s, retrying in %.1f s",
+                            method,
+                            path,
+                            response.status,
+                            delay,
+                        )
+                        attempt += 1
+                    else:
+                        try:
+                            error = (await response.json()).get("error", {})
+                            message = error.get("message", response.reason)
+                        except (aiohttp.ContentTypeError, ValueError, AttributeError):
+                            message = response.reason
+                        raise spotipy.SpotifyException(
+                            response.status,
+                            -1,
+                            f"{url}:\n {message}",
+                            headers=dict(response.headers),
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt < self.retries - 1:
+                    await asyncio.sleep(retry_delay(attempt))
+                    attempt += 1
+                    continue
+                raise spotipy.SpotifyException(
+                    599, -1, f"{url}:\n {type(e).__name__}: {e}"
+                ) from e
+            if rejected:
+                await self._refresh(token)
+            else:
+                await asyncio.sleep(delay)
+
+    async def _get(self, path: str, **params) -> dict:
+        """
+        Sends a GET request, sharing the response with identical requests in flight.
+        """
+        key = (path, tuple(sorted((k, str(v)) for k, v in params.items())))
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._request("GET", path, params))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A cancelled caller must not cancel the request shared with the others
+        return await asyncio.shield(future)
+
+    async def track(self, track_id: str, market: str = None) -> dict:
+        """
+        Returns a track, like spotipy.Spotify.track.
+        """
+        return await self._get(f"tracks/{spotify_id(track_id)}", market=market)
+
+    async def tracks(self, track_ids: list[str], market: str = None) -> list[dict]:
+        """
+        Returns many tracks, with one request per 50 tracks sent concurrently.
+        """
+        ids = [spotify_id(track_id) for track_id in track_ids]
+        chunks = await asyncio.gather(
+            *(
+                self._get(
+                    "tracks", ids=",".join(ids[start : start + 50]), market=market
+                )
+                for start in range(0, len(ids), 50)
+            )
+        )
+        return [track for chunk in chunks for track in chunk["tracks"]]
+
+    async def search(
+        self,
+        q: str,
+        limit: int = 10,
+        offset: int = 0,
+        type: str = "track",
+        market: str = None,
+    ) -> dict:
+        """
+        Searches for an item, like spotipy.Spotify.search.
+        """
+        return await self._get(
+            "search", q=q, limit=limit, offset=offset, type=type, market=market
+        )
+
+    async def playlist(
+        self, playlist_id: str, fields: str = None, market: str = None
+    ) -> dict:
+        """
+        Returns a playlist, like spotipy.Spotify.playlist.
+        """
+        return await self._get(
+            f"playlists/{spotify_id(playlist_id)}", fields=fields, market=market
+        )
+
+    async def playlist_items(
+        self,
+        playlist_id: str,
+        fields: str = None,
+        limit: int = 100,
+        offset: int = 0,
+        market: str = None,
+    ) -> dict:
+        """
+        Returns one page of the items of a playlist, like spotipy.Spotify.playlist_items.
+        """
+        async with self._pages:
+            return await self._get(
+                f"playlists/{spotify_id(playlist_id)}/tracks",
+                fields=fields,
+                limit=limit,
+                offset=offset,
+                market=market,
+            )
+
+    async def playlist_all_items(
+        self, playlist_id: str, fields: str = None, market: str = None
+    ) -> list[dict]:
+        """
+        Returns every item of a playlist, fetching the pages after the first one concurrently.
+
+        Args:
+            playlist_id (str): The ID, URI or URL of the playlist.
+            fields (str, optional): The fields of each page to return, "total" is always added.
+            market (str, optional): The market of the tracks.
+
+        Returns:
+            list[dict]: The items, in the order of the playlist.
+        """
+        if fields and "total" not in fields.split(","):
+            fields = f"total,{fields}"
+        first = await self.playlist_items(playlist_id, fields=fields, market=market)
+        pages = await asyncio.gather(
+            *(
+                self.playlist_items(
+                    playlist_id, fields=fields, offset=offset, market=market
+                )
+                for offset in range(len(first["items"]), first["total"], 100)
+            )
+        )
+        items = first["items"]
+        for page in pages:
+            items.extend(page["items"])
+        return items
+
+    async def playlist_add_items(
+        self, playlist_id: str, items: list[str], position: int = None
+    ) -> dict:
+        """
+        Adds tracks to a playlist, like spotipy.Spotify.playlist_add_items.
+        """
+        payload = {"uris": [spotify_uri("track", item) for item in items]}
+        if position is not None:
+            payload["position"] = position
+        return await self._request(
+            "POST", f"playlists/{spotify_id(playlist_id)}/tracks", payload=payload
+        )
+
+    async def playlist_remove_all_occurrences_of_items(
+        self, playlist_id: str, items: list[str]
+    ) -> dict:
+        """
+        Removes tracks from a playlist, like spotipy.Spotify.playlist_remove_all_occurrences_of_items.
+        """
+        payload = {"tracks": [{"uri": spotify_uri("track", item)} for item in items]}
+        return await self._request(
+            "DELETE", f"playlists/{spotify_id(playlist_id)}/tracks", payload=payload
+        )
+
+    async def playlist_replace_items(self, playlist_id: str, items: list[str]) -> dict:
+        """
+        Replaces the tracks of a playlist, like spotipy.Spotify.playlist_replace_items.
+        """
+        payload = {"uris": [spotify_uri("track", item) for item in items]}
+        return await self._request(
+            "PUT", f"playlists/{spotify_id(playlist_id)}/tracks", payload=payload
+        )
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query, so that queries differing only by case or spacing share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class SearchCache:
+    """
+    LRU cache of the Spotify track searches used by the autocomplete handlers.
+
+    While the results of a query are unknown, the cached results of its longest
+    prefix are served right away, filtered on the words typed so far, and the
+    real search runs in the background. Concurrent searches of the same query
+    share one request.
+
+    Args:
+        spotify (AsyncSpotify): The client used for the searches.
+        maxsize (int): Maximum number of queries kept.
+        ttl (float): Number of seconds the results of a query are kept.
+        timeout (float): Maximum number of seconds to wait for a search without cached prefix.
+    """
+
+    def __init__(
+        self,
+        spotify: AsyncSpotify,
+        maxsize: int = 512,
+        ttl: float = 600,
+        timeout: float = 2.5,
+    ):
+        self.spotify = spotify
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timeout = timeout
+        self.entries: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.metrics = {"hits": 0, "prefix_hits": 0, "misses": 0, "requests": 0}
+
+    def _lookup(self, key: str) -> list[dict] | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _prefix_results(self, key: str) -> list[dict] | None:
+        words = key.split()
+        for end in range(len(key) - 1, 0, -1):
+            items = self._lookup(key[:end])
+            if items is None:
+                continue
+            matching = [
+                item
+                for item in items
+                if all(word in normalize_query(track_label(item)) for word in words)
+            ]
+            if matching:
+                return matching
+        return None
+
+    async def _search(self, key: str, query: str, market: str) -> list[dict]:
+        self.metrics["requests"] += 1
+        results = await self.spotify.search(
+            query, limit=10, type="track", market=market
+        )
+        items = results["tracks"]["items"]
+        self.entries[key] = (time.monotonic(), items)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return items
+
+    def _start_search(self, key: str, query: str, market: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search(key, query, market))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            task.add_done_callback(_log_search_error)
+        return task
+
+    async def search(self, query: str, market: str = "FR") -> list[dict]:
+        """
+        Searches for tracks, from the cache when possible.
+
+        Args:
+            query (str): The text typed by the user.
+            market (str): The market of the tracks.
+
+        Returns:
+            list[dict]: The tracks found, possibly from a shorter query. Empty if the search failed or timed out.
+        """
+        key = normalize_query(query)
+        items = self._lookup(key)
+        if items is not None:
+            self.metrics["hits"] += 1
+            return items
+        task = self._start_search(key, query, market)
+        items = self._prefix_results(key)
+        if items is not None:
+            self.metrics["prefix_hits"] += 1
+            return items
+        self.metrics["misses"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            # The search goes on in the background and fills the cache
+            logger.warning("Spotify search for '%s' timed out", query)
+            return []
+        except spotipy.SpotifyException:
+            # Already logged by _log_search_error
+            return []
+
+    def stats(self) -> dict:
+        """
+        Returns the metrics of the cache, with the share of lookups answered without waiting.
+        """
+        lookups = sum(
+            self.metrics[name] for name in ("hits", "prefix_hits", "misses")
+        )
+        served = self.metrics["hits"] + self.metrics["prefix_hits"]
+        return {
+            **self.metrics,
+            "entries": len(self.entries),
+            "hit_rate": served / lookups if lookups else 0.0,
+        }
+
+
+TRACK_ID_PATTERN = re.compile(r"^[0-9A-Za-z]{22}$")
+
+
+class TrackCache:
+    """
+    Two-tier cache of the Spotify track objects: an in-process LRU in front of a MongoDB collection.
+
+    The documents of the collection expire through a TTL index. Misses arriving
+    within a few milliseconds of each other are looked up together, first in
+    MongoDB, then through the tracks endpoint, 50 tracks per request.
+
+    Args:
+        spotify (AsyncSpotify): The client used for the misses.
+        collection (AsyncIOMotorCollection): The collection persisting the tracks.
+        maxsize (int): Maximum number of tracks kept in memory.
+        ttl (float): Number of seconds a track is kept, in memory and in MongoDB.
+        market (str): The market of the tracks.
+        batch_delay (float): Number of seconds to wait for other misses before a lookup.
+    """
+
+    def __init__(
+        self,
+        spotify: AsyncSpotify,
+        collection: AsyncIOMotorCollection,
+        maxsize: int = 2048,
+        ttl: float = 7 * 24 * 3600,
+        market: str = "FR",
+        batch_delay: float = 0.02,
+    ):
+        self.spotify = spotify
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.market = market
+        self.batch_delay = batch_delay
+        self.entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._flush_task: asyncio.Task | None = None
+        self.started = time.monotonic()
+        self.metrics = {
+            "memory_hits": 0,
+            "store_hits": 0,
+            "misses": 0,
+            "requests": 0,
+        }
+
+    async def setup(self):
+        """
+        Creates the TTL index of the collection.
+        """
+        await self.collection.create_index(
+            "cached_at", expireAfterSeconds=int(self.ttl)
+        )
+
+    def _remember(self, track: dict, cached_at: float = None):
+        if cached_at is None:
+            cached_at = time.monotonic()
+        self.entries[track["id"]] = (cached_at, track)
+        self.entries.move_to_end(track["id"])
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _lookup(self, track_id: str) -> dict | None:
+        entry = self.entries.get(track_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self.entries[track_id]
+            return None
+        self.entries.move_to_end(track_id)
+        return entry[1]
+
+    async def warm(self, tracks: list[dict], persist: bool = True):
+        """
+        Adds tracks already fetched elsewhere, for example by a playlist sync.
+
+        Args:
+            tracks (list[dict]): The track objects.
+            persist (bool): Whether to also write them to MongoDB.
+        """
+        tracks = [track for track in tracks if track and track.get("id")]
+        for track in tracks:
+            self._remember(track)
+        if persist and tracks:
+            await self._store(tracks)
+
+    async def _store(self, tracks: list[dict]):
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {"_id": track["id"]},
+                        {"track": track, "cached_at": now},
+                        upsert=True,
+                    )
+                    for track in tracks
+                ],
+                ordered=False,
+            )
+        except PyMongoError as e:
+            logger.error("Failed to store %s tracks: %s", len(tracks), e)
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_delay)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        try:
+            track_ids = list(pending)
+            async for document in self.collection.find({"_id": {"$in": track_ids}}):
+                self.metrics["store_hits"] += 1
+                # Expires from memory when it expires from the collection
+                stored_at = document["cached_at"]
+                if stored_at.tzinfo is None:
+                    stored_at = stored_at.replace(tzinfo=timezone.utc)
+                age = (datetime.now(timezone.utc) - stored_at).total_seconds()
+                self._remember(document["track"], time.monotonic() - age)
+                pending.pop(document["_id"]).set_result(document["track"])
+            track_ids = list(pending)
+            if track_ids:
+                self.metrics["misses"] += len(track_ids)
+                self.metrics["requests"] += (len(track_ids) + 49) // 50
+                tracks = await self.spotify.tracks(track_ids, market=self.market)
+                found = [track for track in tracks if track]
+                for track in found:
+                    self._remember(track)
+                for track_id, track in zip(track_ids, tracks):
+                    pending.pop(track_id).set_result(track)
+                if found:
+                    await self._store(found)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def _enqueue(self, track_id: str) -> asyncio.Future:
+        future = self._pending.get(track_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[track_id] = future
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush())
+        return future
+
+    async def get_many(self, track_ids: list[str]) -> list[dict | None]:
+        """
+        Returns many tracks, looking up all the misses together.
+
+        Args:
+            track_ids (list[str]): The IDs, URIs or URLs of the tracks.
+
+        Returns:
+            list[dict | None]: The tracks in the same order, None for the ones that do not exist.
+        """
+        ids = [spotify_id(track_id) for track_id in track_ids]
+        tracks = {}
+        futures = {}
+        for track_id in ids:
+            if track_id in tracks or track_id in futures:
+                continue
+            track = self._lookup(track_id)
+            if track is not None:
+                self.metrics["memory_hits"] += 1
+                tracks[track_id] = track
+            elif TRACK_ID_PATTERN.match(track_id):
+                futures[track_id] = self._enqueue(track_id)
+        if futures:
+            results = await asyncio.gather(
+                *(asyncio.shield(future) for future in futures.values())
+            )
+            tracks.update(zip(futures, results))
+        return [tracks.get(track_id) for track_id in ids]
+
+    async def get(self, track_id: str) -> dict:
+        """
+        Returns a track, like AsyncSpotify.track.
+
+        Args:
+            track_id (str): The ID, URI or URL of the track.
+
+        Raises:
+            spotipy.SpotifyException: If the track does not exist or the request failed.
+        """
+        track = (await self.get_many([track_id]))[0]
+        if track is None:
+            raise spotipy.SpotifyException(404, -1, f"Track {track_id} not found")
+        return track
+
+    def stats(self) -> dict:
+        """
+        Returns the metrics of the cache, with the Spotify requests made and avoided per day.
+        """
+        hits = self.metrics["memory_hits"] + self.metrics["store_hits"]
+        lookups = hits + self.metrics["misses"]
+        days = max((time.monotonic() - self.started) / 86400, 1 / 24)
+        return {
+            **self.metrics,
+            "entries": len(self.entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "requests_per_day": self.metrics["requests"] / days,
+            # Each hit used to be one request to the track endpoint
+            "avoided_per_day": (lookups - self.metrics["requests"]) / days,
+        }
+
+
+def _log_search_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Spotify search failed: %s", task.exception())
+
+
+def track_label(track: dict) -> str:
+    """
+    Formats a track as shown in the autocomplete choices, limited to 100 characters.
+    """
+    return f"{track['artists'][0]['name']} - {track['name']} (Album: {track['album']['name']})"[
+        :100
+    ]
 
 
 class EmbedType(Enum):
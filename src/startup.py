@@ -0,0 +1,134 @@
+"""
+This module loads the extensions and reports how long each of them took to start.
+
+The extension modules are imported in parallel, then instantiated one by one, and
+their on_startup listeners are timed once the gateway is ready. A report is logged
+when every listener has finished.
+"""
+
+import functools
+import importlib
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import interactions
+import prettytable
+
+from src import logutil
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+MAX_IMPORT_WORKERS = 8
+STAGES = ("import", "__init__", "on_startup")
+
+
+class StartupProfiler:
+    """
+    Loads the extensions of a client and times their import, __init__ and on_startup.
+
+    Args:
+        client (interactions.Client): The client to load the extensions into.
+    """
+
+    def __init__(self, client: interactions.Client):
+        self.client = client
+        self.timings: dict[str, dict[str, float]] = defaultdict(dict)
+        self.started = time.perf_counter()
+        self.pending = 0
+
+    def _import(self, name: str) -> tuple[str, float, Exception | None]:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            error = None
+        except Exception as e:
+            error = e
+        return name, time.perf_counter() - start, error
+
+    def import_extensions(
+        self, names: list[str], max_workers: int = MAX_IMPORT_WORKERS
+    ):
+        """
+        Imports the extension modules in parallel threads.
+
+        A module that fails to import is left to load_extension, which imports it
+        again and reports the error.
+
+        Args:
+            names (list[str]): The module names of the extensions.
+            max_workers (int): The maximum number of threads.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for name, elapsed, error in executor.map(self._import, names):
+                self.timings[name]["import"] = elapsed
+                if error is not None:
+                    logger.debug("Parallel import of %s failed: %s", name, error)
+
+    def load_extensions(self, names: list[str]):
+        """
+        Imports and loads the extensions, timing their on_startup listeners.
+
+        Args:
+            names (list[str]): The module names of the extensions.
+        """
+        self.import_extensions(names)
+        for name in names:
+            start = time.perf_counter()
+            try:
+                self.client.load_extension(name)
+                logger.info(f"Loaded extension {name}")
+            except interactions.errors.ExtensionLoadException as e:
+                logger.exception(f"Failed to load extension {name}.", exc_info=e)
+                continue
+            self.timings[name]["__init__"] = time.perf_counter() - start
+        for extension in self.client.ext.values():
+            for listener in extension.listeners:
+                if listener.event == "startup":
+                    self._time_listener(extension.__module__, listener)
+        if self.pending == 0:
+            self.report()
+
+    def _time_listener(self, name: str, listener: interactions.Listener):
+        callback = listener.callback
+        self.pending += 1
+
+        @functools.wraps(callback)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings = self.timings[name]
+                timings["on_startup"] = timings.get("on_startup", 0) + elapsed
+                self.pending -= 1
+                if self.pending == 0:
+                    self.report()
+
+        listener.callback = timed
+
+    def report(self):
+        """
+        Logs the time spent by each extension in each stage of the startup.
+        """
+        table = prettytable.PrettyTable(
+            ["Extension", *(f"{stage} (ms)" for stage in STAGES)]
+        )
+        table.align["Extension"] = "l"
+        for name, timings in sorted(
+            self.timings.items(), key=lambda item: -sum(item[1].values())
+        ):
+            table.add_row(
+                [
+                    name,
+                    *(
+                        f"{timings[stage] * 1000:.0f}" if stage in timings else "-"
+                        for stage in STAGES
+                    ),
+                ]
+            )
+        logger.info(
+            "Startup finished in %.2f s\n%s", time.perf_counter() - self.started, table
+        )
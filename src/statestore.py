@@ -0,0 +1,294 @@
+"""
+This module provides the embedded key-value store holding the state of the bot.
+
+The state used to live in JSON files rewritten in full on every change, from the
+event loop and without atomicity, so a crash while writing corrupted them. It
+now lives in a single SQLite database in WAL mode: each key of a namespace is a
+row holding a JSON value, a change rewrites only the rows it touches, and every
+write is an atomic transaction run off the event loop.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+from src import logutil
+from src.configstore import config_store
+from src.lifecycle import on_shutdown
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID
+"""
+
+
+def read_legacy_json(path: str) -> dict:
+    """
+    Reads a JSON data file of the former storage, blocking.
+
+    Files written through the former append-only journal have their changes,
+    one JSON object per line in "<path>.journal", replayed over the snapshot.
+
+    Args:
+        path (str): The JSON file.
+
+    Returns:
+        dict: The content of the file.
+
+    Raises:
+        ValueError: If the snapshot is not valid JSON.
+    """
+    data = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    journal_path = f"{path}.journal"
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # Only the last line can be cut short, by a crash while appending
+                    break
+                *parents, key = change["path"]
+                target = data
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                if change["op"] == "set":
+                    target[key] = change["value"]
+                else:
+                    target.pop(key, None)
+    return data
+
+
+class StateStore:
+    """
+    Namespaced JSON values stored in SQLite, behind an asynchronous API.
+
+    Every operation runs on one dedicated thread, which owns the connection, so
+    they are serialized in the order they were awaited and never block the
+    event loop. Writes are atomic: update() applies all its changes or none.
+
+    Args:
+        path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="statestore"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Only ever called from the thread of the executor
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Durable across crashes of the bot, only a power loss can lose the
+            # last commits, and never leaves the database half-written
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(SCHEMA)
+            self._connection = connection
+            logger.info("State store opened at %s", self.path)
+        return self._connection
+
+    async def _run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _get(self, namespace: str, key: str) -> str | None:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def _items(self, namespace: str) -> list[tuple[str, str]]:
+        return (
+            self._connect()
+            .execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            )
+            .fetchall()
+        )
+
+    def _write(
+        self, namespace: str, values: list[tuple[str, str]], deleted: list[str]
+    ):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "DELETE FROM state WHERE namespace = ? AND key = ?",
+                [(namespace, key) for key in deleted],
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                [(namespace, key, value) for key, value in values],
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    async def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """
+        Returns the value of a key, or default if it is not set.
+
+        Args:
+            namespace (str): The namespace, usually named after its module.
+            key (str): The key within the namespace.
+            default (Any, optional): Returned when the key is not set.
+        """
+        value = await self._run(self._get, namespace, str(key))
+        return default if value is None else json.loads(value)
+
+    async def items(self, namespace: str) -> dict[str, Any]:
+        """
+        Returns every key of a namespace with its value.
+
+        Args:
+            namespace (str): The namespace.
+        """
+        rows = await self._run(self._items, namespace)
+        return {key: json.loads(value) for key, value in rows}
+
+    async def set(self, namespace: str, key: str, value: Any):
+        """
+        Sets the value of a key.
+
+        Args:
+            namespace (str): The namespace.
+            key (str): The key within the namespace.
+            value (Any): A JSON-serializable value.
+        """
+        await self.update(namespace, {key: value})
+
+    async def delete(self, namespace: str, key: str):
+        """
+        Deletes a key, if it is set.
+
+        Args:
+            namespace (str): The namespace.
+            key (str): The key within the namespace.
+        """
+        await self.update(namespace, deleted=[key])
+
+    async def update(
+        self,
+        namespace: str,
+        values: dict[str, Any] | None = None,
+        deleted: Iterable[str] = (),
+    ):
+        """
+        Sets and deletes several keys of a namespace in one atomic transaction.
+
+        Args:
+            namespace (str): The namespace.
+            values (dict[str, Any], optional): The keys to set, with their values.
+            deleted (Iterable[str], optional): The keys to delete.
+        """
+        # Serialized here, so a value modified once update() is awaited is not
+        # stored half-modified
+        encoded = [
+            (str(key), json.dumps(value)) for key, value in (values or {}).items()
+        ]
+        deleted = [str(key) for key in deleted]
+        if encoded or deleted:
+            await self._run(self._write, namespace, encoded, deleted)
+
+    async def migrate_json(
+        self,
+        namespace: str,
+        path: str,
+        select: Callable[[dict], dict] | None = None,
+    ) -> bool:
+        """
+        Imports a JSON data file into a namespace, once, then renames the file.
+
+        Each top-level key of the file becomes a key of the namespace. The file
+        may have been written through the former journal, see read_legacy_json.
+
+        Args:
+            namespace (str): The namespace to fill.
+            path (str): The JSON file, renamed to *.migrated once imported.
+            select (Callable[[dict], dict], optional): Picks the dictionary to
+                import from the content of the file.
+
+        Returns:
+            bool: Whether a file was imported.
+        """
+        journal_path = f"{path}.journal"
+        if not (os.path.exists(path) or os.path.exists(journal_path)):
+            return False
+        try:
+            data = await asyncio.to_thread(read_legacy_json, path)
+        except ValueError:
+            # Left in place, to be fixed by hand
+            logger.exception("%s is corrupted, not imported", path)
+            return False
+        if select is not None:
+            data = select(data)
+        await self.update(namespace, data)
+        for file_path in (path, journal_path):
+            if os.path.exists(file_path):
+                os.replace(file_path, f"{file_path}.migrated")
+        logger.info("%s keys of %s moved to %s", len(data), path, namespace)
+        return True
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def close(self):
+        """
+        Closes the database, once the pending operations are done.
+        """
+        await self._run(self._close)
+        self._executor.shutdown()
+
+
+_store: StateStore | None = None
+
+
+def get_state_store() -> StateStore:
+    """
+    Returns the state store shared by the extensions, creating it on first use.
+
+    Returns:
+        StateStore: The shared state store.
+    """
+    global _store
+    if _store is None:
+        config, _, _ = config_store.get()
+        _store = StateStore(f"{config['misc']['dataFolder']}/state.sqlite3")
+    return _store
+
+
+@on_shutdown
+async def close_state_store():
+    """
+    Closes the state store.
+    """
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -0,0 +1,329 @@
+"""
+This module provides the durable timers shared by the extensions.
+
+Every timer of the bot is kept in one min-heap of due times, and a single task
+sleeps until the earliest one instead of each extension polling its own list
+every minute. The timers are persisted in the state store, so they survive
+restarts, and the ones that came due while the bot was down fire on startup.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from dateutil.relativedelta import relativedelta
+
+from src import logutil
+from src.configstore import config_store
+from src.lifecycle import on_shutdown
+from src.statestore import StateStore, get_state_store
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+RECURRENCES = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "monthly": relativedelta(months=1),
+    "yearly": relativedelta(years=1),
+}
+
+
+def next_occurrence(due: datetime, every: str, now: datetime | None = None) -> datetime:
+    """
+    Returns the first occurrence of a recurring timer after now.
+
+    Args:
+        due (datetime): The last occurrence.
+        every (str): One of RECURRENCES.
+        now (datetime, optional): Defaults to the current time.
+
+    Returns:
+        datetime: The next occurrence, skipping the ones already past.
+    """
+    now = now or datetime.now()
+    step = RECURRENCES[every]
+    due += step
+    while due <= now:
+        due += step
+    return due
+
+
+class TimerService:
+    """
+    Durable timers, fired by a single task that sleeps until the next deadline.
+
+    A timer is a dictionary with a kind, a due time, an optional recurrence and
+    some data. When it is due, the handler registered for its kind is called
+    with it. A recurring timer moves to its next occurrence before its handler
+    runs; a one-shot timer is only deleted once its handler has returned, so it
+    fires again after a crash rather than never.
+
+    Cancelled and moved timers leave a stale entry in the heap, skipped when it
+    reaches the top, so every operation stays O(log n).
+
+    The timers are loaded from the store on first use.
+
+    Args:
+        store (StateStore): Persists the timers, one key per timer.
+        namespace (str): The namespace of the timers in the store.
+        legacy_path (str, optional): A JSON file of timers to import once.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        namespace: str = "timers",
+        legacy_path: str | None = None,
+    ):
+        self.store = store
+        self.namespace = namespace
+        self.legacy_path = legacy_path
+        self.timers: dict[str, dict] = {}
+        self.by_kind: dict[str, set[str]] = defaultdict(set)
+        # (timestamp, sequence, timer ID, due), the sequence breaks the ties
+        self.heap: list[tuple[float, int, str, str]] = []
+        self.handlers: dict[str, Callable[[dict], Awaitable]] = {}
+        # Due timers whose kind has no handler yet
+        self.parked: dict[str, list[str]] = defaultdict(list)
+        self.lock = asyncio.Lock()
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        # One-shot timers whose handler is running, by ID
+        self._firing: dict[str, dict] = {}
+        self._loaded = False
+
+    async def load(self):
+        """
+        Reads the timers from the store, if not already done.
+        """
+        async with self.lock:
+            if self._loaded:
+                return
+            if self.legacy_path is not None:
+                await self.store.migrate_json(self.namespace, self.legacy_path)
+            self.timers = await self.store.items(self.namespace)
+            for timer_id, timer in self.timers.items():
+                self.by_kind[timer["kind"]].add(timer_id)
+                self.heap.append(self._entry(timer_id, timer))
+            heapq.heapify(self.heap)
+            self._loaded = True
+        logger.info("%s timers loaded", len(self.timers))
+
+    def _entry(self, timer_id: str, timer: dict) -> tuple[float, int, str, str]:
+        due = datetime.strptime(timer["due"], TIME_FORMAT).timestamp()
+        return due, next(self._sequence), timer_id, timer["due"]
+
+    def _push(self, timer_id: str, timer: dict):
+        entry = self._entry(timer_id, timer)
+        if not self.heap or entry < self.heap[0]:
+            self._wakeup.set()
+        heapq.heappush(self.heap, entry)
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable]):
+        """
+        Sets the coroutine function called with the timers of a kind when they are due.
+
+        Register it once the state the handler needs is loaded: the timers that
+        came due before are held until then.
+
+        Args:
+            kind (str): The kind of timers.
+            handler (Callable[[dict], Awaitable]): Called with the timer.
+        """
+        self.handlers[kind] = handler
+        for timer_id in self.parked.pop(kind, []):
+            if timer_id in self.timers:
+                self._push(timer_id, self.timers[timer_id])
+
+    async def schedule(
+        self,
+        kind: str,
+        due: datetime,
+        data: dict | None = None,
+        every: str | None = None,
+        timer_id: str | None = None,
+    ) -> str:
+        """
+        Adds a timer, or replaces the one with the same ID.
+
+        Args:
+            kind (str): The kind of timer, which selects its handler.
+            due (datetime): When it fires, in local time, to the second.
+            data (dict, optional): JSON-serializable data passed to the handler.
+            every (str, optional): One of RECURRENCES for a recurring timer.
+            timer_id (str, optional): A stable ID, to make scheduling idempotent.
+
+        Returns:
+            str: The ID of the timer.
+        """
+        if every is not None and every not in RECURRENCES:
+            raise ValueError(f"Unknown recurrence {every}")
+        timer_id = timer_id or uuid.uuid4().hex
+        timer = {
+            "kind": kind,
+            "due": due.strftime(TIME_FORMAT),
+            "every": every,
+            "data": data or {},
+        }
+        await self.load()
+        async with self.lock:
+            previous = self.timers.get(timer_id)
+            if previous == timer:
+                # Already scheduled, another heap entry would fire it twice
+                return timer_id
+            if previous is not None:
+                self.by_kind[previous["kind"]].discard(timer_id)
+            self.timers[timer_id] = timer
+            self.by_kind[kind].add(timer_id)
+            await self.store.set(self.namespace, timer_id, timer)
+        self._push(timer_id, timer)
+        return timer_id
+
+    async def cancel(self, timer_id: str) -> bool:
+        """
+        Deletes a timer.
+
+        Returns:
+            bool: False if there was no such timer.
+        """
+        await self.load()
+        async with self.lock:
+            timer = self.timers.pop(timer_id, None)
+            if timer is None:
+                return False
+            self.by_kind[timer["kind"]].discard(timer_id)
+            await self.store.delete(self.namespace, timer_id)
+        return True
+
+    async def find(self, kind: str, **data) -> list[tuple[str, dict]]:
+        """
+        Returns the timers of a kind whose data contains the given values.
+
+        Args:
+            kind (str): The kind of timers.
+            **data: The values to match, e.g. user_id="123".
+
+        Returns:
+            list[tuple[str, dict]]: The IDs and timers, the earliest first.
+        """
+        await self.load()
+        found = [
+            (timer_id, self.timers[timer_id])
+            for timer_id in self.by_kind.get(kind, ())
+            if all(self.timers[timer_id]["data"].get(k) == v for k, v in data.items())
+        ]
+        return sorted(found, key=lambda item: item[1]["due"])
+
+    def start(self):
+        """
+        Starts firing the timers, if not already started.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        await self.load()
+        while True:
+            # Drop the entries of cancelled or moved timers
+            while self.heap:
+                _, _, timer_id, due = self.heap[0]
+                timer = self.timers.get(timer_id)
+                if (
+                    timer is not None
+                    and timer["due"] == due
+                    and self._firing.get(timer_id) is not timer
+                ):
+                    break
+                heapq.heappop(self.heap)
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                # Sleep until the deadline, or until an earlier timer is added
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            _, _, timer_id, _ = heapq.heappop(self.heap)
+            await self._fire(timer_id, self.timers[timer_id])
+
+    async def _fire(self, timer_id: str, timer: dict):
+        if timer["kind"] not in self.handlers:
+            self.parked[timer["kind"]].append(timer_id)
+            return
+        if timer["every"] is not None:
+            due = datetime.strptime(timer["due"], TIME_FORMAT)
+            await self.schedule(
+                timer["kind"],
+                next_occurrence(due, timer["every"]),
+                timer["data"],
+                timer["every"],
+                timer_id,
+            )
+        else:
+            # Until its handler returns, no other entry may fire it
+            self._firing[timer_id] = timer
+        task = asyncio.create_task(self._call(timer_id, timer))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _call(self, timer_id: str, timer: dict):
+        try:
+            await self.handlers[timer["kind"]](timer)
+        except Exception:
+            logger.exception("Timer %s (%s) failed", timer_id, timer["kind"])
+        if timer["every"] is None:
+            async with self.lock:
+                if self._firing.get(timer_id) is timer:
+                    del self._firing[timer_id]
+                # Unless it was rescheduled in the meantime
+                if self.timers.get(timer_id) is timer:
+                    del self.timers[timer_id]
+                    self.by_kind[timer["kind"]].discard(timer_id)
+                    await self.store.delete(self.namespace, timer_id)
+
+
+_service: TimerService | None = None
+
+
+def get_timers() -> TimerService:
+    """
+    Returns the timer service shared by the extensions, creating it on first use.
+
+    Returns:
+        TimerService: The shared timer service.
+    """
+    global _service
+    if _service is None:
+        config, _, _ = config_store.get()
+        _service = TimerService(
+            get_state_store(),
+            legacy_path=f"{config['misc']['dataFolder']}/timers.json",
+        )
+    return _service
+
+
+@on_shutdown
+def stop_timers():
+    """
+    Stops firing the timers.
+    """
+    if _service is not None:
+        _service.stop()
@@ -0,0 +1,37 @@
+"""
+This module provides the polling intervals used by the scheduler.
+"""
+
+
+class AdaptiveTrigger:
+    """
+    Polling interval that backs off exponentially while idle, and resets on activity.
+
+    It only holds the interval: SyncScheduler reads it after each check to
+    schedule the next one, so a change applies from the following check.
+
+    Args:
+        minimum (float): The shortest interval, in seconds, used right after activity.
+        maximum (float): The longest interval, in seconds.
+        factor (float): How much the interval grows after each idle check.
+    """
+
+    def __init__(self, minimum: float, maximum: float, factor: float = 2):
+        if not 0 < minimum <= maximum:
+            raise ValueError("The intervals must satisfy 0 < minimum <= maximum")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = minimum
+
+    def reset(self):
+        """
+        Goes back to the shortest interval, after some activity.
+        """
+        self.interval = self.minimum
+
+    def backoff(self):
+        """
+        Lengthens the interval, after a check that found nothing to do.
+        """
+        self.interval = min(self.interval * self.factor, self.maximum)
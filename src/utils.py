@@ -1,17 +1,17 @@
-import json
 import os
 import emoji
 import string
+import time
 import re
-from collections import defaultdict
 from io import BytesIO
 from typing import Tuple
 import asyncio
-from aiohttp import ClientSession, ClientError
-from interactions.api.events import MessageReactionAdd, MessageReactionRemove
+from aiohttp import ClientError
 from PIL import Image, ImageDraw, ImageFont
 
 from src import logutil
+from src.configstore import config_store
+from src.httpclient import RETRY_STATUSES, get_session, retry_delay
 
 logger = logutil.init_logger(os.path.basename(__file__))
 
@@ -100,116 +100,31 @@ def format_number(num):
         return str(num)
 
 
-name_cache = {}
-
-
 def escape_md(text):
     """Escape markdown special characters in the given text."""
     return re.sub(r"([_*\[\]()~`>#+\-=|{}.!])", r"\\\1", text)
 
 
-async def format_poll(event: MessageReactionAdd | MessageReactionRemove, config):
-    """
-    Formats a poll message by updating the description with the current vote counts and participants.
-
-    Args:
-        event (MessageReactionAdd | MessageReactionRemove): The event object representing the reaction add or remove event.
-
-    Returns:
-        Embed: The updated embed object with the formatted poll description.
-    """
-    message = event.message
-    embed = message.embeds[0]
-    options = embed.description.split("\n\n")
-    reactions = message.reactions
-
-    # Fetch all users at once and store them in a dictionary
-    reaction_users = defaultdict(list)
-    reaction_counts = defaultdict(int)
-    max_reaction_count = 0
-    for reaction in reactions:
-        users = [user for user in await reaction.users().flatten() if not user.bot]
-        reaction_users[str(reaction.emoji)] = users
-        reaction_counts[str(reaction.emoji)] = reaction.count - 1
-        if reaction.count > max_reaction_count:
-            max_reaction_count = reaction.count - 1
-
-    max_reaction_indices = [
-        i for i, count in reaction_counts.items() if count == max_reaction_count
-    ]
-    participant_count = len(
-        set(user.id for users in reaction_users.values() for user in users)
-        - {message.author.id}
-    )
-
-    description_list = []
-    for i, option in enumerate(options):
-        option = option.split(":", 1)[0].replace("**", "")
-        emoji = option.split(" ", 1)[0]
-
-        reaction_count = reaction_counts[emoji]
-        user_list = reaction_users[emoji]
-
-        user_names = []
-        for user in user_list:
-            user_name = user.display_name
-            user_id = str(user.id)
-            server_id = str(event.message.guild.id)
-            if server_id not in name_cache:
-                name_cache[server_id] = {}
-            if user_id not in name_cache[server_id]:
-                # If not in cache, compute it and store it in the cache
-                name_cache[server_id][user_id] = (
-                    config["discord2name"].get(server_id, {}).get(user_id, user_name)
-                )
-            user_name = name_cache[server_id][user_id]
-            user_names.append(user_name)
-        user_names_str = ", ".join(user_names)
-
-        description = f"{option}"
-        if reaction_count > 0:
-            description = (
-                f"**{option} : {reaction_count}/{participant_count} votes\n({user_names_str})**"
-                if emoji in max_reaction_indices
-                else f"{option} : **{reaction_count}/{participant_count} votes**\n({user_names_str})"
-            )
-
-        description_list.append(description)
-
-    embed.description = "\n\n".join(description_list)
-    return embed
-
-
 def load_config(module_name: str = None) -> Tuple[dict, dict, list[str]]:
     """
     Load the configuration for a specific module.
 
+    The configuration file is only parsed once, see src.configstore. The returned
+    dictionaries and list are live views, updated in place when the file changes.
+
     Args:
         module_name (str): The name of the module.
 
     Returns:
         A tuple containing the global configuration, the module-specific configuration, and the list of enabled servers.
     """
-    with open("config/config.json", "r", encoding="utf-8") as file:
-        data = json.load(file)
-    if module_name is None:
-        return data.get("config", {}), {}, []
-    enabled_servers = [
-        str(server_id)
-        for server_id, server_info in data["servers"].items()
-        if server_info.get(module_name, {}).get("enabled", False)
-    ]
-    module_config = {
-        server_id: server_info.get(module_name, {})
-        for server_id, server_info in data["servers"].items()
-        if str(server_id) in enabled_servers
-    }
-    config = data.get("config", {})
-    logger.info(
-        "Loaded config for module %s for servers %s",
-        module_name,
-        enabled_servers,
-    )
+    config, module_config, enabled_servers = config_store.get(module_name)
+    if module_name is not None:
+        logger.info(
+            "Loaded config for module %s for servers %s",
+            module_name,
+            enabled_servers,
+        )
     return config, module_config, enabled_servers
 
 
@@ -225,16 +140,7 @@ def save_config(
         module_config (dict): The module-specific configuration.
         enabled_servers (list[int]): The list of enabled servers.
     """
-    with open("config/config.json", "r", encoding="utf-8") as file:
-        data = json.load(file)
-    for server_id, server_info in data["servers"].items():
-        if str(server_id) in enabled_servers:
-            server_info[module_name] = module_config
-        else:
-            server_info[module_name] = {"enabled": False}
-    data["config"] = config
-    with open("config/config.json", "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=4)
+    config_store.save(module_name, config, module_config, enabled_servers)
     logger.info(
         "Saved config for module %s for servers %s",
         module_name,
@@ -289,26 +195,148 @@ def extract_answer(text):
 
 
 async def fetch(url, return_type="text", headers=None, params=None, retries=3, pause=1):
+    session = get_session()
     for i in range(retries):
         try:
-            async with ClientSession() as session:
-                async with session.get(url, headers=headers, params=params) as response:
-                    if response.status != 200:
-                        logger.error(f"Failed to fetch {url}: Status {response.status}")
-                        raise Exception(
-                            f"Failed to fetch {url}: Status {response.status}"
-                        )
-                    if return_type == "text":
-                        return await response.text()
-                    elif return_type == "json":
-                        return await response.json()
-                    else:
-                        raise ValueError(
-                            "Invalid return_type. Expected 'text' or 'json'."
-                        )
+            async with session.get(url, headers=headers, params=params) as response:
+                if response.status in RETRY_STATUSES and i < retries - 1:
+                    delay = retry_delay(i, pause, response.headers.get("Retry-After"))
+                    logger.warning(
+                        f"Failed to fetch {url}: Status {response.status}, retrying in {delay:.1f}s"
+                    )
+                elif response.status != 200:
+                    logger.error(f"Failed to fetch {url}: Status {response.status}")
+                    raise Exception(f"Failed to fetch {url}: Status {response.status}")
+                elif return_type == "text":
+                    return await response.text()
+                elif return_type == "json":
+                    return await response.json()
+                else:
+                    raise ValueError("Invalid return_type. Expected 'text' or 'json'.")
         except (ClientError, asyncio.TimeoutError) as e:
             logger.error(f"Error fetching {url}: {e}")
             if i == retries - 1:  # This was the last attempt
                 raise
-            else:
-                await asyncio.sleep(pause)
+            delay = retry_delay(i, pause)
+        # Outside of the response, so its connection goes back to the pool meanwhile
+        await asyncio.sleep(delay)
+
+
+class UserCache:
+    """
+    Cache of the users fetched from Discord, with a time to live.
+
+    Unknown users are fetched concurrently, with a bounded number of requests in flight.
+
+    Args:
+        bot (Client): The bot used to fetch the users.
+        ttl (float): Number of seconds a fetched user is kept.
+        concurrency (int): Maximum number of simultaneous fetches.
+    """
+
+    def __init__(self, bot, ttl: float = 3600, concurrency: int = 5):
+        self.bot = bot
+        self.ttl = ttl
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.users: dict[str, tuple[float, object]] = {}
+
+    async def fetch(self, user_id):
+        """
+        Returns a user from the cache, fetching it from Discord if needed.
+
+        Args:
+            user_id (str | int): The ID of the user.
+
+        Returns:
+            User | None: The user, or None if it does not exist anymore.
+        """
+        user_id = str(user_id)
+        cached = self.users.get(user_id)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        async with self.semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except Exception as e:
+                logger.warning("Failed to fetch user %s: %s", user_id, e)
+                return None
+        self.users[user_id] = (time.monotonic(), user)
+        return user
+
+    async def fetch_many(self, user_ids) -> dict:
+        """
+        Fetches several users concurrently.
+
+        Args:
+            user_ids (Iterable[str | int]): The IDs of the users.
+
+        Returns:
+            dict: The users (or None) indexed by their ID as a string.
+        """
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        users = await asyncio.gather(*(self.fetch(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, users))
+
+    def invalidate(self, user_id):
+        """
+        Removes a user from the cache.
+        """
+        self.users.pop(str(user_id), None)
+
+
+class Debouncer:
+    """
+    Coalesces calls to a coroutine function: it runs at most once per delay.
+
+    The function takes no argument and must read the latest state itself, so
+    the triggers received while it waits or runs are all served by the next run.
+
+    Args:
+        func (Callable[[], Awaitable]): The coroutine function to run.
+        delay (float): Number of seconds to wait after a trigger before running.
+    """
+
+    def __init__(self, func, delay: float = 2):
+        self.func = func
+        self.delay = delay
+        self.pending = False
+        self._sleeping = False
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def trigger(self):
+        """
+        Schedules a run, unless one is already scheduled.
+        """
+        self.pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while self.pending:
+            self._sleeping = True
+            await asyncio.sleep(self.delay)
+            self._sleeping = False
+            await self._run()
+
+    async def _run(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            self.pending = False
+            try:
+                await self.func()
+            except Exception as e:
+                logger.exception(
+                    "Debounced %s failed", self.func.__qualname__, exc_info=e
+                )
+
+    async def flush(self):
+        """
+        Runs the function now if a run is pending, after any run in progress.
+        """
+        if self._task is not None and self._sleeping:
+            self._task.cancel()
+            self._task = None
+            self._sleeping = False
+        await self._run()
@@ -0,0 +1,295 @@
+"""
+This module provides the in-memory XP store used by the XP extension.
+
+The whole XP collection of each enabled guild is kept in memory, so giving XP for
+a message never waits on MongoDB. Changed users are written back in batches.
+"""
+
+import asyncio
+import bisect
+import os
+from collections import defaultdict
+from datetime import datetime
+
+import pytz
+from interactions import Embed, Guild
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+from src import logutil
+from src.leveling import XP_CURVE
+from src.utils import UserCache, format_number
+
+logger = logutil.init_logger(os.path.basename(__file__))
+
+PERSISTED_FIELDS = ("xp", "time", "msg", "lvl")
+LEADERBOARD_PAGE_SIZE = 10
+
+
+class XpCache:
+    """
+    Write-behind cache of the users' XP, one dictionary per guild.
+
+    Args:
+        db (AsyncIOMotorDatabase): The database holding one collection per guild.
+        cooldown (float): Minimum number of seconds between two messages giving XP.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, cooldown: float = 60):
+        self.db = db
+        self.cooldown = cooldown
+        self.guilds: dict[str, dict[str, dict]] = {}
+        # Sorted (-xp, user_id) keys of each guild, used to find ranks by bisection
+        self.rankings: dict[str, list[tuple[int, str]]] = {}
+        # Incremented on every change, to know when a guild's ranking changed
+        self.versions: dict[str, int] = defaultdict(int)
+        self.dirty: dict[str, set[str]] = defaultdict(set)
+        self._load_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._flush_lock = asyncio.Lock()
+
+    async def load(self, guild_id: str):
+        """
+        Loads the XP of a guild from MongoDB, unless it is already in memory.
+
+        Args:
+            guild_id (str): The ID of the guild.
+        """
+        if guild_id in self.guilds:
+            return
+        async with self._load_locks[guild_id]:
+            if guild_id in self.guilds:
+                return
+            await self.db[guild_id].create_index([("xp", DESCENDING)])
+            users = {}
+            async for stats in self.db[guild_id].find():
+                for field in PERSISTED_FIELDS:
+                    stats.setdefault(field, 0)
+                users[stats["_id"]] = stats
+            self.guilds[guild_id] = users
+            self.rankings[guild_id] = sorted(
+                (-stats["xp"], user_id) for user_id, stats in users.items()
+            )
+            logger.info("Loaded XP of %s users for guild %s", len(users), guild_id)
+
+    def get(self, guild_id: str, user_id: str) -> dict | None:
+        """
+        Returns the stats of a user, or None if the user has no XP yet.
+        """
+        return self.guilds.get(guild_id, {}).get(user_id)
+
+    def add_message(
+        self, guild_id: str, user_id: str, timestamp: float, gain: int
+    ) -> dict | None:
+        """
+        Gives XP to a user for a message, unless the user is on cooldown.
+
+        Args:
+            guild_id (str): The ID of the guild, which must be loaded.
+            user_id (str): The ID of the user.
+            timestamp (float): The timestamp of the message.
+            gain (int): The XP to give.
+
+        Returns:
+            dict | None: The updated stats of the user, or None if on cooldown.
+        """
+        users = self.guilds[guild_id]
+        stats = users.get(user_id)
+        ranking = self.rankings[guild_id]
+        if stats is None:
+            stats = {"_id": user_id, "xp": gain, "time": timestamp, "msg": 1, "lvl": 0}
+            users[user_id] = stats
+            # New users have little XP, so they land near the end of the list
+            bisect.insort(ranking, (-stats["xp"], user_id))
+        else:
+            if timestamp - stats["time"] < self.cooldown:
+                return None
+            old = bisect.bisect_left(ranking, (-stats["xp"], user_id))
+            stats["xp"] += gain
+            stats["msg"] += 1
+            stats["time"] = timestamp
+            # XP only grows, so the user moves up past the users it overtook: only
+            # those are shifted, instead of the whole tail of the list twice
+            entry = (-stats["xp"], user_id)
+            new = bisect.bisect_left(ranking, entry, 0, old)
+            ranking[new + 1 : old + 1] = ranking[new:old]
+            ranking[new] = entry
+        self.dirty[guild_id].add(user_id)
+        self.versions[guild_id] += 1
+        return stats
+
+    def ranked(self, guild_id: str) -> list[dict]:
+        """
+        Returns the stats of every user of a loaded guild, by decreasing XP.
+        """
+        users = self.guilds[guild_id]
+        return [users[user_id] for _, user_id in self.rankings[guild_id]]
+
+    def rank(self, guild_id: str, user_id: str) -> int | None:
+        """
+        Returns the rank of a user in a loaded guild, users with the same XP sharing a rank.
+
+        Args:
+            guild_id (str): The ID of the guild.
+            user_id (str): The ID of the user.
+
+        Returns:
+            int | None: The rank, starting at 1, or None if the user has no XP yet.
+        """
+        stats = self.get(guild_id, user_id)
+        if stats is None:
+            return None
+        # Number of users with strictly more XP
+        return bisect.bisect_left(self.rankings[guild_id], (-stats["xp"],)) + 1
+
+    def set_level(self, guild_id: str, user_id: str, lvl: int):
+        """
+        Updates the stored level of a user.
+        """
+        self.guilds[guild_id][user_id]["lvl"] = lvl
+        self.dirty[guild_id].add(user_id)
+
+    async def flush(self):
+        """
+        Writes every changed user to MongoDB, with one bulk write per guild.
+
+        Users whose write failed stay dirty and are retried on the next flush.
+        """
+        async with self._flush_lock:
+            dirty, self.dirty = self.dirty, defaultdict(set)
+            for guild_id, user_ids in dirty.items():
+                users = self.guilds[guild_id]
+                operations = [
+                    UpdateOne(
+                        {"_id": user_id},
+                        {
+                            "$set": {
+                                field: users[user_id][field]
+                                for field in PERSISTED_FIELDS
+                            }
+                        },
+                        upsert=True,
+                    )
+                    for user_id in user_ids
+                ]
+                try:
+                    await self.db[guild_id].bulk_write(operations, ordered=False)
+                    logger.debug(
+                        "Flushed XP of %s users for guild %s", len(operations), guild_id
+                    )
+                except PyMongoError as e:
+                    logger.error("Failed to flush XP for guild %s: %s", guild_id, e)
+                    self.dirty[guild_id].update(user_ids)
+
+
+class LeaderboardSnapshot:
+    """
+    Rendered leaderboard pages of each guild, shared by /leaderboard and the pinned message.
+
+    Only the pages whose members or stats changed since the last render are rebuilt.
+
+    Args:
+        xp_cache (XpCache): The XP cache to render.
+        users (UserCache): The cache used to resolve the users who left the guild.
+    """
+
+    def __init__(self, xp_cache: XpCache, users: UserCache):
+        self.xp_cache = xp_cache
+        self.users = users
+        self.pages: dict[str, list[Embed]] = {}
+        self.page_keys: dict[str, list[tuple]] = {}
+        self.versions: dict[str, int] = {}
+
+    async def render(self, guild: Guild, refresh: bool = False) -> list[Embed]:
+        """
+        Returns the leaderboard pages of a guild, rebuilding the ones that changed.
+
+        Args:
+            guild (Guild): The guild.
+            refresh (bool): Whether to rebuild every page, to pick up new user names.
+
+        Returns:
+            list[Embed]: One embed per page.
+        """
+        guild_id = str(guild.id)
+        await self.xp_cache.load(guild_id)
+        version = self.xp_cache.versions[guild_id]
+        if not refresh and self.versions.get(guild_id) == version:
+            return self.pages[guild_id]
+
+        ranked = self.xp_cache.ranked(guild_id)
+        old_keys = [] if refresh else self.page_keys.get(guild_id, [])
+        old_pages = self.pages.get(guild_id, [])
+        chunks = [
+            ranked[start : start + LEADERBOARD_PAGE_SIZE]
+            for start in range(0, max(len(ranked), 1), LEADERBOARD_PAGE_SIZE)
+        ]
+        keys = [
+            tuple((stats["_id"], stats["xp"], stats["msg"]) for stats in chunk)
+            for chunk in chunks
+        ]
+        changed = [
+            index
+            for index, key in enumerate(keys)
+            if index >= len(old_keys) or old_keys[index] != key
+        ]
+        # Resolve the users of every changed page at once
+        unknown_ids = [
+            stats["_id"]
+            for index in changed
+            for stats in chunks[index]
+            if guild.get_member(stats["_id"]) is None
+        ]
+        users = await self.users.fetch_many(unknown_ids)
+
+        pages = []
+        for index, chunk in enumerate(chunks):
+            if index in changed:
+                pages.append(self._render_page(guild, index, chunk, users))
+            else:
+                pages.append(old_pages[index])
+        for index, page in enumerate(pages):
+            page.set_footer(f"Page {index + 1}/{len(pages)}")
+        logger.debug(
+            "Leaderboard of %s rendered (%s/%s pages rebuilt)",
+            guild.name,
+            len(changed),
+            len(pages),
+        )
+
+        self.pages[guild_id] = pages
+        self.page_keys[guild_id] = keys
+        self.versions[guild_id] = version
+        return pages
+
+    def _render_page(
+        self, guild: Guild, index: int, chunk: list[dict], users: dict
+    ) -> Embed:
+        embed = Embed(
+            title=(
+                f"Classement de {guild.name}"
+                if index == 0
+                else f"Classement de {guild.name} (cont.)"
+            ),
+            color=0x00FF00,
+            timestamp=datetime.now(pytz.timezone("Europe/Paris")),
+        )
+        for position, stats in enumerate(chunk, index * LEADERBOARD_PAGE_SIZE):
+            member = guild.get_member(stats["_id"]) or users.get(stats["_id"])
+            if member is None:
+                name = "Utilisateur inconnu"
+            else:
+                name = f"{member.display_name} ({member.username})"
+            lvl, xp_in_level, xp_max = XP_CURVE.level(stats["xp"])
+            if position < 3:
+                text = ["🥇", "🥈", "🥉"][position]
+            else:
+                text = f"{position+1} -"
+
+            percentage = f"({(xp_in_level/xp_max*100):.0f}"
+            embed.add_field(
+                name=f"{text} {name}",
+                value=f"`Niveau {str(lvl).rjust(2)} {percentage.rjust(3)} %) | XP : {str(format_number(stats['xp']).rjust(7))} | {str(format_number(stats['msg'])).rjust(5)} messages`",
+                inline=False,
+            )
+        return embed
@@ -0,0 +1,100 @@
+import asyncio
+import copy
+import random
+
+from pymongo.errors import DuplicateKeyError
+
+from src.playlist import VOTE_OPTIONS, SongVote
+from src.utils import Debouncer
+
+
+class FakeVotes:
+    """
+    The subset of a motor collection used by SongVote, yielding to the event loop
+    inside every operation so concurrent votes interleave.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query, projection=None):
+        await asyncio.sleep(0)
+        document = self.documents.get(query["_id"])
+        return copy.deepcopy(document)
+
+    async def find_one_and_update(
+        self, query, update, projection=None, upsert=False, return_document=None
+    ):
+        await asyncio.sleep(0)
+        document = self.documents.get(query["_id"])
+        if document is None and upsert:
+            document = {"_id": query["_id"], "votes": {}, "counts": {}}
+        if document is None or not self._matches(document, query):
+            if upsert and query["_id"] in self.documents:
+                raise DuplicateKeyError("E11000 duplicate key error")
+            return None
+        for key, value in update.get("$inc", {}).items():
+            option = key.split(".", 1)[1]
+            document.setdefault("counts", {})
+            document["counts"][option] = document["counts"].get(option, 0) + value
+        for key, value in update.get("$set", {}).items():
+            document["votes"][key.split(".", 1)[1]] = value
+        for key in update.get("$unset", {}):
+            document["votes"].pop(key.split(".", 1)[1], None)
+        self.documents[query["_id"]] = document
+        return copy.deepcopy(document)
+
+    @staticmethod
+    def _matches(document, query):
+        for key, expected in query.items():
+            if key == "_id":
+                continue
+            if key == "counts":
+                if "counts" in document:
+                    return False
+                continue
+            user_id = key.split(".", 1)[1]
+            if expected == {"$exists": False}:
+                if user_id in document["votes"]:
+                    return False
+            elif document["votes"].get(user_id) != expected:
+                return False
+        return True
+
+
+def test_concurrent_votes_keep_the_counts_exact():
+    async def run():
+        collection = FakeVotes()
+        song_vote = SongVote(collection, "track")
+        renders = []
+
+        async def render():
+            renders.append(dict(song_vote.counts))
+
+        debouncer = Debouncer(render, delay=0.05)
+        rng = random.Random(0)
+
+        async def voter(user_id):
+            for _ in range(5):
+                option = rng.choice(VOTE_OPTIONS + (None,))
+                if await song_vote.vote(user_id, option, retries=20):
+                    debouncer.trigger()
+
+        # Two clicks in flight for each user, so their votes conflict
+        await asyncio.gather(
+            *(voter(str(user_id)) for user_id in range(40) for _ in range(2))
+        )
+        await debouncer.flush()
+        document = collection.documents["track"]
+        expected = dict.fromkeys(VOTE_OPTIONS, 0)
+        for option in document["votes"].values():
+            expected[option] += 1
+        counts = {option: document["counts"].get(option, 0) for option in VOTE_OPTIONS}
+        return expected, counts, song_vote.counts, renders
+
+    expected, counts, loaded, renders = asyncio.run(run())
+    assert counts == expected
+    assert loaded == expected
+    # Coalesced into a few edits, the last one showing the final votes
+    assert 0 < len(renders) < 10
+    assert renders[-1] == expected
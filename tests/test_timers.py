@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from src.statestore import StateStore
+from src.timers import TimerService
+
+
+async def fire_after_schedules(path, schedules: int) -> int:
+    store = StateStore(path)
+    timers = TimerService(store)
+    calls = 0
+
+    async def handler(timer):
+        nonlocal calls
+        calls += 1
+        # Still running when the other heap entries come up
+        await asyncio.sleep(0.1)
+
+    timers.register("test", handler)
+    due = datetime.now() - timedelta(seconds=1)
+    for _ in range(schedules):
+        await timers.schedule("test", due, {"n": 1}, timer_id="same")
+    timers.start()
+    await asyncio.sleep(0.3)
+    timers.stop()
+    remaining = await store.items("timers")
+    await store.close()
+    assert remaining == {}
+    return calls
+
+
+def test_same_timer_scheduled_twice_fires_once(tmp_path):
+    assert asyncio.run(fire_after_schedules(f"{tmp_path}/state.sqlite3", 2)) == 1
+
+
+def test_reloaded_timer_scheduled_again_fires_once(tmp_path):
+    path = f"{tmp_path}/state.sqlite3"
+
+    async def run() -> int:
+        store = StateStore(path)
+        due = datetime.now() - timedelta(seconds=1)
+        await TimerService(store).schedule("test", due, {"n": 1}, timer_id="same")
+        await store.close()
+        # Loaded from the store, then scheduled again as on startup
+        return await fire_after_schedules(path, 1)
+
+    assert asyncio.run(run()) == 1